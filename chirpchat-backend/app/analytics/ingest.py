@@ -0,0 +1,201 @@
+
+import asyncio
+import json
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from postgrest.exceptions import APIError
+
+from app.analytics.schemas import FileAnalyticsCreate, MoodAnalyticsContext
+from app.database import db_manager
+from app.redis_client import get_redis_client
+from app.utils.logging import logger
+
+# Analytics events are client telemetry; nobody waits on them being stored. They are collected in
+# memory and written with one multi-row insert per table, either when a table's buffer reaches
+# ANALYTICS_FLUSH_SIZE or every ANALYTICS_FLUSH_INTERVAL_SECONDS. Rows that can't be written are
+# spilled to a Redis list and retried on later flushes. A batch the database rejects (a constraint or
+# type error in some row) is split in half until the offending rows are isolated; those go to a
+# dead-letter list instead of blocking the rest of the buffer and the spill replay forever.
+ANALYTICS_FLUSH_SIZE = 200
+ANALYTICS_FLUSH_INTERVAL_SECONDS = 5
+ANALYTICS_BUFFER_MAX_ROWS = 10_000 # Per table; beyond this (DB and Redis both down) new rows are dropped.
+ANALYTICS_SPILL_KEY_PREFIX = "analytics_spill:"
+ANALYTICS_SPILL_REPLAY_SIZE = 500
+ANALYTICS_DEAD_LETTER_KEY_PREFIX = "analytics_dead_letter:"
+ANALYTICS_DEAD_LETTER_MAX_ROWS = 10_000 # Per table; the oldest entries are trimmed beyond this.
+# SQLSTATE classes meaning the rows themselves are bad (22: data exception, 23: integrity constraint
+# violation). Anything else (connection errors, timeouts, 5xx) is an outage and the rows are spilled.
+REJECTED_SQLSTATE_CLASSES = ("22", "23")
+ANALYTICS_TABLES = ("file_analytics", "mood_analytics")
+
+def is_rejection(error: Exception) -> bool:
+    return isinstance(error, APIError) and (error.code or "")[:2] in REJECTED_SQLSTATE_CLASSES
+
+def file_analytics_row(user_id: UUID, payload: FileAnalyticsCreate) -> Dict[str, Any]:
+    return {
+        "user_id": str(user_id),
+        "message_id": str(payload.message_id),
+        "upload_duration_seconds": payload.upload_duration_seconds,
+        "file_size_bytes": payload.file_size_bytes,
+        "compressed_size_bytes": payload.compressed_size_bytes,
+        "network_quality": payload.network_quality,
+        "file_type": payload.file_type,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+def mood_analytics_row(user_id: UUID, mood_name: str, mood_emoji: Optional[str], context: MoodAnalyticsContext, created_at: Optional[datetime] = None) -> Dict[str, Any]:
+    # Outcome fields (partner_response_time etc.) are left to their column defaults and filled in later.
+    return {
+        "user_id": str(user_id),
+        "partner_id": str(context.partner_id) if context.partner_id else None,
+        "mood_name": mood_name,
+        "mood_emoji": mood_emoji,
+        "source": context.source,
+        "context": context.model_dump_json(),
+        "created_at": (created_at or datetime.now(timezone.utc)).isoformat(),
+    }
+
+class AnalyticsBuffer:
+    def __init__(self):
+        self._rows: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._flush_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._pending_flushes: set = set()
+        self._flush_tasks: set = set() # The event loop only keeps weak references to tasks.
+        self.flushed_rows = 0
+        self.spilled_rows = 0
+        self.dropped_rows = 0
+        self.dead_lettered_rows = 0
+        self.failed_flushes = 0
+        self.last_flush_ms: Optional[float] = None
+        self.max_flush_ms = 0.0
+
+    def add(self, table: str, rows: List[Dict[str, Any]]):
+        buffered = self._rows[table]
+        room = ANALYTICS_BUFFER_MAX_ROWS - len(buffered)
+        if room < len(rows):
+            self.dropped_rows += len(rows) - max(room, 0)
+            logger.warning(f"Analytics buffer for {table} is full; dropping {len(rows) - max(room, 0)} rows.")
+            rows = rows[:max(room, 0)]
+        buffered.extend(rows)
+        if len(buffered) >= ANALYTICS_FLUSH_SIZE and table not in self._pending_flushes:
+            self._pending_flushes.add(table)
+            task = asyncio.create_task(self.flush(table))
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+
+    async def _spill(self, table: str, rows: List[Dict[str, Any]]):
+        try:
+            redis = await get_redis_client()
+            await redis.rpush(ANALYTICS_SPILL_KEY_PREFIX + table, *[json.dumps(row) for row in rows])
+            self.spilled_rows += len(rows)
+        except Exception as e:
+            # Redis is unavailable too; keep the rows in memory for the next flush.
+            logger.error(f"Could not spill {len(rows)} {table} rows to Redis: {e}")
+            self._rows[table][:0] = rows[:ANALYTICS_BUFFER_MAX_ROWS]
+
+    async def _dead_letter(self, table: str, row: Dict[str, Any], error: Exception):
+        logger.warning(f"Database rejected a {table} row; moving it to the dead-letter list: {error}")
+        entry = json.dumps({"row": row, "error": str(error), "failed_at": datetime.now(timezone.utc).isoformat()})
+        try:
+            redis = await get_redis_client()
+            await redis.rpush(ANALYTICS_DEAD_LETTER_KEY_PREFIX + table, entry)
+            await redis.ltrim(ANALYTICS_DEAD_LETTER_KEY_PREFIX + table, -ANALYTICS_DEAD_LETTER_MAX_ROWS, -1)
+            self.dead_lettered_rows += 1
+        except Exception as e:
+            logger.error(f"Could not dead-letter {table} row, dropping it: {e}. Row: {entry}")
+            self.dropped_rows += 1
+
+    async def _insert(self, table: str, rows: List[Dict[str, Any]]):
+        started_at = time.perf_counter()
+        await db_manager.admin_client.table(table).insert(rows).execute()
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        self.last_flush_ms = round(elapsed_ms, 1)
+        self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+        self.flushed_rows += len(rows)
+
+    async def _write(self, table: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Inserts rows, splitting a rejected batch in half until each bad row is isolated and dead-lettered.
+        Returns the rows that were not written because the database could not be reached.
+        """
+        try:
+            await self._insert(table, rows)
+            return []
+        except Exception as e:
+            if not is_rejection(e):
+                self.failed_flushes += 1
+                logger.error(f"Could not insert {len(rows)} {table} rows: {e}")
+                return rows
+            if len(rows) == 1:
+                await self._dead_letter(table, rows[0], e)
+                return []
+        middle = len(rows) // 2
+        unwritten = await self._write(table, rows[:middle])
+        if unwritten: return unwritten + rows[middle:]
+        return await self._write(table, rows[middle:])
+
+    async def _replay_spill(self, table: str):
+        redis = await get_redis_client()
+        # LPOP with a count is atomic, so two instances never replay the same rows.
+        spilled = await redis.lpop(ANALYTICS_SPILL_KEY_PREFIX + table, ANALYTICS_SPILL_REPLAY_SIZE)
+        if not spilled: return
+        unwritten = await self._write(table, [json.loads(row) for row in spilled])
+        if unwritten:
+            await redis.lpush(ANALYTICS_SPILL_KEY_PREFIX + table, *[json.dumps(row) for row in reversed(unwritten)])
+        else:
+            logger.info(f"Replayed {len(spilled)} spilled {table} rows.")
+
+    async def flush(self, table: str):
+        async with self._flush_locks[table]:
+            self._pending_flushes.discard(table)
+            rows, self._rows[table] = self._rows[table], []
+            for i in range(0, len(rows), ANALYTICS_FLUSH_SIZE):
+                unwritten = await self._write(table, rows[i:i + ANALYTICS_FLUSH_SIZE])
+                if unwritten:
+                    await self._spill(table, unwritten + rows[i + ANALYTICS_FLUSH_SIZE:])
+                    return
+            try:
+                await self._replay_spill(table)
+            except Exception as e:
+                logger.warning(f"Could not replay spilled {table} rows: {e}")
+
+    async def flush_all(self):
+        for table in ANALYTICS_TABLES: await self.flush(table)
+
+    async def run(self):
+        """Periodically flushes every table; intended to be launched once at app startup."""
+        logger.info("Analytics buffer flusher starting.")
+        while True:
+            try:
+                await asyncio.sleep(ANALYTICS_FLUSH_INTERVAL_SECONDS)
+                await self.flush_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in analytics buffer flusher: {e}", exc_info=True)
+
+    async def stats(self) -> Dict[str, Any]:
+        try:
+            redis = await get_redis_client()
+            spill_depth = {table: await redis.llen(ANALYTICS_SPILL_KEY_PREFIX + table) for table in ANALYTICS_TABLES}
+            dead_letter_depth = {table: await redis.llen(ANALYTICS_DEAD_LETTER_KEY_PREFIX + table) for table in ANALYTICS_TABLES}
+        except Exception:
+            spill_depth, dead_letter_depth = {}, {}
+        return {
+            "buffer_depth": {table: len(self._rows[table]) for table in ANALYTICS_TABLES},
+            "spill_depth": spill_depth,
+            "dead_letter_depth": dead_letter_depth,
+            "flushed_rows": self.flushed_rows,
+            "spilled_rows": self.spilled_rows,
+            "dropped_rows": self.dropped_rows,
+            "dead_lettered_rows": self.dead_lettered_rows,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms,
+        }
+
+analytics_buffer = AnalyticsBuffer()
@@ -0,0 +1,44 @@
+
+import asyncio
+import time
+
+from app.database import db_manager
+from app.utils.logging import logger
+
+# Fills in the outcome fields of mood_analytics (partner_response_time, partner_reaction,
+# conversation_started, mood_reciprocated) once each event's window has closed. The work lives in the
+# compute_mood_outcomes RPC (migrations 010 and 015), which picks events whose outcomes are still
+# unset, so rows that reach the table late are processed too; this loop only drives it.
+MOOD_OUTCOME_WINDOW_SECONDS = 6 * 60 * 60
+MOOD_OUTCOME_BATCH_SIZE = 1000
+MOOD_OUTCOME_POLL_INTERVAL_SECONDS = 60
+
+async def compute_mood_outcome_batch(batch_size: int = MOOD_OUTCOME_BATCH_SIZE) -> int:
+    """Processes the oldest events still waiting for outcomes. Returns how many mood events were processed."""
+    resp = await db_manager.admin_client.rpc("compute_mood_outcomes", {"p_batch_size": batch_size, "p_window_seconds": MOOD_OUTCOME_WINDOW_SECONDS}).execute()
+    return resp.data or 0
+
+async def drain_mood_outcomes() -> int:
+    """Runs batches until the job has caught up, logging throughput. Doubles as the backfill for existing events."""
+    started_at = time.perf_counter()
+    total = 0
+    while True:
+        processed = await compute_mood_outcome_batch()
+        total += processed
+        if processed < MOOD_OUTCOME_BATCH_SIZE: break
+    if total:
+        elapsed = time.perf_counter() - started_at
+        logger.info(f"Computed mood outcomes for {total} events in {elapsed:.1f}s ({total / elapsed:.0f} events/s).")
+    return total
+
+async def run_mood_outcome_worker():
+    """Keeps mood outcomes up to date; intended to be launched at app startup."""
+    logger.info("Mood outcome worker starting.")
+    while True:
+        try:
+            await drain_mood_outcomes()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in mood outcome worker: {e}", exc_info=True)
+        await asyncio.sleep(MOOD_OUTCOME_POLL_INTERVAL_SECONDS)
@@ -1,7 +1,7 @@
 
 
 from pydantic import BaseModel, Field
-from typing import Optional, Literal
+from typing import Dict, List, Optional, Literal
 from uuid import UUID
 
 class FileAnalyticsCreate(BaseModel):
@@ -23,3 +23,21 @@ class MoodAnalyticsCreate(BaseModel):
     mood_name: str = Field(..., max_length=50)
     mood_emoji: Optional[str] = None
     context: MoodAnalyticsContext
+
+MAX_ANALYTICS_BATCH_SIZE = 500
+
+class AnalyticsBatchCreate(BaseModel):
+    file_events: List[FileAnalyticsCreate] = Field(default_factory=list, max_length=MAX_ANALYTICS_BATCH_SIZE)
+    mood_events: List[MoodAnalyticsCreate] = Field(default_factory=list, max_length=MAX_ANALYTICS_BATCH_SIZE)
+
+class AnalyticsBufferStats(BaseModel):
+    buffer_depth: Dict[str, int]
+    spill_depth: Dict[str, int]
+    dead_letter_depth: Dict[str, int]
+    flushed_rows: int
+    spilled_rows: int
+    dropped_rows: int
+    dead_lettered_rows: int
+    failed_flushes: int
+    last_flush_ms: Optional[float] = None
+    max_flush_ms: float
@@ -1,78 +1,43 @@
 
+import asyncio
 from uuid import UUID
 from datetime import datetime, timedelta, timezone
-from collections import Counter
 
 from app.database import db_manager
 from app.utils.logging import logger
 from postgrest.exceptions import APIError
 
+# Mood counts come from the mood_daily_counts rollup (migration 008), which a trigger on
+# mood_analytics keeps current. Reading top-k from it costs the same no matter how many events a user has.
+MOOD_ROLLUP_RETENTION_DAYS = 90 # The longest window any suggestion reads.
+MOOD_ROLLUP_PRUNE_INTERVAL_SECONDS = 6 * 60 * 60
+
+async def _get_top_moods(user_id: UUID, count: int, days_ago: int) -> list:
+    since = (datetime.now(timezone.utc) - timedelta(days=days_ago)).date()
+    response = await db_manager.admin_client.rpc("get_top_moods", {"p_user_id": str(user_id), "p_since": since.isoformat(), "p_limit": count}).execute()
+    return [
+        {"id": item["mood_name"], "emoji": item.get("mood_emoji") or '❓', "label": item["mood_name"]}
+        for item in response.data or []
+    ]
+
 async def get_frequently_used_moods(user_id: UUID, count: int = 5, days_ago: int = 90) -> list:
     """
-    Analyzes mood usage for a user and returns their most frequent moods.
+    Returns the user's most frequent moods over the last `days_ago` days.
     """
     try:
-        time_cutoff = datetime.now(timezone.utc) - timedelta(days=days_ago)
-        
-        response = await db_manager.admin_client.table("mood_analytics").select(
-            "mood_name, mood_emoji"
-        ).eq("user_id", str(user_id)).gte(
-            "created_at", time_cutoff.isoformat()
-        ).execute()
-        
-        if not response.data:
-            return []
-            
-        # Use a counter to get frequencies of (mood_name, mood_emoji) tuples
-        mood_counter = Counter(
-            (item['mood_name'], item.get('mood_emoji')) for item in response.data if item.get('mood_name')
-        )
-        
-        most_common_moods = mood_counter.most_common(count)
-        
-        suggestions = [
-            {"id": mood_name, "emoji": mood_emoji or '❓', "label": mood_name} 
-            for (mood_name, mood_emoji), freq in most_common_moods
-        ]
-        
-        return suggestions
-        
+        return await _get_top_moods(user_id, count, days_ago)
     except Exception as e:
         logger.error(f"Error getting suggested moods for user {user_id}: {e}", exc_info=True)
         return []
 
 async def get_partner_influenced_mood_suggestions(partner_id: UUID, count: int = 5, days_ago: int = 30) -> list:
     """
-    Analyzes mood usage for a user's partner and returns their most frequent moods.
+    Returns the partner's most frequent moods (moods sent BY the partner) over the last `days_ago` days.
     """
     if not partner_id:
         return []
     try:
-        time_cutoff = datetime.now(timezone.utc) - timedelta(days=days_ago)
-        
-        # Query for moods sent BY THE PARTNER.
-        response = await db_manager.admin_client.table("mood_analytics").select(
-            "mood_name, mood_emoji"
-        ).eq("user_id", str(partner_id)).gte( # The user_id is the partner because they are the sender
-            "created_at", time_cutoff.isoformat()
-        ).execute()
-        
-        if not response.data:
-            return []
-            
-        mood_counter = Counter(
-            (item['mood_name'], item.get('mood_emoji')) for item in response.data if item.get('mood_name')
-        )
-        
-        most_common_moods = mood_counter.most_common(count)
-        
-        suggestions = [
-            {"id": mood_name, "emoji": mood_emoji or '❓', "label": mood_name} 
-            for (mood_name, mood_emoji), freq in most_common_moods
-        ]
-        
-        return suggestions
-        
+        return await _get_top_moods(partner_id, count, days_ago)
     except APIError as e:
         logger.error(f"Error getting partner suggested moods for partner {partner_id}: {e.message}", exc_info=True)
         return []
@@ -80,6 +45,25 @@ async def get_partner_influenced_mood_suggestions(partner_id: UUID, count: int =
         logger.error(f"Unexpected error in get_partner_influenced_mood_suggestions for partner {partner_id}: {e}", exc_info=True)
         return []
 
+async def rebuild_mood_rollups(days_ago: int = MOOD_ROLLUP_RETENTION_DAYS) -> int:
+    """Backfill: recomputes the rollup for the last `days_ago` days from mood_analytics. Safe to re-run; exposed as POST /analytics/moods/rollups/rebuild."""
+    since = (datetime.now(timezone.utc) - timedelta(days=days_ago)).date()
+    response = await db_manager.admin_client.rpc("rebuild_mood_daily_counts", {"p_since": since.isoformat()}).execute()
+    logger.info(f"Rebuilt mood rollups since {since}: {response.data} day buckets.")
+    return response.data or 0
+
+async def run_rollup_maintenance():
+    """Drops rollup days older than any suggestion window; intended to be launched at app startup."""
+    while True:
+        try:
+            response = await db_manager.admin_client.rpc("prune_mood_daily_counts", {"p_keep_days": MOOD_ROLLUP_RETENTION_DAYS}).execute()
+            if response.data: logger.info(f"Pruned {response.data} expired mood rollup rows.")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error pruning mood rollups: {e}", exc_info=True)
+        await asyncio.sleep(MOOD_ROLLUP_PRUNE_INTERVAL_SECONDS)
+
 class AnalyticsService:
     async def get_frequently_used_moods(self, user_id: UUID, count: int = 5, days_ago: int = 90) -> list:
         return await get_frequently_used_moods(user_id, count, days_ago)
@@ -127,3 +127,9 @@ async def get_user_from_refresh_token(token: str = Depends(oauth2_scheme)) -> Us
 
 async def get_current_active_user(current_user: UserPublic = Depends(get_current_user)) -> UserPublic:
     return current_user
+
+async def get_current_admin_user(current_user: UserPublic = Depends(get_current_user)) -> UserPublic:
+    admin_ids = {user_id.strip() for user_id in settings.ADMIN_USER_IDS.split(",") if user_id.strip()}
+    if str(current_user.id) not in admin_ids:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required.")
+    return current_user
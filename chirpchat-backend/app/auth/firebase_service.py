@@ -1,12 +1,56 @@
+import asyncio
+import hashlib
+import re
+import time
 import firebase_admin
+import requests
 from firebase_admin import credentials, auth
+from jose import jwt
 from app.config import settings
+from app.utils.cache import ExpiringCache
 from app.utils.logging import logger
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
+
+# Google rotates the ID token signing keys every few hours and publishes them with a Cache-Control
+# max-age. Keys are refreshed in the background shortly before that runs out, so no login waits on it.
+CERTS_FETCH_TIMEOUT_SECONDS = 10
+CERTS_DEFAULT_MAX_AGE_SECONDS = 60 * 60
+CERTS_REFRESH_MARGIN_SECONDS = 5 * 60
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+TOKEN_ISSUER_PREFIX = "https://securetoken.google.com/"
+
+# sha256(ID token) -> decoded claims, kept for FIREBASE_TOKEN_MEMO_TTL_SECONDS at most, and never past the token's exp.
+verified_token_cache = ExpiringCache(max_entries=10_000)
+
+class UnknownSigningKey(Exception):
+    pass
+
+def fetch_signing_keys(url: str) -> Tuple[Dict[str, str], float]:
+    """Returns the {kid: PEM certificate} map and the epoch time the response may be cached until."""
+    response = requests.get(url, timeout=CERTS_FETCH_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    max_age = MAX_AGE_PATTERN.search(response.headers.get("Cache-Control", ""))
+    return response.json(), time.time() + (int(max_age.group(1)) if max_age else CERTS_DEFAULT_MAX_AGE_SECONDS)
+
+def decode_id_token(id_token: str, signing_keys: Dict[str, str], project_id: str) -> Dict[str, Any]:
+    """Checks the same claims as firebase_admin.auth.verify_id_token (without revocation) and returns them with 'uid' set."""
+    header = jwt.get_unverified_header(id_token)
+    certificate = signing_keys.get(header.get("kid"))
+    if certificate is None: raise UnknownSigningKey(f"No signing key with kid {header.get('kid')!r}")
+    claims = jwt.decode(id_token, certificate, algorithms=["RS256"], audience=project_id, issuer=TOKEN_ISSUER_PREFIX + project_id, options={"verify_at_hash": False})
+    subject = claims.get("sub")
+    if not isinstance(subject, str) or not subject or len(subject) > 128: raise ValueError("Token has an invalid subject")
+    if claims.get("auth_time", 0) > time.time(): raise ValueError("Token auth_time is in the future")
+    claims["uid"] = subject
+    return claims
 
 class FirebaseService:
     def __init__(self):
         self._initialized = False
+        self._signing_keys: Dict[str, str] = {}
+        self._signing_keys_expire_at = 0.0
+        self._signing_keys_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
         self._initialize_firebase()
     
     def _initialize_firebase(self):
@@ -43,28 +87,64 @@ class FirebaseService:
             logger.error(f"Failed to initialize Firebase Admin SDK: {e}")
             self._initialized = False
     
-    def verify_id_token(self, id_token: str) -> Optional[Dict[str, Any]]:
+    async def _refresh_signing_keys(self, force: bool = False):
+        async with self._signing_keys_lock:
+            # Another caller may have refreshed while this one waited for the lock.
+            if not force and self._signing_keys_expire_at - time.time() > CERTS_REFRESH_MARGIN_SECONDS: return
+            self._signing_keys, self._signing_keys_expire_at = await asyncio.to_thread(fetch_signing_keys, settings.FIREBASE_ID_TOKEN_CERT_URL)
+            logger.info(f"Fetched {len(self._signing_keys)} Firebase signing keys, cacheable for {self._signing_keys_expire_at - time.time():.0f}s.")
+
+    def _schedule_key_refresh(self):
+        if self._refresh_task and not self._refresh_task.done(): return
+        async def refresh():
+            try:
+                await self._refresh_signing_keys()
+            except Exception as e:
+                logger.warning(f"Background refresh of Firebase signing keys failed: {e}")
+        self._refresh_task = asyncio.create_task(refresh())
+
+    async def _get_signing_keys(self) -> Dict[str, str]:
+        remaining = self._signing_keys_expire_at - time.time()
+        if remaining <= 0:
+            await self._refresh_signing_keys()
+        elif remaining <= CERTS_REFRESH_MARGIN_SECONDS:
+            self._schedule_key_refresh()
+        return self._signing_keys
+
+    async def verify_id_token(self, id_token: str) -> Optional[Dict[str, Any]]:
         """Verify Firebase ID token and return decoded token data"""
         if not self._initialized:
             logger.error("Firebase not initialized. Cannot verify token.")
             return None
-            
+
+        token_hash = hashlib.sha256(id_token.encode()).hexdigest()
+        cached = verified_token_cache.get(token_hash)
+        if cached is not None:
+            return dict(cached)
+
         try:
-            decoded_token = auth.verify_id_token(id_token)
+            signing_keys = await self._get_signing_keys()
+            try:
+                decoded_token = await asyncio.to_thread(decode_id_token, id_token, signing_keys, settings.FIREBASE_PROJECT_ID)
+            except UnknownSigningKey:
+                # Tokens signed with a key published after our last fetch; refetch once.
+                await self._refresh_signing_keys(force=True)
+                decoded_token = await asyncio.to_thread(decode_id_token, id_token, self._signing_keys, settings.FIREBASE_PROJECT_ID)
             logger.info(f"Firebase token verified for user: {decoded_token.get('uid')}")
-            return decoded_token
+            verified_token_cache.set(token_hash, decoded_token, min(decoded_token["exp"], time.time() + settings.FIREBASE_TOKEN_MEMO_TTL_SECONDS))
+            return dict(decoded_token)
         except Exception as e:
             logger.error(f"Failed to verify Firebase token: {e}")
             return None
     
-    def get_user_by_uid(self, uid: str) -> Optional[Dict[str, Any]]:
+    async def get_user_by_uid(self, uid: str) -> Optional[Dict[str, Any]]:
         """Get Firebase user by UID"""
         if not self._initialized:
             logger.error("Firebase not initialized. Cannot get user.")
             return None
             
         try:
-            user = auth.get_user(uid)
+            user = await asyncio.to_thread(auth.get_user, uid)
             return {
                 "uid": user.uid,
                 "phone_number": user.phone_number,
@@ -1,79 +1,79 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, BackgroundTasks, Request
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, BackgroundTasks, Request, Query
 from fastapi.security import OAuth2PasswordRequestForm
 from uuid import UUID, uuid4
 from datetime import datetime, timezone
 import random
-from typing import List
+from typing import List, Optional
 
-from app.auth.schemas import UserLogin, UserUpdate, UserPublic, Token, PhoneSchema, VerifyOtpRequest, VerifyOtpResponse, CompleteRegistrationRequest, PasswordChangeRequest, DeleteAccountRequest, FirebaseSignupRequest, FirebaseLoginRequest, ActivityHistoryEvent
+from app.auth.schemas import UserLogin, UserUpdate, UserPublic, Token, PhoneSchema, VerifyOtpRequest, VerifyOtpResponse, CompleteRegistrationRequest, PasswordChangeRequest, DeleteAccountRequest, FirebaseSignupRequest, FirebaseLoginRequest, ActivityHistoryEvent, ActivityTimelinePage
 from app.auth.dependencies import get_current_user, get_current_active_user, get_user_from_refresh_token
-from app.utils.security import get_password_hash, verify_password, create_access_token, create_refresh_token, create_registration_token, verify_registration_token
+from app.utils.security import get_password_hash, verify_password, verify_password_and_update, create_access_token, create_refresh_token, create_registration_token, verify_registration_token, iter_upload_file, iter_request_body
 from app.database import db_manager
 from app.config import settings
 from app.utils.email_utils import send_login_notification_email
 from app.utils.logging import logger
+from app.utils.pagination import encode_keyset_cursor, decode_keyset_cursor
 from postgrest.exceptions import APIError
 from app.websocket import manager as ws_manager
 from app.notifications.service import notification_service
 from app.redis_client import get_redis_client
 from app.auth.firebase_service import firebase_service
+from app.media.avatars import AVATAR_LIST_SIZE, upload_avatar
 
 auth_router = APIRouter(prefix="/auth", tags=["Authentication"])
 user_router = APIRouter(prefix="/users", tags=["Users"])
 
+ACTIVITY_TIMELINE_DEFAULT_LIMIT = 50
+ACTIVITY_TIMELINE_MAX_LIMIT = 200
+
+def _to_activity_event(event: dict, user_id: str, partner_id: Optional[str]) -> ActivityHistoryEvent:
+    common = {"id": str(event["id"]), "timestamp": event["created_at"], "user_id": user_id}
+    if event["source"] == "profile_update":
+        return ActivityHistoryEvent(type="mood_update", mood=event.get("mood_name"), **common)
+    if str(event["user_id"]) == user_id:
+        return ActivityHistoryEvent(type="ping_sent", recipient_id=partner_id, **common)
+    return ActivityHistoryEvent(type="ping_received", sender_id=partner_id, **common)
+
+async def _get_activity_page(current_user: UserPublic, limit: int, since: Optional[datetime], before: Optional[datetime], before_id: Optional[UUID]) -> ActivityTimelinePage:
+    """One page of the user's mood updates and pings plus the partner's pings, newest first (see migration 009)."""
+    user_id = str(current_user.id)
+    partner_id = str(current_user.partner_id) if current_user.partner_id else None
+    resp = await db_manager.admin_client.rpc("get_activity_timeline", {
+        "p_user_id": user_id,
+        "p_partner_id": partner_id,
+        "p_since": since.isoformat() if since else None,
+        "p_before": before.isoformat() if before else None,
+        "p_before_id": str(before_id) if before_id else None,
+        "p_limit": limit,
+    }).execute()
+    rows = resp.data or []
+    next_cursor = encode_keyset_cursor(rows[-1]["created_at"], rows[-1]["id"]) if len(rows) == limit else None
+    return ActivityTimelinePage(events=[_to_activity_event(row, user_id, partner_id) for row in rows], next_cursor=next_cursor)
+
+@user_router.get("/me/activity-timeline", response_model=ActivityTimelinePage, summary="Get a page of user activity history")
+async def get_activity_timeline(
+    limit: int = Query(ACTIVITY_TIMELINE_DEFAULT_LIMIT, ge=1, le=ACTIVITY_TIMELINE_MAX_LIMIT),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page."),
+    since: Optional[datetime] = Query(None, description="Only events at or after this time."),
+    before: Optional[datetime] = Query(None, description="Only events before this time. Ignored when a cursor is given."),
+    current_user: UserPublic = Depends(get_current_active_user),
+):
+    """
+    Mood updates and 'Thinking of You' pings for the current user and their partner,
+    newest first, one page at a time.
+    """
+    before_id = None
+    if cursor: before, before_id = decode_keyset_cursor(cursor)
+    return await _get_activity_page(current_user, limit, since, before, before_id)
+
 @user_router.get("/me/activity-history", response_model=List[ActivityHistoryEvent], summary="Get user activity history")
 async def get_activity_history(current_user: UserPublic = Depends(get_current_active_user)):
     """
-    Retrieves a combined history of mood updates and 'Thinking of You' pings
-    for the current user and their partner.
+    Retrieves the most recent mood updates and 'Thinking of You' pings
+    for the current user and their partner. Use /me/activity-timeline to page further back.
     """
-    user_id = str(current_user.id)
-    partner_id = str(current_user.partner_id) if current_user.partner_id else None
-
-    if not partner_id:
-        # If there's no partner, only fetch the user's own mood updates
-        mood_updates_resp = await db_manager.admin_client.table("mood_analytics").select("id, created_at, mood_name, source").eq("user_id", user_id).eq("source", "profile_update").execute()
-        mood_events = mood_updates_resp.data or []
-    else:
-        # Fetch events for both user and partner
-        mood_updates_resp = await db_manager.admin_client.table("mood_analytics").select("id, created_at, mood_name, source, user_id").in_("user_id", [user_id, partner_id]).execute()
-        mood_events = mood_updates_resp.data or []
-
-    history_events: List[ActivityHistoryEvent] = []
-
-    for event in mood_events:
-        event_user_id = str(event['user_id'])
-        if event.get('source') == 'profile_update' and event_user_id == user_id:
-            history_events.append(ActivityHistoryEvent(
-                id=str(event['id']),
-                type='mood_update',
-                mood=event.get('mood_name'),
-                timestamp=event['created_at'],
-                user_id=user_id
-            ))
-        elif event.get('source') == 'assistive_touch_ping':
-            if event_user_id == user_id:
-                history_events.append(ActivityHistoryEvent(
-                    id=str(event['id']),
-                    type='ping_sent',
-                    recipient_id=partner_id,
-                    timestamp=event['created_at'],
-                    user_id=user_id
-                ))
-            elif partner_id and event_user_id == partner_id:
-                history_events.append(ActivityHistoryEvent(
-                    id=str(event['id']),
-                    type='ping_received',
-                    sender_id=partner_id,
-                    timestamp=event['created_at'],
-                    user_id=user_id
-                ))
-    
-    # Sort events chronologically descending
-    history_events.sort(key=lambda x: x.timestamp, reverse=True)
-    
-    return history_events
-
+    page = await _get_activity_page(current_user, ACTIVITY_TIMELINE_MAX_LIMIT, None, None, None)
+    return page.events
 
 @auth_router.post("/firebase/signup", response_model=Token, summary="Sign up with Firebase")
 async def firebase_signup(request_data: FirebaseSignupRequest):
@@ -83,7 +83,7 @@ async def firebase_signup(request_data: FirebaseSignupRequest):
     """
     try:
         # Verify Firebase token
-        decoded_token = firebase_service.verify_id_token(request_data.firebase_token)
+        decoded_token = await firebase_service.verify_id_token(request_data.firebase_token)
         if not decoded_token:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Firebase token")
         
@@ -144,7 +144,7 @@ async def firebase_login(request_data: FirebaseLoginRequest):
     """
     try:
         # Verify Firebase token
-        decoded_token = firebase_service.verify_id_token(request_data.firebase_token)
+        decoded_token = await firebase_service.verify_id_token(request_data.firebase_token)
         if not decoded_token:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Firebase token")
         
@@ -240,7 +240,7 @@ async def complete_registration(reg_data: CompleteRegistrationRequest):
     if existing_user_resp.data:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Phone number was registered by another user. Please start over.")
 
-    hashed_password = get_password_hash(reg_data.password)
+    hashed_password = await get_password_hash(reg_data.password)
     user_id = uuid4()
     
     new_user_data = {
@@ -280,10 +280,19 @@ async def login(request: Request, background_tasks: BackgroundTasks, form_data:
     
     user_dict_from_db = user_response_obj.data if user_response_obj else None
     
-    if not user_dict_from_db or not verify_password(form_data.password, user_dict_from_db["hashed_password"]):
+    password_valid, upgraded_hash = await verify_password_and_update(form_data.password, user_dict_from_db["hashed_password"]) if user_dict_from_db else (False, None)
+    if not password_valid:
         logger.warning(f"Login attempt failed for phone: {form_data.username} - User not found or incorrect password.")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect phone number or password", headers={"WWW-Authenticate": "Bearer"})
 
+    if upgraded_hash:
+        # The plaintext is only available here, so this is the one chance to move the hash to the configured cost.
+        try:
+            db_manager.get_table("users").update({"hashed_password": upgraded_hash}).eq("id", str(user_dict_from_db["id"])).execute()
+            logger.info(f"Rehashed password for user {user_dict_from_db['id']} with the configured cost.")
+        except APIError as e:
+            logger.warning(f"Could not store rehashed password for user {user_dict_from_db['id']}: {e}")
+
     logger.info(f"User {form_data.username} ({user_dict_from_db['display_name']}) successfully logged in.")
 
     user_public_info = UserPublic.model_validate(user_dict_from_db)
@@ -315,7 +324,7 @@ async def read_users_me(current_user: UserPublic = Depends(get_current_active_us
 
 @user_router.get("/{user_id}", response_model=UserPublic)
 async def get_user(user_id: UUID, current_user_dep: UserPublic = Depends(get_current_user)):
-    user_response_obj = db_manager.get_table("users").select("id, display_name, avatar_url, mood, phone, email, is_online, last_seen, partner_id").eq("id", str(user_id)).maybe_single().execute()
+    user_response_obj = db_manager.get_table("users").select("id, display_name, avatar_url, avatar_variants, mood, phone, email, is_online, last_seen, partner_id").eq("id", str(user_id)).maybe_single().execute()
     if not user_response_obj.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     return UserPublic(**user_response_obj.data)
@@ -348,10 +357,10 @@ async def update_profile(profile_update: UserUpdate, current_user: UserPublic =
 async def change_password(password_data: PasswordChangeRequest, current_user: UserPublic = Depends(get_current_active_user)):
     user_response_obj = db_manager.get_table("users").select("hashed_password").eq("id", str(current_user.id)).single().execute()
     
-    if not verify_password(password_data.current_password, user_response_obj.data["hashed_password"]):
+    if not await verify_password(password_data.current_password, user_response_obj.data["hashed_password"]):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Incorrect current password.")
 
-    new_hashed_password = get_password_hash(password_data.new_password)
+    new_hashed_password = await get_password_hash(password_data.new_password)
     db_manager.get_table("users").update({"hashed_password": new_hashed_password, "updated_at": datetime.now(timezone.utc).isoformat()}).eq("id", str(current_user.id)).execute()
     logger.info(f"User {current_user.id} successfully changed their password.")
     return None
@@ -363,7 +372,7 @@ async def delete_account(
 ):
     user_resp = db_manager.get_table("users").select("hashed_password").eq("id", str(current_user.id)).single().execute()
     
-    if not verify_password(delete_request.password, user_resp.data["hashed_password"]):
+    if not await verify_password(delete_request.password, user_resp.data["hashed_password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect password. Account not deleted.",
@@ -383,21 +392,30 @@ async def delete_account(
     
     return None
 
-@user_router.post("/me/avatar", response_model=UserPublic)
-async def upload_avatar_route(file: UploadFile = File(...), current_user: UserPublic = Depends(get_current_active_user)):
-    from app.routers.uploads import upload_avatar_to_cloudinary 
-    file_url = await upload_avatar_to_cloudinary(file)
-    update_data = {"avatar_url": file_url, "updated_at": datetime.now(timezone.utc).isoformat()}
-    db_manager.get_table("users").update(update_data).eq("id", str(current_user.id)).execute()
-    updated_user_response_obj = db_manager.get_table("users").select("*").eq("id", str(current_user.id)).maybe_single().execute()
+async def _save_avatar(current_user: UserPublic, avatar_variants: dict) -> UserPublic:
+    update_data = {"avatar_url": avatar_variants[str(AVATAR_LIST_SIZE)], "avatar_variants": avatar_variants, "updated_at": datetime.now(timezone.utc).isoformat()}
+    await db_manager.get_table("users").update(update_data).eq("id", str(current_user.id)).execute()
+    updated_user_response_obj = await db_manager.get_table("users").select("*").eq("id", str(current_user.id)).maybe_single().execute()
     
     if not updated_user_response_obj.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found or avatar update failed")
     
     refreshed_user_data = updated_user_response_obj.data
-    await ws_manager.broadcast_user_profile_update(user_id=current_user.id, updated_data={"avatar_url": refreshed_user_data["avatar_url"]})
+    await ws_manager.broadcast_user_profile_update(user_id=current_user.id, updated_data={"avatar_url": refreshed_user_data["avatar_url"], "avatar_variants": refreshed_user_data.get("avatar_variants")})
     return UserPublic.model_validate(refreshed_user_data)
 
+@user_router.post("/me/avatar", response_model=UserPublic)
+async def upload_avatar_route(file: UploadFile = File(...), current_user: UserPublic = Depends(get_current_active_user)):
+    avatar_variants = await upload_avatar(current_user.id, iter_upload_file(file), file.size)
+    return await _save_avatar(current_user, avatar_variants)
+
+@user_router.put("/me/avatar", response_model=UserPublic)
+async def upload_avatar_raw_route(request: Request, current_user: UserPublic = Depends(get_current_active_user)):
+    """Same as POST /me/avatar, but the image is the raw request body, validated as it streams in instead of being spooled by the multipart parser."""
+    content_length = request.headers.get("content-length")
+    avatar_variants = await upload_avatar(current_user.id, iter_request_body(request), int(content_length) if content_length and content_length.isdigit() else None)
+    return await _save_avatar(current_user, avatar_variants)
+
 @user_router.post("/{recipient_user_id}/ping-thinking-of-you", status_code=status.HTTP_200_OK)
 async def http_ping_thinking_of_you(recipient_user_id: UUID, current_user: UserPublic = Depends(get_current_active_user)):
     logger.info(f"User {current_user.id} sending 'Thinking of You' ping to user {recipient_user_id} via HTTP.")
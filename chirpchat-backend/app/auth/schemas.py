@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field, validator
-from typing import Optional, List
+from typing import Optional, List, Dict
 from uuid import UUID
 from datetime import datetime
 import re
@@ -67,6 +67,7 @@ class UserPublic(BaseModel):
     id: UUID
     display_name: str
     avatar_url: Optional[str] = None
+    avatar_variants: Optional[Dict[str, str]] = None # Pixel size ("64", "128", "512") -> WebP URL
     mood: Optional[Mood] = "Neutral"
     is_online: Optional[bool] = False
     last_seen: Optional[datetime] = None
@@ -78,6 +79,13 @@ class UserPublic(BaseModel):
     class Config:
         from_attributes = True
 
+    def avatar_url_for(self, size: int) -> Optional[str]:
+        """Smallest avatar variant at least `size` pixels wide, falling back to the largest one, then avatar_url."""
+        if not self.avatar_variants: return self.avatar_url
+        sizes = sorted(int(s) for s in self.avatar_variants)
+        fitting = next((s for s in sizes if s >= size), sizes[-1])
+        return self.avatar_variants[str(fitting)]
+
 class Token(BaseModel):
     access_token: str
     refresh_token: str
@@ -98,4 +106,8 @@ class ActivityHistoryEvent(BaseModel):
     recipient_id: Optional[str] = None
     sender_id: Optional[str] = None
 
+class ActivityTimelinePage(BaseModel):
+    events: List[ActivityHistoryEvent]
+    next_cursor: Optional[str] = None # Pass back as `cursor` for the next (older) page; None on the last page.
+
     
\ No newline at end of file
@@ -1,57 +1,159 @@
 
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query, BackgroundTasks
-from typing import Optional, List, Any
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from typing import Optional, List, Dict, Any
 from uuid import UUID
 from datetime import datetime, timezone
 import json
-from pydantic import BaseModel
+import orjson
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 
 from app.chat.schemas import (
     ChatCreate, ChatResponse, ChatListResponse, MessageCreate, MessageInDB,
     MessageListResponse, ReactionToggle, ChatParticipant, MessageStatusEnum,
-    MessageModeEnum
+    MessageModeEnum, MessageBatchCreate, MessageBatchAck, MessageBatchResponse,
+    GalleryMediaType, MediaGalleryItem, MediaGalleryResponse
 )
 from app.auth.dependencies import get_current_active_user, get_current_user
 from app.auth.schemas import UserPublic
 from app.database import db_manager
 from app.websocket import manager as ws_manager
 from app.utils.logging import logger 
+from app.utils.pagination import encode_keyset_cursor, decode_keyset_cursor
 from app.notifications.service import notification_service
-from app.routers.uploads import delete_cloudinary_asset
+from app.media import deletion_queue
+from app.media import assets as media_assets
+from app.media import signed_urls
+from app.media.schemas import CONTENT_HASH_PATTERN, MediaMessageByHashCreate, MediaMessageForwardCreate
 import uuid
 
 router = APIRouter(prefix="/chats", tags=["Chats"])
 
+MESSAGE_STATUS_MAP = {"sent_to_server": "sent", "delivered_to_recipient": "delivered", "read_by_recipient": "read"}
+MEDIA_URL_FIELD_BY_SUBTYPE = {"image": "image_url", "clip": "clip_url", "voice_message": "clip_url", "audio": "clip_url", "document": "document_url"}
+
+REPLY_PREVIEW_TEXT_LENGTH = 120
+REPLY_PREVIEW_COLUMNS = "id, user_id, media_type, text, thumbnail_url, stickers(image_url)"
+
+# Precompiled adapters so a whole page of rows is validated in one pass instead of one model_validate per row.
+message_list_adapter = TypeAdapter(List[MessageInDB])
+chat_list_adapter = TypeAdapter(List[ChatResponse])
+
 def map_db_message_to_schema(message_data: dict) -> dict:
-    """Centralized function to map raw DB message data to a schema-compatible dict."""
+    """Centralized function to map raw DB message data to a schema-compatible dict.
+    Returns a new dict; the DB row itself is left untouched."""
     if not message_data: return {}
-    if message_data.get('media_type'): message_data['message_subtype'] = message_data['media_type']
-    if message_data.get('media_url'):
-        subtype = message_data.get('message_subtype')
-        if subtype == 'image':
-            message_data['image_url'] = message_data['media_url']
-            if message_data.get('thumbnail_url'): message_data['image_thumbnail_url'] = message_data.get('thumbnail_url')
-        elif subtype in ['clip', 'voice_message', 'audio']:
-            message_data['clip_url'] = message_data['media_url']
-            if message_data.get('thumbnail_url'): message_data['image_thumbnail_url'] = message_data.get('thumbnail_url')
-        elif subtype == 'document': message_data['document_url'] = message_data['media_url']
-    if message_data.get('file_size'): message_data['file_size_bytes'] = message_data['file_size']
-    if isinstance(message_data.get('file_metadata'), str):
+    mapped = dict(message_data)
+    if mapped.get('media_type'): mapped['message_subtype'] = mapped['media_type']
+    media_url = mapped.get('media_url')
+    if media_url:
+        url_field = MEDIA_URL_FIELD_BY_SUBTYPE.get(mapped.get('message_subtype'))
+        if url_field: mapped[url_field] = media_url
+        if url_field in ('image_url', 'clip_url') and mapped.get('thumbnail_url'): mapped['image_thumbnail_url'] = mapped['thumbnail_url']
+    if mapped.get('file_size'): mapped['file_size_bytes'] = mapped['file_size']
+    file_metadata = mapped.get('file_metadata')
+    if isinstance(file_metadata, str):
+        try: file_metadata = orjson.loads(file_metadata)
+        except orjson.JSONDecodeError: file_metadata = None
+        if isinstance(file_metadata, dict): mapped.update(file_metadata)
+        mapped['file_metadata'] = file_metadata if isinstance(file_metadata, dict) else None
+    status_value = mapped.get("status")
+    if status_value in MESSAGE_STATUS_MAP: mapped["status"] = MESSAGE_STATUS_MAP[status_value]
+    if mapped.get("stickers"): mapped["sticker_image_url"] = mapped["stickers"].get("image_url")
+    return mapped
+
+def messages_from_rows(rows: List[dict]) -> List[MessageInDB]:
+    """Maps and validates a batch of rows read from our own DB with the precompiled list adapter.
+    For rows that are only serialized back out, message_list_response_from_trusted_rows is cheaper."""
+    return message_list_adapter.validate_python([map_db_message_to_schema(row) for row in rows])
+
+def stored_messages_from_rows(rows: List[dict]) -> List[MessageInDB]:
+    """Like messages_from_rows, but a row that fails validation is logged and left out instead of failing the batch."""
+    try:
+        return messages_from_rows(rows)
+    except ValidationError:
+        messages = []
+        for row in rows:
+            try: messages.append(MessageInDB.model_validate(map_db_message_to_schema(row)))
+            except ValidationError as e: logger.error(f"Stored message {row.get('id')} does not match MessageInDB: {e}")
+        return messages
+
+def message_list_response(messages: List[MessageInDB]) -> ORJSONResponse:
+    """Serializes a MessageListResponse body directly with orjson, skipping FastAPI's response_model re-validation."""
+    return ORJSONResponse({"messages": message_list_adapter.dump_python(messages)})
+
+# Every MessageInDB field with its default, in schema order.
+MESSAGE_FIELD_DEFAULTS = {name: field.default_factory() if field.default_factory else field.default for name, field in MessageInDB.model_fields.items()}
+
+def message_list_response_from_trusted_rows(rows: List[dict]) -> ORJSONResponse:
+    """
+    Serializes rows read from our own DB as a MessageListResponse body without building models at all.
+    Each mapped row is projected onto MessageInDB's fields and values are passed through as the DB returned them.
+    model_construct saves little here: with pydantic 2.5 it runs in Python per field, about as slow as
+    validating the whole page in pydantic-core (see tests/test_message_serialization.py).
+    """
+    messages = []
+    for row in rows:
+        mapped = map_db_message_to_schema(row)
+        messages.append({name: mapped.get(name, default) for name, default in MESSAGE_FIELD_DEFAULTS.items()})
+    return ORJSONResponse({"messages": messages})
+
+def chat_list_response(chats: List[ChatResponse]) -> ORJSONResponse:
+    """Serializes a ChatListResponse body directly with orjson, skipping FastAPI's response_model re-validation."""
+    return ORJSONResponse({"chats": chat_list_adapter.dump_python(chats)})
+
+def build_reply_preview(quoted: dict) -> dict:
+    """Builds the compact preview embedded in a reply: sender, subtype, truncated text and thumbnail."""
+    text = quoted.get("text")
+    stickers = quoted.get("stickers") or {}
+    return {
+        "id": quoted["id"], "user_id": quoted["user_id"],
+        "message_subtype": quoted.get("media_type") or quoted.get("message_subtype"),
+        "text": text[:REPLY_PREVIEW_TEXT_LENGTH] if text else None,
+        "thumbnail_url": quoted.get("thumbnail_url") or stickers.get("image_url"),
+    }
+
+async def attach_reply_previews(rows: List[dict], chat_id: UUID, cleared_at: Optional[str] = None) -> List[dict]:
+    """
+    Embeds a reply_preview into every row that quotes another message.
+    Quoted messages on the same page are resolved in memory; the rest are fetched in one batched query,
+    restricted to the same chat and to what the reader can still see after clearing their history.
+    """
+    quoted_by_id = {str(row["id"]): row for row in rows}
+    missing_ids = {str(row["reply_to_message_id"]) for row in rows if row.get("reply_to_message_id") and str(row["reply_to_message_id"]) not in quoted_by_id}
+    if missing_ids:
         try:
-            metadata = json.loads(message_data['file_metadata'])
-            message_data.update(metadata)
-        except (json.JSONDecodeError, TypeError): pass 
-    status_map = {"sent_to_server": "sent", "delivered_to_recipient": "delivered", "read_by_recipient": "read"}
-    if message_data.get("status") in status_map: message_data["status"] = status_map[message_data["status"]]
-    if message_data.get("stickers"): message_data["sticker_image_url"] = message_data["stickers"].get("image_url")
-    return message_data
+            query = db_manager.get_table("messages").select(REPLY_PREVIEW_COLUMNS).eq("chat_id", str(chat_id)).in_("id", list(missing_ids))
+            if cleared_at: query = query.gt("created_at", cleared_at)
+            quoted_resp = await query.execute()
+            quoted_by_id.update({str(row["id"]): row for row in quoted_resp.data or []})
+        except Exception as e:
+            logger.error(f"Error fetching reply previews for {len(missing_ids)} messages: {e}", exc_info=True)
+    for row in rows:
+        quoted = quoted_by_id.get(str(row.get("reply_to_message_id")))
+        if quoted: row["reply_preview"] = build_reply_preview(quoted)
+    return rows
+
+async def find_invalid_reply_targets(chat_id: UUID, reply_ids: List[UUID], cleared_at: Optional[str] = None) -> set:
+    """
+    Returns the ids in reply_ids that a sender may not quote: messages in another chat, or ones from before
+    the sender cleared their history. Ids with no stored message (incognito or deleted) are allowed; they get no preview.
+    """
+    if not reply_ids: return set()
+    resp = await db_manager.get_table("messages").select("id, chat_id, created_at").in_("id", list({str(i) for i in reply_ids})).execute()
+    cleared = datetime.fromisoformat(cleared_at) if cleared_at else None
+    return {
+        str(row["id"]) for row in resp.data or []
+        if str(row["chat_id"]) != str(chat_id) or (cleared and datetime.fromisoformat(row["created_at"]) <= cleared)
+    }
 
 async def get_message_with_details_from_db(message_id: UUID) -> Optional[MessageInDB]:
     """Helper function to fetch a message and join its sticker/media details."""
     try:
         response = await db_manager.get_table("messages").select("*, stickers(image_url)").eq("id", str(message_id)).maybe_single().execute()
         if not response.data: return None
+        await attach_reply_previews([response.data], response.data["chat_id"])
         mapped_data = map_db_message_to_schema(response.data)
         return MessageInDB.model_validate(mapped_data)
     except Exception as e:
@@ -65,38 +167,79 @@ async def get_chat_list_for_user(user_id: UUID) -> List[ChatResponse]:
         if not rpc_response.data: return []
         for chat_data in rpc_response.data:
             if chat_data.get('last_message'): chat_data['last_message'] = map_db_message_to_schema(chat_data['last_message'])
-        return [ChatResponse.model_validate(chat) for chat in rpc_response.data]
+        return chat_list_adapter.validate_python(rpc_response.data)
     except Exception as e:
         logger.error(f"Error calling get_user_chat_list RPC for user {user_id}: {e}", exc_info=True)
         return []
 
+MEDIA_MESSAGE_SUBTYPES = ['image', 'video', 'audio', 'document', 'voice_message', 'clip']
+
+def build_message_row(message_create: MessageCreate, message_id: UUID, chat_id: UUID, user_id: UUID) -> dict:
+    """Maps a MessageCreate from the client onto a row of the messages table."""
+    message_row = {
+        "id": str(message_id),
+        "chat_id": str(chat_id),
+        "user_id": str(user_id),
+        "text": message_create.text,
+        "media_type": message_create.message_subtype.value if message_create.message_subtype else 'text',
+        "mode": message_create.mode.value if message_create.mode else MessageModeEnum.NORMAL.value,
+        "status": MessageStatusEnum.SENT.value,
+        "upload_status": "completed", # Since this is after upload
+        "created_at": "now()",
+        "updated_at": "now()",
+        "reactions": {},
+        "client_temp_id": message_create.client_temp_id,
+        "reply_to_message_id": str(message_create.reply_to_message_id) if message_create.reply_to_message_id else None,
+        "sticker_id": str(message_create.sticker_id) if message_create.sticker_id else None,
+    }
+
+    # Handle media-specific fields
+    if message_create.message_subtype in MEDIA_MESSAGE_SUBTYPES:
+        message_row["media_url"] = message_create.image_url or message_create.clip_url or message_create.document_url
+        message_row["thumbnail_url"] = message_create.image_thumbnail_url
+        file_metadata = {
+            "duration_seconds": message_create.duration_seconds,
+            "file_size_bytes": message_create.file_size_bytes,
+            "audio_format": message_create.audio_format,
+            "document_name": message_create.document_name,
+            "clip_type": message_create.clip_type.value if message_create.clip_type else None,
+        }
+        message_row["file_metadata"] = json.dumps({k: v for k, v in file_metadata.items() if v is not None})
+        message_row["file_size"] = message_create.file_size_bytes
+    return message_row
+
 @router.delete("/messages/{message_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_message(message_id: UUID, background_tasks: BackgroundTasks, chat_id: UUID = Query(...), current_user: UserPublic = Depends(get_current_user)):
+async def delete_message(message_id: UUID, chat_id: UUID = Query(...), current_user: UserPublic = Depends(get_current_user)):
     logger.info(f"User {current_user.id} attempting to delete message {message_id} from chat {chat_id}")
     msg_resp = await db_manager.get_table("messages").select("user_id, chat_id, file_metadata").eq("id", str(message_id)).single().execute()
     if not msg_resp.data: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message not found")
     if str(msg_resp.data["user_id"]) != str(current_user.id) or str(msg_resp.data["chat_id"]) != str(chat_id): raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You can only delete your own messages.")
 
     file_metadata = msg_resp.data.get("file_metadata")
+    if isinstance(file_metadata, str):
+        try: file_metadata = orjson.loads(file_metadata)
+        except orjson.JSONDecodeError: file_metadata = None
     if file_metadata and isinstance(file_metadata, dict):
         public_id = file_metadata.get("public_id")
         resource_type = file_metadata.get("resource_type")
-        if public_id and resource_type:
-            background_tasks.add_task(delete_cloudinary_asset, public_id=public_id, resource_type=resource_type)
+        # Deduplicated media is shared between messages; only the last reference destroys the asset.
+        if public_id and resource_type and await media_assets.release_asset(public_id):
+            await deletion_queue.enqueue_deletion(public_id, resource_type)
 
     await db_manager.get_table("messages").delete().eq("id", str(message_id)).execute()
+    await signed_urls.revoke_signed_urls(message_id)
     await ws_manager.broadcast_message_deletion(str(chat_id), str(message_id))
     return None
 
 @router.post("/{chat_id}/clear", status_code=status.HTTP_204_NO_CONTENT)
 async def clear_chat_for_user(chat_id: UUID, current_user: UserPublic = Depends(get_current_active_user)):
-    """Clears the chat history for the current user only by creating a marker message."""
+    """Clears the chat history for the current user only by moving their cleared_at watermark forward."""
     logger.info(f"User {current_user.id} clearing history for chat {chat_id} for themselves.")
-    participant_check_resp = await db_manager.get_table("chat_participants").select("user_id").eq("chat_id", str(chat_id)).eq("user_id", str(current_user.id)).maybe_single().execute()
-    if not participant_check_resp.data: raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not a participant of this chat.")
-    marker_message = {"id": str(uuid.uuid4()), "chat_id": str(chat_id), "user_id": str(current_user.id), "message_subtype": "history_cleared_marker", "text": None, "created_at": "now()", "updated_at": "now()", "reactions": {}}
-    await db_manager.get_table("messages").insert(marker_message).execute()
-    logger.info(f"History clear marker set for user {current_user.id} in chat {chat_id}.")
+    cleared_at = datetime.now(timezone.utc).isoformat()
+    update_resp = await db_manager.get_table("chat_participants").update({"cleared_at": cleared_at}).eq("chat_id", str(chat_id)).eq("user_id", str(current_user.id)).execute()
+    if not update_resp.data: raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not a participant of this chat.")
+    await ws_manager.invalidate_chat_membership(current_user.id, chat_id)
+    logger.info(f"History cleared watermark set to {cleared_at} for user {current_user.id} in chat {chat_id}.")
     return None
 
 @router.post("/", response_model=ChatResponse)
@@ -119,27 +262,72 @@ async def create_chat(chat_create: ChatCreate, current_user: UserPublic = Depend
 @router.get("/", response_model=ChatListResponse)
 async def list_chats(current_user: UserPublic = Depends(get_current_active_user)):
     chat_responses = await get_chat_list_for_user(current_user.id)
-    return ChatListResponse(chats=chat_responses)
+    return chat_list_response(chat_responses)
 
 @router.get("/{chat_id}/messages", response_model=MessageListResponse)
 async def get_messages(chat_id: UUID, limit: int = 50, before_timestamp: Optional[datetime] = None, current_user: UserPublic = Depends(get_current_active_user)):
-    is_participant_resp = await db_manager.get_table("chat_participants").select("user_id").eq("chat_id", str(chat_id)).eq("user_id", str(current_user.id)).maybe_single().execute()
-    if not is_participant_resp.data: raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a participant of this chat")
-    marker_resp = await db_manager.get_table("messages").select("created_at").eq("chat_id", str(chat_id)).eq("user_id", str(current_user.id)).eq("message_subtype", "history_cleared_marker").order("created_at", desc=True).limit(1).maybe_single().execute()
-    marker_timestamp = marker_resp.data['created_at'] if marker_resp and marker_resp.data else None
+    membership = await ws_manager.get_chat_membership(current_user.id, chat_id)
+    if membership is None: raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a participant of this chat")
     query = db_manager.get_table("messages").select("*, stickers(image_url)").eq("chat_id", str(chat_id)).order("created_at", desc=True).limit(limit)
     if before_timestamp: query = query.lt("created_at", before_timestamp.isoformat())
-    if marker_timestamp: query = query.gt("created_at", marker_timestamp)
+    if membership.get("cleared_at"): query = query.gt("created_at", membership["cleared_at"])
     messages_resp = await query.execute()
-    messages_data_list = messages_resp.data or []
-    cleaned_messages = [map_db_message_to_schema(m) for m in reversed(messages_data_list)]
-    return MessageListResponse(messages=[MessageInDB.model_validate(m) for m in cleaned_messages])
+    messages_data_list = await attach_reply_previews(messages_resp.data or [], chat_id, membership.get("cleared_at"))
+    return message_list_response_from_trusted_rows(list(reversed(messages_data_list)))
+
+GALLERY_COLUMNS = "id, user_id, media_type, media_url, thumbnail_url, file_size, file_metadata, created_at"
+
+def build_gallery_item(row: dict) -> MediaGalleryItem:
+    """Builds a gallery tile from a media row, taking thumbnail and dimensions from file_metadata."""
+    metadata = row.get("file_metadata")
+    if isinstance(metadata, str):
+        try: metadata = orjson.loads(metadata)
+        except orjson.JSONDecodeError: metadata = None
+    if not isinstance(metadata, dict): metadata = {}
+    urls = metadata.get("urls") or {}
+    return MediaGalleryItem(
+        message_id=row["id"], user_id=row["user_id"], media_type=row["media_type"], created_at=row["created_at"],
+        media_url=row["media_url"],
+        thumbnail_url=row.get("thumbnail_url") or urls.get("thumbnail_250") or urls.get("static_thumbnail"),
+        width=metadata.get("width"), height=metadata.get("height"),
+        duration_seconds=metadata.get("duration_seconds"), document_name=metadata.get("document_name"),
+        file_size_bytes=row.get("file_size") or metadata.get("bytes"),
+    )
+
+@router.get("/{chat_id}/media", response_model=MediaGalleryResponse)
+async def get_chat_media(
+    chat_id: UUID,
+    media_type: Optional[GalleryMediaType] = Query(None, alias="type"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page."),
+    limit: int = Query(60, ge=1, le=200),
+    current_user: UserPublic = Depends(get_current_active_user),
+):
+    """
+    Pages through a chat's shared media, newest first, without downloading text messages.
+    Backed by the partial index idx_messages_chat_media_gallery; pass next_cursor back as cursor for the next page.
+    """
+    membership = await ws_manager.get_chat_membership(current_user.id, chat_id)
+    if membership is None: raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a participant of this chat")
+    query = db_manager.get_table("messages").select(GALLERY_COLUMNS).eq("chat_id", str(chat_id)).not_.is_("media_url", "null")
+    if media_type: query = query.eq("media_type", media_type)
+    if cursor:
+        before, before_id = decode_keyset_cursor(cursor)
+        # (created_at, id) < (before, before_id), spelled out for PostgREST.
+        query = query.or_(f'created_at.lt."{before.isoformat()}",and(created_at.eq."{before.isoformat()}",id.lt.{before_id})')
+    if membership.get("cleared_at"): query = query.gt("created_at", membership["cleared_at"])
+    media_resp = await query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1).execute()
+    rows = media_resp.data or []
+    items = [build_gallery_item(row) for row in rows[:limit]]
+    next_cursor = encode_keyset_cursor(rows[limit - 1]["created_at"], rows[limit - 1]["id"]) if len(rows) > limit else None
+    return MediaGalleryResponse(items=items, next_cursor=next_cursor)
 
 @router.post("/{chat_id}/messages", response_model=MessageInDB)
 async def send_message_http(chat_id: UUID, message_create: MessageCreate, current_user: UserPublic = Depends(get_current_active_user)):
-    is_participant_resp = await db_manager.get_table("chat_participants").select("user_id").eq("chat_id", str(chat_id)).eq("user_id", str(current_user.id)).maybe_single().execute()
-    if not is_participant_resp.data: raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a participant of this chat")
+    membership = await ws_manager.get_chat_membership(current_user.id, chat_id)
+    if membership is None: raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a participant of this chat")
     if await ws_manager.is_message_processed(message_create.client_temp_id): raise HTTPException(status_code=status.HTTP_200_OK, detail="Duplicate message, already processed.")
+    if message_create.reply_to_message_id and await find_invalid_reply_targets(chat_id, [message_create.reply_to_message_id], membership.get("cleared_at")):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="reply_to_message_id is not a message in this chat")
     message_id = uuid.uuid4()
     if message_create.mode == MessageModeEnum.INCOGNITO:
         incognito_message_obj = MessageInDB(id=message_id, chat_id=chat_id, user_id=current_user.id, **message_create.model_dump(exclude={'chat_id', 'recipient_id'}), status=MessageStatusEnum.SENT, created_at=datetime.now(timezone.utc), updated_at=datetime.now(timezone.utc), reactions={})
@@ -158,22 +346,118 @@ async def send_message_http(chat_id: UUID, message_create: MessageCreate, curren
     await notification_service.send_new_message_notification(sender=current_user, chat_id=chat_id, message=message_for_response)
     return message_for_response
 
+@router.post("/{chat_id}/messages/batch", response_model=MessageBatchResponse)
+async def send_message_batch(chat_id: UUID, batch: MessageBatchCreate, current_user: UserPublic = Depends(get_current_active_user)):
+    """
+    Sends an ordered batch of messages, e.g. an offline outbox being flushed.
+    Dedupes in one Redis pass, inserts in one statement, then emits one broadcast and one collapsed push.
+    """
+    membership = await ws_manager.get_chat_membership(current_user.id, chat_id)
+    if membership is None: raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a participant of this chat")
+    acks: List[MessageBatchAck] = [MessageBatchAck(client_temp_id=m.client_temp_id, status="failed", detail="client_temp_id is required.") for m in batch.messages]
+    candidate_indexes, seen_temp_ids = [], set()
+    for index, message_create in enumerate(batch.messages):
+        if not message_create.client_temp_id: continue
+        if message_create.client_temp_id in seen_temp_ids: acks[index] = MessageBatchAck(client_temp_id=message_create.client_temp_id, status="duplicate")
+        else:
+            seen_temp_ids.add(message_create.client_temp_id)
+            candidate_indexes.append(index)
+    invalid_reply_ids = await find_invalid_reply_targets(chat_id, [batch.messages[i].reply_to_message_id for i in candidate_indexes if batch.messages[i].reply_to_message_id], membership.get("cleared_at"))
+    for index in [i for i in candidate_indexes if str(batch.messages[i].reply_to_message_id) in invalid_reply_ids]:
+        acks[index] = MessageBatchAck(client_temp_id=batch.messages[index].client_temp_id, status="failed", detail="reply_to_message_id is not a message in this chat")
+        candidate_indexes.remove(index)
+    claimed = await ws_manager.claim_messages_for_processing([batch.messages[i].client_temp_id for i in candidate_indexes])
+    claimed_indexes = [i for i, is_new in zip(candidate_indexes, claimed) if is_new]
+    for i, is_new in zip(candidate_indexes, claimed):
+        if not is_new: acks[i] = MessageBatchAck(client_temp_id=batch.messages[i].client_temp_id, status="duplicate")
+    if not claimed_indexes: return MessageBatchResponse(acks=acks)
+
+    message_ids, rows_to_insert, incognito_messages = {}, [], {}
+    for index in claimed_indexes:
+        message_create, message_id = batch.messages[index], uuid.uuid4()
+        message_ids[index] = message_id
+        if message_create.mode == MessageModeEnum.INCOGNITO:
+            now = datetime.now(timezone.utc)
+            incognito_messages[index] = MessageInDB(id=message_id, chat_id=chat_id, user_id=current_user.id, **message_create.model_dump(exclude={'chat_id', 'recipient_id'}), status=MessageStatusEnum.SENT, created_at=now, updated_at=now, reactions={})
+        else:
+            rows_to_insert.append(build_message_row(message_create, message_id, chat_id, current_user.id))
+
+    stored_by_id: Dict[str, MessageInDB] = {}
+    if rows_to_insert:
+        # insert_messages_batch takes its column list from the first row, so every row needs the same keys.
+        all_columns = set().union(*rows_to_insert)
+        for row in rows_to_insert:
+            for column in all_columns: row.setdefault(column, None)
+        try:
+            # Stamps created_at with the DB clock, one microsecond apart, so the outbox order is kept.
+            await db_manager.admin_client.rpc("insert_messages_batch", {"p_rows": rows_to_insert}).execute()
+        except Exception as e:
+            logger.error(f"Batch insert of {len(rows_to_insert)} messages failed for chat {chat_id}: {e}", exc_info=True)
+            await ws_manager.release_processed_messages([batch.messages[i].client_temp_id for i in claimed_indexes])
+            raise HTTPException(status_code=500, detail="Failed to send messages")
+        # From here on the messages are stored and their claims must stay, or a retry would store them twice.
+        try:
+            await db_manager.get_table("chats").update({"updated_at": "now()"}).eq("id", str(chat_id)).execute()
+            stored_resp = await db_manager.get_table("messages").select("*, stickers(image_url)").in_("id", [row["id"] for row in rows_to_insert]).execute()
+            stored_by_id = {str(message.id): message for message in stored_messages_from_rows(await attach_reply_previews(stored_resp.data or [], chat_id))}
+        except Exception as e:
+            logger.error(f"Could not load {len(rows_to_insert)} stored batch messages for chat {chat_id}: {e}", exc_info=True)
+
+    sent_messages: List[MessageInDB] = []
+    for index in claimed_indexes:
+        client_temp_id = batch.messages[index].client_temp_id
+        message = incognito_messages.get(index) or stored_by_id.get(str(message_ids[index]))
+        if not message:
+            # Stored, but it could not be read back; the client keeps the id and gets the message from history.
+            acks[index] = MessageBatchAck(client_temp_id=client_temp_id, status="sent", server_assigned_id=message_ids[index], detail="Could not retrieve message details after sending.")
+            continue
+        acks[index] = MessageBatchAck(client_temp_id=client_temp_id, status="sent", server_assigned_id=message.id, message=message)
+        sent_messages.append(message)
+
+    if sent_messages:
+        await ws_manager.broadcast_chat_messages(str(chat_id), sent_messages)
+        await notification_service.send_new_messages_notification(sender=current_user, chat_id=chat_id, messages=[m for m in sent_messages if m.mode != MessageModeEnum.INCOGNITO])
+    return MessageBatchResponse(acks=acks)
+
 class MediaMessagePayload(BaseModel):
     client_temp_id: str
     chat_id: str
     public_id: str
     media_type: str
     cloudinary_metadata: dict
+    content_hash: Optional[str] = Field(None, pattern=CONTENT_HASH_PATTERN)
+
+async def publish_media_message(message_row: dict, chat_id: UUID, client_temp_id: str, current_user: UserPublic) -> MessageInDB:
+    """Fans out a media message that has just been inserted."""
+    await ws_manager.mark_message_as_processed(client_temp_id)
+    await db_manager.get_table("chats").update({"updated_at": "now()"}).eq("id", str(chat_id)).execute()
+
+    message_out = await get_message_with_details_from_db(UUID(message_row["id"]))
+    if not message_out: raise Exception(f"Could not retrieve media message details for ID: {message_row['id']}")
+    await ws_manager.broadcast_chat_message(str(chat_id), message_out)
+    await notification_service.send_new_message_notification(sender=current_user, chat_id=chat_id, message=message_out)
+    return message_out
 
 @router.post("/send-media-message", response_model=MessageInDB)
 async def send_media_message(payload: MediaMessagePayload, current_user: UserPublic = Depends(get_current_active_user)):
     chat_id = UUID(payload.chat_id)
-    is_participant_resp = await db_manager.get_table("chat_participants").select("user_id").eq("chat_id", str(chat_id)).eq("user_id", str(current_user.id)).maybe_single().execute()
-    if not is_participant_resp.data: raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a participant of this chat")
+    if not await ws_manager.is_user_in_chat(current_user.id, chat_id): raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a participant of this chat")
     if await ws_manager.is_message_processed(payload.client_temp_id): raise HTTPException(status_code=status.HTTP_200_OK, detail="Duplicate media message, already processed.")
     
     message_db_id = uuid.uuid4()
     cloudinary_meta = payload.cloudinary_metadata
+    file_metadata = {
+        "duration_seconds": cloudinary_meta.get('duration'),
+        "audio_format": cloudinary_meta.get('audio', {}).get('codec'),
+        "document_name": cloudinary_meta.get('original_filename'),
+        "clip_type": cloudinary_meta.get('resource_type'),
+        # Sent with new_message so the bubble can be laid out before any image bytes arrive.
+        "width": cloudinary_meta.get('width'),
+        "height": cloudinary_meta.get('height'),
+    }
+    if payload.content_hash:
+        # Recorded up front so delete_message can release the asset before the webhook has filled in the rest.
+        file_metadata.update({"content_hash": payload.content_hash, "public_id": payload.public_id, "resource_type": cloudinary_meta.get('resource_type')})
     
     message_data_to_insert = {
         "id": str(message_db_id), "chat_id": str(chat_id), "user_id": str(current_user.id),
@@ -183,23 +467,59 @@ async def send_media_message(payload: MediaMessagePayload, current_user: UserPub
         "media_url": cloudinary_meta.get('secure_url'),
         "file_size": cloudinary_meta.get('bytes'),
         "thumbnail_url": next((item['secure_url'] for item in cloudinary_meta.get('eager', []) if item.get('transformation')), None),
-        "file_metadata": json.dumps({
-            "duration_seconds": cloudinary_meta.get('duration'),
-            "audio_format": cloudinary_meta.get('audio', {}).get('codec'),
-            "document_name": cloudinary_meta.get('original_filename'),
-            "clip_type": cloudinary_meta.get('resource_type')
-        })
+        "file_metadata": json.dumps(file_metadata)
     }
     
     await db_manager.get_table("messages").insert(message_data_to_insert).execute()
-    await ws_manager.mark_message_as_processed(payload.client_temp_id)
-    await db_manager.get_table("chats").update({"updated_at": "now()"}).eq("id", str(chat_id)).execute()
-    
-    message_out = await get_message_with_details_from_db(message_db_id)
-    if not message_out: raise Exception(f"Could not retrieve media message details for ID: {message_db_id}")
-    await ws_manager.broadcast_chat_message(str(chat_id), message_out)
-    await notification_service.send_new_message_notification(sender=current_user, chat_id=chat_id, message=message_out)
-    return message_out
+    # Registered only once the message exists, so a failed insert leaves no reference behind.
+    if payload.content_hash and cloudinary_meta.get('resource_type'):
+        await media_assets.register_asset(current_user.id, payload.content_hash, payload.public_id, cloudinary_meta['resource_type'], message_data_to_insert["media_url"], message_data_to_insert["thumbnail_url"], message_data_to_insert["file_size"], file_metadata)
+    return await publish_media_message(message_data_to_insert, chat_id, payload.client_temp_id, current_user)
+
+@router.post("/{chat_id}/media-messages/by-hash", response_model=MessageInDB)
+async def send_media_message_by_hash(chat_id: UUID, payload: MediaMessageByHashCreate, current_user: UserPublic = Depends(get_current_active_user)):
+    """
+    Sends (or resends) media the current user already uploaded, identified by the SHA-256 of its bytes.
+    Returns 404 when the user has no upload with this hash; the client then uploads as usual and passes the hash to /send-media-message.
+    """
+    if not await ws_manager.is_user_in_chat(current_user.id, chat_id): raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a participant of this chat")
+    if await ws_manager.is_message_processed(payload.client_temp_id): raise HTTPException(status_code=status.HTTP_200_OK, detail="Duplicate media message, already processed.")
+    asset = await media_assets.acquire_asset(current_user.id, payload.content_hash)
+    if not asset: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No uploaded media matches this content hash.")
+    return await send_acquired_asset(chat_id, asset, payload.client_temp_id, payload.media_type, current_user)
+
+@router.post("/{chat_id}/media-messages/forward", response_model=MessageInDB)
+async def forward_media_message(chat_id: UUID, payload: MediaMessageForwardCreate, current_user: UserPublic = Depends(get_current_active_user)):
+    """
+    Forwards the media of an existing message (e.g. the partner's voice note) into chat_id without re-uploading it.
+    Returns 404 unless the user can see the source message and its media is deduplicated.
+    """
+    if not await ws_manager.is_user_in_chat(current_user.id, chat_id): raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a participant of this chat")
+    if await ws_manager.is_message_processed(payload.client_temp_id): raise HTTPException(status_code=status.HTTP_200_OK, detail="Duplicate media message, already processed.")
+    asset = await media_assets.acquire_asset_for_forward(current_user.id, payload.source_message_id)
+    if not asset: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No forwardable media for this message.")
+    return await send_acquired_asset(chat_id, asset, payload.client_temp_id, payload.media_type, current_user)
+
+async def send_acquired_asset(chat_id: UUID, asset: dict, client_temp_id: str, media_type: str, current_user: UserPublic) -> MessageInDB:
+    """Inserts and fans out a media message for an asset a reference was just taken on."""
+    file_metadata = {**(asset.get("file_metadata") or {}), "content_hash": asset["content_hash"], "public_id": asset["public_id"], "resource_type": asset["resource_type"]}
+    message_data_to_insert = {
+        "id": str(uuid.uuid4()), "chat_id": str(chat_id), "user_id": str(current_user.id),
+        "media_type": media_type, "mode": MessageModeEnum.NORMAL.value, "status": MessageStatusEnum.SENT.value,
+        "upload_status": "completed", "created_at": "now()", "updated_at": "now()", "reactions": {},
+        "client_temp_id": client_temp_id,
+        "media_url": asset["media_url"],
+        "file_size": asset.get("file_size"),
+        "thumbnail_url": asset.get("thumbnail_url"),
+        "file_metadata": json.dumps(file_metadata)
+    }
+    try:
+        await db_manager.get_table("messages").insert(message_data_to_insert).execute()
+    except Exception:
+        # The message was never stored, so the reference taken above must not keep the asset alive.
+        await media_assets.release_asset(asset["public_id"])
+        raise
+    return await publish_media_message(message_data_to_insert, chat_id, client_temp_id, current_user)
 
 
 @router.post("/messages/{message_id}/reactions", response_model=MessageInDB)
@@ -209,8 +529,7 @@ async def react_to_message(message_id: UUID, reaction_toggle: ReactionToggle, cu
     message_db = message_resp_obj.data 
     chat_id_str = str(message_db["chat_id"])
     if message_db.get("mode") == MessageModeEnum.INCOGNITO.value: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cannot react to incognito messages.")
-    participant_check_resp = await db_manager.get_table("chat_participants").select("user_id").eq("chat_id", chat_id_str).eq("user_id", str(current_user.id)).maybe_single().execute()
-    if not participant_check_resp.data: raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a participant of this chat")
+    if not await ws_manager.is_user_in_chat(current_user.id, message_db["chat_id"]): raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a participant of this chat")
     reactions, emoji, user_id_str = message_db.get("reactions") or {}, reaction_toggle.emoji, str(current_user.id)
     if emoji not in reactions: reactions[emoji] = []
     if user_id_str in reactions[emoji]: reactions[emoji].remove(user_id_str)
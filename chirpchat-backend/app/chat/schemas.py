@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
 from uuid import UUID
 from datetime import datetime
 import enum
@@ -58,6 +58,13 @@ class MessageCreate(MessageBase):
     recipient_id: Optional[UUID] = None
     client_temp_id: Optional[str] = None
 
+class ReplyPreview(BaseModel):
+    id: UUID
+    user_id: UUID
+    message_subtype: Optional[str] = None
+    text: Optional[str] = None
+    thumbnail_url: Optional[str] = None
+
 class MessageInDB(MessageBase):
     id: UUID
     user_id: UUID
@@ -68,6 +75,7 @@ class MessageInDB(MessageBase):
     status: Optional[MessageStatusEnum] = MessageStatusEnum.SENT
     client_temp_id: Optional[str] = None
     sticker_image_url: Optional[str] = None
+    reply_preview: Optional[ReplyPreview] = None
     class Config: from_attributes = True
 
 class ChatParticipant(BaseModel):
@@ -101,6 +109,40 @@ class ChatListResponse(BaseModel):
 class MessageListResponse(BaseModel):
     messages: List[MessageInDB]
 
+MAX_MESSAGE_BATCH_SIZE = 100
+
+class MessageBatchCreate(BaseModel):
+    messages: List[MessageCreate] = Field(..., min_length=1, max_length=MAX_MESSAGE_BATCH_SIZE)
+
+class MessageBatchAck(BaseModel):
+    client_temp_id: Optional[str] = None
+    status: Literal["sent", "duplicate", "failed"]
+    server_assigned_id: Optional[UUID] = None
+    detail: Optional[str] = None
+    message: Optional[MessageInDB] = None
+
+class MessageBatchResponse(BaseModel):
+    acks: List[MessageBatchAck]
+
+GalleryMediaType = Literal["image", "clip", "document", "voice_message"]
+
+class MediaGalleryItem(BaseModel):
+    message_id: UUID
+    user_id: UUID
+    media_type: str
+    created_at: datetime
+    media_url: str
+    thumbnail_url: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    duration_seconds: Optional[float] = None
+    document_name: Optional[str] = None
+    file_size_bytes: Optional[int] = None
+
+class MediaGalleryResponse(BaseModel):
+    items: List[MediaGalleryItem]
+    next_cursor: Optional[str] = None # Pass back as `cursor` for the next (older) page; None on the last page.
+
 class DefaultChatPartnerResponse(BaseModel):
     user_id: UUID
     display_name: str
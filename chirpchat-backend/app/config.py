@@ -11,10 +11,13 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
     CLOUDINARY_CLOUD_NAME: str
     CLOUDINARY_API_KEY: str
     CLOUDINARY_API_SECRET: str
     CLOUDINARY_WEBHOOK_URL: Optional[str] = None
+    CLOUDINARY_API_PREFIX: Optional[str] = None # e.g. http://localhost:8090 for a stand-in Admin API
     API_BASE_URL: str = "https://938c-49-43-231-86.ngrok-free.app"
     HUGGINGFACE_API_KEY: Optional[str] = None
     HUGGINGFACE_MOOD_MODEL_URL: Optional[str] = None
@@ -29,9 +32,13 @@ class Settings(BaseSettings):
     VAPID_PUBLIC_KEY: Optional[str] = None
     VAPID_PRIVATE_KEY: Optional[str] = None
     VAPID_ADMIN_EMAIL: Optional[str] = "mailto:admin@example.com"
+    PUSH_COLLAPSE_WINDOW_SECONDS: int = 30
     ENVIRONMENT: str = "development"
     DEBUG: bool = True
     SERVER_INSTANCE_ID: str = "default-instance-01"
+    ADMIN_USER_IDS: str = "" # Comma-separated user ids allowed on operational endpoints (cache and buffer stats).
+    WEBHOOK_WORKER_COUNT: int = 2
+    MEDIA_PROCESS_POOL_SIZE: int = 2
     
     # Firebase Configuration
     FIREBASE_PROJECT_ID: str = "kuchlu-8791e"
@@ -43,6 +50,8 @@ class Settings(BaseSettings):
     FIREBASE_TOKEN_URI: str = "https://oauth2.googleapis.com/token"
     FIREBASE_AUTH_PROVIDER_X509_CERT_URL: str = "https://www.googleapis.com/oauth2/v1/certs"
     FIREBASE_CLIENT_X509_CERT_URL: str = ""
+    FIREBASE_ID_TOKEN_CERT_URL: str = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+    FIREBASE_TOKEN_MEMO_TTL_SECONDS: int = 5 * 60 # Longest a verified ID token is trusted without checking it again.
     
     class Config:
         env_file = ".env"
@@ -11,10 +11,18 @@ from app.websocket import manager as ws_manager
 from app.utils.logging import logger
 from app.redis_client import redis_manager
 from app.config import settings
+from app.media.webhook_queue import run_webhook_workers
+from app.media.deletion_queue import run_deletion_worker
+from app.notifications.service import notification_service
+from app.utils.email_utils import EMAIL_DRAIN_TIMEOUT_SECONDS, email_dispatcher
+from app.analytics.ingest import analytics_buffer
+from app.analytics.service import run_rollup_maintenance
+from app.analytics.outcomes import run_mood_outcome_worker
 
 from app.auth.routes import auth_router, user_router
 from app.chat.routes import router as chat_router
 from app.routers.uploads import router as uploads_router
+from app.routers.upload_queue import router as upload_queue_router
 from app.routers.ws import router as ws_router
 from app.routers.ai import router as ai_router
 from app.routers.stickers import router as stickers_router
@@ -55,7 +63,19 @@ else:
 @app.on_event("startup")
 async def startup_event():
     asyncio.create_task(ws_manager.listen_for_broadcasts())
-    logger.info("FastAPI application startup complete. Redis listener running.")
+    asyncio.create_task(run_webhook_workers())
+    asyncio.create_task(run_deletion_worker())
+    asyncio.create_task(notification_service.run_deferred_dispatcher())
+    asyncio.create_task(email_dispatcher.run())
+    asyncio.create_task(analytics_buffer.run())
+    asyncio.create_task(run_rollup_maintenance())
+    asyncio.create_task(run_mood_outcome_worker())
+    logger.info("FastAPI application startup complete. Redis listener, webhook, deletion, notification digest, email, analytics and mood outcome workers running.")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await analytics_buffer.flush_all()
+    await email_dispatcher.drain(EMAIL_DRAIN_TIMEOUT_SECONDS)
 
 app.add_middleware(
     CORSMiddleware,
@@ -95,6 +115,7 @@ app.include_router(auth_router)
 app.include_router(user_router)
 app.include_router(chat_router)
 app.include_router(uploads_router)
+app.include_router(upload_queue_router)
 app.include_router(ws_router)
 app.include_router(ai_router)
 app.include_router(stickers_router)
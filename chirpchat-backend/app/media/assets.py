@@ -0,0 +1,63 @@
+
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from app.database import db_manager
+from app.utils.logging import logger
+
+# media_assets maps an owner's content hash to one uploaded Cloudinary asset, with a count of the
+# messages pointing at it. The acquire/register/release RPCs (migrations 006 and 014) keep the count
+# consistent under concurrent sends and deletes. Hash lookups are per owner, so a hash never matches
+# (or reveals) another user's upload; forwarding someone else's media goes through the source
+# message instead (migration 016), which the forwarder must be able to see.
+
+async def acquire_asset(owner_id: UUID, content_hash: str) -> Optional[Dict[str, Any]]:
+    """Takes a reference on an asset the owner already uploaded. Returns None if they have none with this hash."""
+    resp = await db_manager.admin_client.rpc("acquire_media_asset", {"p_owner_id": str(owner_id), "p_content_hash": content_hash}).execute()
+    return resp.data[0] if resp.data else None
+
+async def acquire_asset_for_forward(user_id: UUID, message_id: UUID) -> Optional[Dict[str, Any]]:
+    """
+    Takes a reference on the asset behind a message, for forwarding it. Returns None unless the user is a
+    participant of the message's chat, the message is after their cleared_at, and its media is tracked.
+    """
+    resp = await db_manager.admin_client.rpc("acquire_media_asset_for_forward", {"p_user_id": str(user_id), "p_message_id": str(message_id)}).execute()
+    return resp.data[0] if resp.data else None
+
+async def register_asset(owner_id: UUID, content_hash: str, public_id: str, resource_type: str, media_url: Optional[str], thumbnail_url: Optional[str], file_size: Optional[int], file_metadata: Dict[str, Any]) -> bool:
+    """
+    Records a freshly uploaded asset with one reference. Returns False if another upload of
+    the same bytes by the same owner got there first; that asset then stays untracked and is deleted with its message.
+    """
+    try:
+        resp = await db_manager.admin_client.rpc("register_media_asset", {
+            "p_owner_id": str(owner_id),
+            "p_content_hash": content_hash,
+            "p_public_id": public_id,
+            "p_resource_type": resource_type,
+            "p_media_url": media_url,
+            "p_thumbnail_url": thumbnail_url,
+            "p_file_size": file_size,
+            "p_file_metadata": file_metadata,
+        }).execute()
+        return bool(resp.data)
+    except Exception as e:
+        logger.error(f"Could not register media asset {public_id}: {e}", exc_info=True)
+        return False
+
+async def release_asset(public_id: str) -> bool:
+    """
+    Drops one reference. Returns True when the Cloudinary asset should now be destroyed:
+    either this was the last reference, or the asset was never tracked (uploaded before dedup).
+    """
+    resp = await db_manager.admin_client.rpc("release_media_asset", {"p_public_id": public_id}).execute()
+    remaining = resp.data
+    return remaining is None or remaining <= 0
+
+async def refresh_asset(content_hash: str, public_id: str, media_url: Optional[str], thumbnail_url: Optional[str], file_metadata: Dict[str, Any]):
+    """Copies the processed URLs onto the asset so later dedup hits get the eager versions too."""
+    await db_manager.admin_client.table("media_assets").update({
+        "media_url": media_url,
+        "thumbnail_url": thumbnail_url,
+        "file_metadata": file_metadata,
+    }).eq("content_hash", content_hash).eq("public_id", public_id).execute()
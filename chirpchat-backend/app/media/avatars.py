@@ -0,0 +1,49 @@
+
+import asyncio
+import io
+from typing import AsyncIterable, Dict, Optional
+from uuid import UUID
+
+import cloudinary
+import cloudinary.uploader
+from fastapi import HTTPException, status
+from PIL import Image, ImageOps
+
+from app.media.processing import run_in_process_pool
+from app.utils.logging import logger
+from app.utils.security import read_validated_upload
+
+AVATAR_SIZES = (64, 128, 512)
+AVATAR_LIST_SIZE = 128 # Stored as users.avatar_url, the size embedded in chat lists and presence updates.
+AVATAR_ALLOWED_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp"}
+MAX_AVATAR_SIZE = 5 * 1024 * 1024 # 5MB
+AVATAR_WEBP_QUALITY = 80
+AVATAR_FOLDER = "avatars"
+
+def render_avatar_variants(image_bytes: bytes) -> Dict[int, bytes]:
+    """Runs in the process pool. Square-crops the image and encodes one WebP per AVATAR_SIZES entry."""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        variants = {}
+        for size in AVATAR_SIZES:
+            output = io.BytesIO()
+            ImageOps.fit(image, (size, size), Image.LANCZOS).save(output, format="WEBP", quality=AVATAR_WEBP_QUALITY, method=4)
+            variants[size] = output.getvalue()
+        return variants
+
+def _upload_variant(user_id: UUID, size: int, data: bytes) -> str:
+    result = cloudinary.uploader.upload(io.BytesIO(data), public_id=f"{AVATAR_FOLDER}/user_{user_id}/{size}", resource_type="image", format="webp", overwrite=True, invalidate=True)
+    return result["secure_url"]
+
+async def upload_avatar(user_id: UUID, chunks: AsyncIterable[bytes], declared_size: Optional[int] = None) -> Dict[str, str]:
+    """Validates, resizes and uploads an avatar streamed as chunks. Returns the variant URLs keyed by pixel size."""
+    image_bytes = await read_validated_upload(chunks, AVATAR_ALLOWED_TYPES, MAX_AVATAR_SIZE, declared_size)
+    try:
+        variants = await run_in_process_pool(render_avatar_variants, image_bytes)
+    except Exception as e:
+        logger.warning(f"Could not decode avatar for user {user_id}: {e}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Could not read image.")
+    # Variants overwrite the previous avatar's public_ids, so nothing is left to clean up.
+    urls = await asyncio.gather(*[asyncio.to_thread(_upload_variant, user_id, size, data) for size, data in variants.items()])
+    return {str(size): url for size, url in zip(variants, urls)}
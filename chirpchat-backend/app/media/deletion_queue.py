@@ -0,0 +1,124 @@
+
+import asyncio
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+import cloudinary
+import cloudinary.api
+
+from app.redis_client import get_redis_client
+from app.utils.logging import logger
+
+# Pending deletions live in a sorted set scored by the time they are next due, so they
+# survive restarts and any instance's worker can pick them up.
+DELETION_QUEUE_KEY = "cloudinary_deletions"
+DELETION_ATTEMPTS_KEY = "cloudinary_deletion_attempts"
+DELETION_FAILED_KEY = "cloudinary_deletions_failed"
+DELETION_BATCH_SIZE = 100 # Admin API limit for one delete_resources call.
+DELETION_CLAIM_SIZE = DELETION_BATCH_SIZE * 5
+DELETION_POLL_INTERVAL_SECONDS = 5
+DELETION_LEASE_SECONDS = 120
+DELETION_RETRY_BASE_DELAY_SECONDS = 10
+DELETION_RETRY_MAX_DELAY_SECONDS = 60 * 60
+DELETION_MAX_ATTEMPTS = 8
+DEFAULT_DELIVERY_TYPE = "private" # Matches the type signed in build_upload_signature.
+
+# Takes the due members and pushes their score out by the lease in one step, so
+# workers on other instances don't pick up the same batch while it is in flight.
+CLAIM_DUE_DELETIONS_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[3])
+for _, member in ipairs(due) do redis.call('ZADD', KEYS[1], ARGV[2], member) end
+return due
+"""
+
+def _member(public_id: str, resource_type: str, delivery_type: str) -> str:
+    return f"{resource_type}:{delivery_type}:{public_id}"
+
+def _parse_member(member: str) -> Tuple[str, str, str]:
+    resource_type, delivery_type, public_id = member.split(":", 2)
+    return resource_type, delivery_type, public_id
+
+async def enqueue_deletions(assets: Iterable[Tuple[str, str]], delivery_type: str = DEFAULT_DELIVERY_TYPE):
+    """Queues (public_id, resource_type) pairs for deletion. Re-queueing an asset that is already pending is a no-op."""
+    mapping = {_member(public_id, resource_type, delivery_type): time.time() for public_id, resource_type in assets}
+    if not mapping: return
+    redis = await get_redis_client()
+    await redis.zadd(DELETION_QUEUE_KEY, mapping, nx=True)
+
+async def enqueue_deletion(public_id: str, resource_type: str, delivery_type: str = DEFAULT_DELIVERY_TYPE):
+    await enqueue_deletions([(public_id, resource_type)], delivery_type)
+
+def _retry_delay(attempts: int) -> float:
+    return min(DELETION_RETRY_MAX_DELAY_SECONDS, DELETION_RETRY_BASE_DELAY_SECONDS * (2 ** (attempts - 1)))
+
+async def _mark_done(redis, members: List[str]):
+    if not members: return
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.zrem(DELETION_QUEUE_KEY, *members)
+        pipe.hdel(DELETION_ATTEMPTS_KEY, *members)
+        await pipe.execute()
+
+async def _reschedule(redis, members: List[str], reason: str):
+    """Backs off each member by its own attempt count; members past DELETION_MAX_ATTEMPTS move to the failed set."""
+    if not members: return
+    async with redis.pipeline(transaction=False) as pipe:
+        for member in members: pipe.hincrby(DELETION_ATTEMPTS_KEY, member, 1)
+        attempts = await pipe.execute()
+    now = time.time()
+    async with redis.pipeline(transaction=False) as pipe:
+        for member, attempt in zip(members, attempts):
+            if attempt >= DELETION_MAX_ATTEMPTS:
+                logger.error(f"Giving up on Cloudinary deletion of {member} after {attempt} attempts: {reason}")
+                pipe.zrem(DELETION_QUEUE_KEY, member)
+                pipe.hdel(DELETION_ATTEMPTS_KEY, member)
+                pipe.zadd(DELETION_FAILED_KEY, {member: now})
+            else:
+                pipe.zadd(DELETION_QUEUE_KEY, {member: now + _retry_delay(attempt)}, xx=True)
+        await pipe.execute()
+
+async def _delete_batch(redis, resource_type: str, delivery_type: str, members: List[str]):
+    public_ids = [_parse_member(member)[2] for member in members]
+    try:
+        # The SDK is synchronous; run it off the event loop.
+        result = await asyncio.to_thread(cloudinary.api.delete_resources, public_ids, resource_type=resource_type, type=delivery_type, invalidate=True)
+    except Exception as e:
+        logger.warning(f"Cloudinary bulk delete of {len(public_ids)} {resource_type} assets failed: {e}")
+        await _reschedule(redis, members, str(e))
+        return
+
+    statuses = result.get("deleted", {})
+    done = [member for member, public_id in zip(members, public_ids) if statuses.get(public_id) in ("deleted", "not_found")]
+    failed = [member for member, public_id in zip(members, public_ids) if statuses.get(public_id) not in ("deleted", "not_found")]
+    await _mark_done(redis, done)
+    await _reschedule(redis, failed, "not reported as deleted")
+    if done: logger.info(f"Deleted {len(done)} Cloudinary {resource_type} assets.")
+
+async def process_due_deletions() -> int:
+    """Runs one pass over the due deletions, one Admin API call per resource type and delivery type per 100 assets."""
+    redis = await get_redis_client()
+    now = time.time()
+    claimed = await redis.eval(CLAIM_DUE_DELETIONS_SCRIPT, 1, DELETION_QUEUE_KEY, now, now + DELETION_LEASE_SECONDS, DELETION_CLAIM_SIZE)
+    if not claimed: return 0
+
+    groups: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+    for member in claimed:
+        resource_type, delivery_type, _ = _parse_member(member)
+        groups[(resource_type, delivery_type)].append(member)
+    for (resource_type, delivery_type), members in groups.items():
+        for i in range(0, len(members), DELETION_BATCH_SIZE):
+            await _delete_batch(redis, resource_type, delivery_type, members[i:i + DELETION_BATCH_SIZE])
+    return len(claimed)
+
+async def run_deletion_worker():
+    """Drains the deletion queue for this instance; intended to be launched at app startup."""
+    logger.info("Cloudinary deletion worker starting.")
+    while True:
+        try:
+            # Keep going while there is a backlog; otherwise poll.
+            if await process_due_deletions() >= DELETION_CLAIM_SIZE: continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in Cloudinary deletion worker: {e}", exc_info=True)
+        await asyncio.sleep(DELETION_POLL_INTERVAL_SECONDS)
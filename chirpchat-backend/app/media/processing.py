@@ -0,0 +1,152 @@
+
+import array
+import asyncio
+import io
+import math
+import sys
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import cloudinary.utils
+import mutagen
+import requests
+from PIL import Image
+
+from app.config import settings
+from app.utils.logging import logger
+
+# Post-processing runs after Cloudinary has accepted an asset. The work is CPU-bound
+# (decoding, resampling), so it happens in a process pool rather than on the event loop.
+WAVEFORM_BUCKETS = 64
+WAVEFORM_SAMPLE_RATE = 8000
+MEDIA_DOWNLOAD_TIMEOUT_SECONDS = 20
+AUDIO_CLIP_TYPE = "audio"
+AUDIO_MESSAGE_SUBTYPES = {"voice_message", "audio"}
+PLACEHOLDER_SOURCE_SIZE = 32 # BlurHash only keeps a few frequency components, so a tiny rendition is enough.
+BLURHASH_COMPONENTS = (4, 3)
+BASE83_CHARACTERS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=settings.MEDIA_PROCESS_POOL_SIZE)
+    return _process_pool
+
+async def run_in_process_pool(func: Callable, *args) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(get_process_pool(), func, *args)
+
+def _download(url: str) -> bytes:
+    response = requests.get(url, timeout=MEDIA_DOWNLOAD_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    return response.content
+
+def compute_waveform_peaks(pcm_wav: bytes, buckets: int = WAVEFORM_BUCKETS) -> List[int]:
+    """Downsamples 16-bit PCM to `buckets` peak values scaled to 0-255, loudest bucket = 255."""
+    with wave.open(io.BytesIO(pcm_wav)) as wav:
+        if wav.getsampwidth() != 2: raise ValueError(f"Expected 16-bit PCM, got {wav.getsampwidth() * 8}-bit")
+        samples = array.array("h", wav.readframes(wav.getnframes()))
+    if sys.byteorder == "big": samples.byteswap()
+    if not samples: return [0] * buckets
+
+    # Channels are interleaved; bucketing by sample index still covers each channel evenly.
+    bucket_size = max(1, len(samples) // buckets)
+    peaks = [max((abs(s) for s in samples[i * bucket_size:(i + 1) * bucket_size]), default=0) for i in range(buckets)]
+    loudest = max(peaks) or 1
+    return [round(peak * 255 / loudest) for peak in peaks]
+
+def analyze_audio(source_url: str, pcm_url: str) -> Dict[str, Any]:
+    """
+    Runs in the process pool. Duration comes from mutagen on the file users actually play;
+    peaks come from a low-rate WAV rendition Cloudinary transcodes for us, so no decoder is needed here.
+    """
+    pcm_wav = _download(pcm_url)
+    duration = None
+    try:
+        parsed = mutagen.File(io.BytesIO(_download(source_url)))
+        if parsed is not None and parsed.info and parsed.info.length: duration = parsed.info.length
+    except Exception:
+        pass # Containers mutagen can't read (e.g. webm); fall back to the WAV's length below.
+    if duration is None:
+        with wave.open(io.BytesIO(pcm_wav)) as wav: duration = wav.getnframes() / float(wav.getframerate())
+    return {"waveform": compute_waveform_peaks(pcm_wav), "duration_ms": round(duration * 1000)}
+
+def is_audio_message(media_type: Optional[str], file_metadata: Dict[str, Any]) -> bool:
+    return media_type in AUDIO_MESSAGE_SUBTYPES or (media_type == "clip" and file_metadata.get("clip_type") == AUDIO_CLIP_TYPE)
+
+async def compute_audio_metadata(public_id: str, resource_type: str, file_format: str) -> Dict[str, Any]:
+    """Returns the file_metadata keys for an audio asset: waveform, duration_ms and duration_seconds. Empty on failure."""
+    source_url = cloudinary.utils.cloudinary_url(public_id, resource_type=resource_type, type="private", format=file_format, sign_url=True)[0]
+    pcm_url = cloudinary.utils.cloudinary_url(public_id, resource_type=resource_type, type="private", format="wav", transformation=[{"audio_frequency": WAVEFORM_SAMPLE_RATE}], sign_url=True)[0]
+    try:
+        analysis = await run_in_process_pool(analyze_audio, source_url, pcm_url)
+    except Exception as e:
+        logger.error(f"Audio analysis failed for {public_id}: {e}", exc_info=True)
+        return {}
+    return {**analysis, "duration_seconds": round(analysis["duration_ms"] / 1000)}
+
+def _base83(value: int, length: int) -> str:
+    return "".join(BASE83_CHARACTERS[(value // (83 ** (length - i - 1))) % 83] for i in range(length))
+
+def _srgb_to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+def _linear_to_srgb(value: float) -> int:
+    v = min(1.0, max(0.0, value))
+    return int(v * 12.92 * 255 + 0.5) if v <= 0.0031308 else int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+def encode_blurhash(image: "Image.Image", x_components: int, y_components: int) -> str:
+    """Encodes an RGB image as a BlurHash string (https://blurha.sh), a ~20-30 character placeholder."""
+    width, height = image.size
+    pixels = [tuple(_srgb_to_linear(c) for c in pixel) for pixel in image.getdata()]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            normalisation = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                for x in range(width):
+                    basis = cos_x[i][x] * cos_y[j][y]
+                    pr, pg, pb = pixels[y * width + x]
+                    r += basis * pr; g += basis * pg; b += basis * pb
+            scale = normalisation / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    blurhash = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised_max = max(0, min(82, int(max(abs(v) for f in ac for v in f) * 166 - 0.5)))
+        max_value = (quantised_max + 1) / 166
+        blurhash += _base83(quantised_max, 1)
+    else:
+        max_value = 1.0
+        blurhash += _base83(0, 1)
+    blurhash += _base83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+
+    def quantise(v: float) -> int:
+        return max(0, min(18, int(math.copysign(abs(v / max_value) ** 0.5, v) * 9 + 9.5)))
+    for r, g, b in ac:
+        blurhash += _base83(quantise(r) * 19 * 19 + quantise(g) * 19 + quantise(b), 2)
+    return blurhash
+
+def analyze_image(placeholder_url: str) -> Dict[str, Any]:
+    """Runs in the process pool. Builds the placeholder from a tiny rendition, oriented like the original."""
+    with Image.open(io.BytesIO(_download(placeholder_url))) as image:
+        image = image.convert("RGB")
+        x_components, y_components = BLURHASH_COMPONENTS if image.width >= image.height else BLURHASH_COMPONENTS[::-1]
+        return {"blurhash": encode_blurhash(image, x_components, y_components)}
+
+async def compute_image_metadata(public_id: str) -> Dict[str, Any]:
+    """Returns the file_metadata keys for an image asset: blurhash. Empty on failure."""
+    placeholder_url = cloudinary.utils.cloudinary_url(public_id, resource_type="image", type="private", format="jpg", transformation=[{"width": PLACEHOLDER_SOURCE_SIZE, "height": PLACEHOLDER_SOURCE_SIZE, "crop": "fit"}], sign_url=True)[0]
+    try:
+        return await run_in_process_pool(analyze_image, placeholder_url)
+    except Exception as e:
+        logger.error(f"Placeholder generation failed for {public_id}: {e}", exc_info=True)
+        return {}
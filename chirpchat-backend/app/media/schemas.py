@@ -0,0 +1,121 @@
+
+from pydantic import BaseModel, Field
+from typing import List, Optional, Dict, Any, Literal
+from uuid import UUID
+from datetime import datetime
+
+class EagerTransformation(BaseModel):
+    transformation: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    bytes: Optional[int] = None
+    format: str
+    url: str
+    secure_url: str
+
+class CloudinaryWebhookPayload(BaseModel):
+    public_id: str
+    version: int
+    asset_id: str
+    resource_type: str
+    format: str
+    bytes: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+    url: str
+    secure_url: str
+    duration: Optional[float] = None
+    original_filename: Optional[str] = None
+    eager: Optional[List[EagerTransformation]] = Field(None)
+    notification_type: str
+
+class UploadSignatureResponse(BaseModel):
+    signature: str
+    timestamp: int
+    api_key: str
+    cloud_name: str
+    public_id: str
+    folder: str
+    resource_type: str
+    upload_preset: str
+    eager: Optional[str] = None
+    notification_url: Optional[str] = None
+    type: str
+
+UploadMessageSubtype = Literal["image", "clip", "document", "voice_message"]
+
+class UploadQueueCreate(BaseModel):
+    chat_id: UUID
+    temp_message_id: UUID
+    file_name: str = Field(..., max_length=255)
+    file_type: str = Field(..., max_length=255)
+    file_size: int = Field(..., gt=0)
+    message_subtype: UploadMessageSubtype
+    file_metadata: Dict[str, Any] = Field(default_factory=dict)
+
+class UploadQueueItem(BaseModel):
+    id: UUID
+    user_id: UUID
+    chat_id: UUID
+    temp_message_id: UUID
+    file_name: str
+    file_type: str
+    file_size: int
+    file_metadata: Dict[str, Any] = Field(default_factory=dict)
+    upload_priority: int
+    status: str
+    retry_count: int = 0
+    max_retries: int = 3
+    error_message: Optional[str] = None
+    scheduled_retry: Optional[datetime] = None
+    created_at: datetime
+    updated_at: datetime
+
+class UploadClaimRequest(BaseModel):
+    limit: int = Field(3, ge=1, le=10)
+
+class ClaimedUpload(BaseModel):
+    item: UploadQueueItem
+    signature: UploadSignatureResponse
+
+class UploadClaimResponse(BaseModel):
+    uploads: List[ClaimedUpload]
+
+class UploadSignatureBatchRequest(BaseModel):
+    item_ids: List[UUID] = Field(..., min_length=1, max_length=20)
+
+class UploadSignatureBatchResponse(BaseModel):
+    signatures: List[UploadSignatureResponse]
+
+class UploadProgressUpdate(BaseModel):
+    progress: float = Field(..., ge=0, le=1)
+    bytes_uploaded: Optional[int] = None
+
+class UploadFailureReport(BaseModel):
+    error_message: str = Field(..., max_length=500)
+    retryable: bool = True
+
+class UploadQueueStats(BaseModel):
+    pending: int
+    uploading: int
+    retry_scheduled: int
+    failed: int
+    completed_total: int
+    avg_time_to_ready_seconds: Optional[float] = None
+
+class UploadQueueGlobalStats(BaseModel):
+    completed_total: int
+    avg_time_to_ready_seconds: Optional[float] = None
+
+# Lowercase hex SHA-256 of the file's bytes, computed by the client before uploading.
+CONTENT_HASH_PATTERN = r"^[0-9a-f]{64}$"
+
+class MediaMessageByHashCreate(BaseModel):
+    client_temp_id: str
+    content_hash: str = Field(..., pattern=CONTENT_HASH_PATTERN)
+    media_type: UploadMessageSubtype
+
+class MediaMessageForwardCreate(BaseModel):
+    client_temp_id: str
+    source_message_id: UUID
+    media_type: UploadMessageSubtype
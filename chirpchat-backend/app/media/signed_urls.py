@@ -0,0 +1,67 @@
+
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from app.redis_client import get_redis_client
+from app.utils.cache import ExpiringCache
+from app.utils.logging import logger
+from app.websocket import manager as ws_manager
+
+SIGNED_URL_TTL_SECONDS = 600 # 10 minutes expiry
+SIGNED_URL_REFRESH_MARGIN_SECONDS = 60
+SIGNED_URL_REVOKED_PREFIX = "signed_url_revoked:"
+
+# Keyed by (message_id, version, user_id) -> (url, expires_at, chat_id, message created_at); entries are
+# dropped shortly before the URL itself expires. The cache is per instance, so a hit is only served after
+# re-checking, through Redis, that the message was not deleted and the user can still see it.
+signed_url_cache = ExpiringCache(max_entries=20_000)
+
+def cache_signed_url(message_id: UUID, version: str, user_id: UUID, signed_url: str, expires_at: int, chat_id: str, created_at: Optional[str]):
+    signed_url_cache.set((str(message_id), version, str(user_id)), (signed_url, expires_at, str(chat_id), created_at), expires_at - SIGNED_URL_REFRESH_MARGIN_SECONDS)
+
+def is_hidden_by_clear(created_at: Optional[str], cleared_at: Optional[str]) -> bool:
+    """Whether a message created at created_at is behind the reader's cleared_at watermark."""
+    if not created_at or not cleared_at: return False
+    return datetime.fromisoformat(created_at) <= datetime.fromisoformat(cleared_at)
+
+async def revoke_signed_urls(message_id: UUID):
+    """Stops every instance from serving cached URLs for a deleted message, for as long as those URLs could live."""
+    try:
+        redis = await get_redis_client()
+        await redis.set(f"{SIGNED_URL_REVOKED_PREFIX}{message_id}", int(time.time()), ex=SIGNED_URL_TTL_SECONDS)
+    except Exception as e:
+        logger.error(f"Could not revoke cached signed URLs for message {message_id}: {e}", exc_info=True)
+
+async def get_cached_signed_urls(user_id: UUID, items: List[Tuple[UUID, str]]) -> List[Optional[Tuple[str, int]]]:
+    """
+    Looks up (message_id, version) pairs in the cache and returns (url, expires_at) for each hit that is
+    still allowed, None otherwise. Costs one MGET for the revocation markers plus one membership lookup
+    (itself cached in Redis) per chat among the hits; misses cost nothing.
+    """
+    keys = [(str(message_id), version, str(user_id)) for message_id, version in items]
+    entries = [signed_url_cache.get(key) for key in keys]
+    hit_indexes = [i for i, entry in enumerate(entries) if entry]
+    if not hit_indexes: return [None] * len(items)
+    try:
+        redis = await get_redis_client()
+        revoked = await redis.mget([f"{SIGNED_URL_REVOKED_PREFIX}{keys[i][0]}" for i in hit_indexes])
+        memberships: Dict[str, Optional[dict]] = {}
+        for i in hit_indexes:
+            chat_id = entries[i][2]
+            if chat_id not in memberships: memberships[chat_id] = await ws_manager.get_chat_membership(user_id, UUID(chat_id))
+    except Exception as e:
+        # Without the re-check a hit can't be trusted; fall back to the full authorization path.
+        logger.warning(f"Could not re-check cached signed URLs: {e}")
+        return [None] * len(items)
+    results: List[Optional[Tuple[str, int]]] = [None] * len(items)
+    for i, is_revoked in zip(hit_indexes, revoked):
+        url, expires_at, chat_id, created_at = entries[i]
+        membership = memberships[chat_id]
+        cleared_at = membership.get("cleared_at") if membership else None
+        if is_revoked or membership is None or is_hidden_by_clear(created_at, cleared_at):
+            signed_url_cache.delete(keys[i])
+            continue
+        results[i] = (url, expires_at)
+    return results
@@ -0,0 +1,194 @@
+
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from app.database import db_manager
+from app.media.schemas import UploadQueueCreate
+from app.redis_client import get_redis_client
+from app.utils.logging import logger
+
+# Higher runs first (idx_upload_queue_priority sorts upload_priority DESC).
+UPLOAD_PRIORITY_BY_SUBTYPE = {"voice_message": 9, "image": 7, "document": 5, "clip": 3}
+LARGE_UPLOAD_BYTES = 25 * 1024 * 1024
+LARGE_UPLOAD_PRIORITY_PENALTY = 2
+RETRY_BASE_DELAY_SECONDS = 5
+RETRY_MAX_DELAY_SECONDS = 10 * 60
+UPLOAD_PROGRESS_PREFIX = "upload_progress:"
+UPLOAD_PROGRESS_TTL_SECONDS = 60 * 60
+UPLOAD_QUEUE_STATS_KEY = "upload_queue_stats"
+UPLOAD_QUEUE_USER_STATS_PREFIX = "upload_queue_stats:"
+CLAIMABLE_STATUSES = ["pending", "failed"]
+ACTIVE_STATUSES = ["pending", "uploading"] # Statuses an upload can report progress or failure from.
+
+def compute_upload_priority(message_subtype: str, file_size: int) -> int:
+    """Small, latency-sensitive uploads (voice notes) go ahead of large videos."""
+    priority = UPLOAD_PRIORITY_BY_SUBTYPE.get(message_subtype, 5)
+    if file_size >= LARGE_UPLOAD_BYTES: priority -= LARGE_UPLOAD_PRIORITY_PENALTY
+    return max(priority, 1)
+
+def compute_retry_delay(retry_count: int) -> float:
+    """Exponential backoff with jitter so failed uploads from many clients don't retry in lockstep."""
+    delay = min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * (2 ** retry_count))
+    return delay * random.uniform(0.8, 1.2)
+
+def resource_type_for(file_type: str) -> str:
+    if file_type.startswith("image/"): return "image"
+    if file_type.startswith(("video/", "audio/")): return "video" # Cloudinary handles audio as video.
+    return "raw"
+
+def _parse_temp_message_id(public_id: str) -> Optional[str]:
+    """Queue items are keyed by the client's temp message id, which the client also uses as the Cloudinary public_id."""
+    try:
+        return str(UUID(public_id.rsplit("/", 1)[-1]))
+    except (ValueError, AttributeError):
+        return None
+
+async def enqueue_upload(user_id: UUID, upload: UploadQueueCreate) -> Optional[Dict[str, Any]]:
+    now = datetime.now(timezone.utc).isoformat()
+    item_data = {
+        "user_id": str(user_id),
+        "chat_id": str(upload.chat_id),
+        "temp_message_id": str(upload.temp_message_id),
+        "file_name": upload.file_name,
+        "file_type": upload.file_type,
+        "file_size": upload.file_size,
+        "file_metadata": {**upload.file_metadata, "message_subtype": upload.message_subtype},
+        "upload_priority": compute_upload_priority(upload.message_subtype, upload.file_size),
+        "status": "pending",
+        "updated_at": now,
+    }
+    table = db_manager.admin_client.table("upload_queue")
+    # temp_message_id is unique, so re-enqueueing the same file after a client restart leaves the existing
+    # item (and its progress, retries or completion) untouched and returns it.
+    resp = await table.upsert(item_data, on_conflict="temp_message_id", ignore_duplicates=True).execute()
+    if resp.data: return resp.data[0]
+    existing_resp = await table.select("*").eq("temp_message_id", str(upload.temp_message_id)).eq("user_id", str(user_id)).maybe_single().execute()
+    # No row of ours: the temp_message_id belongs to another user's item.
+    return existing_resp.data if existing_resp and existing_resp.data else None
+
+async def claim_uploads(user_id: UUID, limit: int) -> List[Dict[str, Any]]:
+    """
+    Claims the user's next uploads: pending items by priority, plus failed items whose retry is due.
+    Each claim is a conditional status update, so two devices can't start the same upload.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    table = db_manager.admin_client.table("upload_queue")
+    pending_resp = await table.select("*").eq("user_id", str(user_id)).eq("status", "pending").order("upload_priority", desc=True).order("created_at").limit(limit).execute()
+    retry_resp = await table.select("*").eq("user_id", str(user_id)).eq("status", "failed").lte("scheduled_retry", now).order("scheduled_retry").limit(limit).execute()
+    candidates = sorted((pending_resp.data or []) + (retry_resp.data or []), key=lambda item: (-item["upload_priority"], item["created_at"]))
+
+    claimed = []
+    for item in candidates[:limit]:
+        update_resp = await table.update({"status": "uploading", "scheduled_retry": None, "updated_at": now}).eq("id", item["id"]).in_("status", CLAIMABLE_STATUSES).execute()
+        if update_resp.data: claimed.append(update_resp.data[0])
+    return claimed
+
+async def get_user_items(user_id: UUID, item_ids: List[UUID]) -> List[Dict[str, Any]]:
+    resp = await db_manager.admin_client.table("upload_queue").select("*").eq("user_id", str(user_id)).in_("id", [str(i) for i in item_ids]).execute()
+    return resp.data or []
+
+async def record_progress(user_id: UUID, item_id: UUID, progress: float, bytes_uploaded: Optional[int]) -> bool:
+    """
+    Progress is high-frequency and disposable, so it lives in Redis rather than in upload_queue.
+    Returns False, recording nothing, unless the item is the user's and still pending or uploading.
+    """
+    item_resp = await db_manager.admin_client.table("upload_queue").select("id").eq("id", str(item_id)).eq("user_id", str(user_id)).in_("status", ACTIVE_STATUSES).maybe_single().execute()
+    if not item_resp or not item_resp.data: return False
+    redis = await get_redis_client()
+    key = f"{UPLOAD_PROGRESS_PREFIX}{item_id}"
+    mapping = {"user_id": str(user_id), "progress": progress, "updated_at": datetime.now(timezone.utc).isoformat()}
+    if bytes_uploaded is not None: mapping["bytes_uploaded"] = bytes_uploaded
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, UPLOAD_PROGRESS_TTL_SECONDS)
+        await pipe.execute()
+    return True
+
+async def _record_time_to_ready(item: Dict[str, Any]):
+    created_at = datetime.fromisoformat(str(item["created_at"]).replace("Z", "+00:00"))
+    seconds = max(0.0, (datetime.now(timezone.utc) - created_at).total_seconds())
+    redis = await get_redis_client()
+    async with redis.pipeline(transaction=False) as pipe:
+        for key in (UPLOAD_QUEUE_STATS_KEY, f"{UPLOAD_QUEUE_USER_STATS_PREFIX}{item['user_id']}"):
+            pipe.hincrby(key, "completed", 1)
+            pipe.hincrbyfloat(key, "time_to_ready_seconds_total", seconds)
+        pipe.delete(f"{UPLOAD_PROGRESS_PREFIX}{item['id']}")
+        await pipe.execute()
+
+async def _complete_where(**filters) -> Optional[Dict[str, Any]]:
+    query = db_manager.admin_client.table("upload_queue").update({"status": "completed", "error_message": None, "scheduled_retry": None, "updated_at": datetime.now(timezone.utc).isoformat()})
+    for column, value in filters.items(): query = query.eq(column, value)
+    resp = await query.neq("status", "completed").execute()
+    if not resp.data: return None
+    await _record_time_to_ready(resp.data[0])
+    return resp.data[0]
+
+async def complete_upload(user_id: UUID, item_id: UUID) -> Optional[Dict[str, Any]]:
+    return await _complete_where(id=str(item_id), user_id=str(user_id))
+
+async def fail_upload(user_id: UUID, item_id: UUID, error_message: str, retryable: bool) -> Optional[Dict[str, Any]]:
+    """
+    Records a failure and schedules the next attempt; after max_retries the item stays failed with no retry.
+    Only pending or uploading items of the user can fail; returns None for anything else.
+    """
+    table = db_manager.admin_client.table("upload_queue")
+    item_resp = await table.select("id, retry_count, max_retries").eq("id", str(item_id)).eq("user_id", str(user_id)).in_("status", ACTIVE_STATUSES).maybe_single().execute()
+    if not item_resp or not item_resp.data: return None
+    retry_count = (item_resp.data.get("retry_count") or 0) + 1
+    scheduled_retry = None
+    if retryable and retry_count <= (item_resp.data.get("max_retries") or 0):
+        scheduled_retry = (datetime.now(timezone.utc) + timedelta(seconds=compute_retry_delay(retry_count - 1))).isoformat()
+    update_resp = await table.update({
+        "status": "failed",
+        "retry_count": retry_count,
+        "error_message": error_message,
+        "scheduled_retry": scheduled_retry,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }).eq("id", str(item_id)).eq("user_id", str(user_id)).in_("status", ACTIVE_STATUSES).execute()
+    if not update_resp.data: return None # Completed or failed concurrently.
+    redis = await get_redis_client()
+    await redis.delete(f"{UPLOAD_PROGRESS_PREFIX}{item_id}")
+    return update_resp.data[0]
+
+async def mark_uploads_started(user_id: UUID, public_ids: List[str]):
+    """Called when a client requests signatures directly, so the queue reflects uploads it didn't hand out."""
+    temp_message_ids = [t for t in (_parse_temp_message_id(p) for p in public_ids) if t]
+    if not temp_message_ids: return
+    try:
+        await db_manager.admin_client.table("upload_queue").update({"status": "uploading", "updated_at": datetime.now(timezone.utc).isoformat()}).in_("temp_message_id", temp_message_ids).eq("user_id", str(user_id)).in_("status", CLAIMABLE_STATUSES).execute()
+    except Exception as e:
+        logger.error(f"Could not mark {len(temp_message_ids)} uploads as started: {e}", exc_info=True)
+
+async def mark_upload_started(user_id: UUID, public_id: str):
+    await mark_uploads_started(user_id, [public_id])
+
+async def mark_upload_ready(public_id: str):
+    """Called from the webhook pipeline once Cloudinary has processed the asset."""
+    temp_message_id = _parse_temp_message_id(public_id)
+    if not temp_message_id: return
+    try:
+        await _complete_where(temp_message_id=temp_message_id)
+    except Exception as e:
+        logger.error(f"Could not mark upload {temp_message_id} as ready: {e}", exc_info=True)
+
+async def _completion_stats(key: str) -> Dict[str, Any]:
+    redis = await get_redis_client()
+    totals = await redis.hgetall(key)
+    completed = int(totals.get("completed", 0))
+    time_total = float(totals.get("time_to_ready_seconds_total", 0))
+    return {"completed_total": completed, "avg_time_to_ready_seconds": round(time_total / completed, 2) if completed else None}
+
+async def get_queue_stats(user_id: UUID) -> Dict[str, Any]:
+    """The user's queue depth by state, and completions and time to ready for the user's uploads only."""
+    resp = await db_manager.admin_client.table("upload_queue").select("status, scheduled_retry").eq("user_id", str(user_id)).in_("status", ["pending", "uploading", "failed"]).execute()
+    counts = {"pending": 0, "uploading": 0, "retry_scheduled": 0, "failed": 0}
+    for item in resp.data or []:
+        if item["status"] == "failed": counts["retry_scheduled" if item.get("scheduled_retry") else "failed"] += 1
+        else: counts[item["status"]] += 1
+    return {**counts, **await _completion_stats(f"{UPLOAD_QUEUE_USER_STATS_PREFIX}{user_id}")}
+
+async def get_global_queue_stats() -> Dict[str, Any]:
+    """Completions and average time to ready across all users."""
+    return await _completion_stats(UPLOAD_QUEUE_STATS_KEY)
@@ -0,0 +1,198 @@
+
+import asyncio
+import json
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from redis.exceptions import ResponseError
+
+from app.chat.routes import get_message_with_details_from_db
+from app.config import settings
+from app.database import db_manager
+from app.media import assets as media_assets
+from app.media import processing, upload_queue
+from app.media.schemas import CloudinaryWebhookPayload, EagerTransformation
+from app.redis_client import get_redis_client
+from app.utils.logging import logger
+from app.websocket import manager as ws_manager
+
+WEBHOOK_STREAM_KEY = "cloudinary_webhooks"
+WEBHOOK_CONSUMER_GROUP = "cloudinary_webhook_workers"
+WEBHOOK_SEEN_PREFIX = "cloudinary_webhook_seen:"
+WEBHOOK_SEEN_TTL_SECONDS = 60 * 60 * 24
+WEBHOOK_STREAM_MAXLEN = 10000
+WEBHOOK_READ_BATCH_SIZE = 50
+WEBHOOK_READ_BLOCK_MS = 5000
+WEBHOOK_RECLAIM_IDLE_MS = 60 * 1000
+WEBHOOK_MAX_DELIVERIES = 5
+
+def map_eager_to_urls(eager_list: Optional[List[EagerTransformation]], resource_type: str) -> dict:
+    urls = {}
+    if not eager_list:
+        return urls
+
+    for t in eager_list:
+        if resource_type == "image":
+            if "w_250" in t.transformation:
+                urls["thumbnail_250"] = t.secure_url.split(t.url.split('/')[-1])[0] + t.url.split('/')[-1]
+            elif "w_800" in t.transformation:
+                urls["preview_800"] = t.secure_url.split(t.url.split('/')[-1])[0] + t.url.split('/')[-1]
+        elif resource_type == "video":
+            if "sp_auto" in t.transformation and t.format == "m3u8":
+                urls["hls_manifest"] = t.secure_url.split(t.url.split('/')[-1])[0] + t.url.split('/')[-1]
+            if "f_jpg" in t.transformation:
+                urls["static_thumbnail"] = t.secure_url.split(t.url.split('/')[-1])[0] + t.url.split('/')[-1]
+            if "f_gif" in t.transformation:
+                urls["animated_preview"] = t.secure_url.split(t.url.split('/')[-1])[0] + t.url.split('/')[-1]
+            if t.format == "mp4":
+                urls["mp4_video"] = t.secure_url.split(t.url.split('/')[-1])[0] + t.url.split('/')[-1]
+            if t.format == "mp3":
+                urls["mp3_audio"] = t.secure_url.split(t.url.split('/')[-1])[0] + t.url.split('/')[-1]
+    return urls
+
+async def enqueue_webhook(payload: CloudinaryWebhookPayload, raw_body: bytes) -> bool:
+    """
+    Enqueues a verified notification for the worker pool.
+    Returns False if this asset_id + notification_type pair was already accepted (Cloudinary retry).
+    """
+    redis = await get_redis_client()
+    seen_key = f"{WEBHOOK_SEEN_PREFIX}{payload.asset_id}:{payload.notification_type}"
+    if not await redis.set(seen_key, "1", ex=WEBHOOK_SEEN_TTL_SECONDS, nx=True):
+        return False
+    try:
+        await redis.xadd(WEBHOOK_STREAM_KEY, {"public_id": payload.public_id, "body": raw_body.decode("utf-8")}, maxlen=WEBHOOK_STREAM_MAXLEN, approximate=True)
+    except Exception:
+        await redis.delete(seen_key)
+        raise
+    return True
+
+def _load_file_metadata(raw_metadata) -> dict:
+    if isinstance(raw_metadata, str):
+        try: raw_metadata = json.loads(raw_metadata)
+        except json.JSONDecodeError: return {}
+    return raw_metadata if isinstance(raw_metadata, dict) else {}
+
+async def process_asset_notifications(public_id: str, payloads: List[CloudinaryWebhookPayload]):
+    """
+    Applies every pending notification for one asset as a single DB update and a single broadcast.
+    The metadata is merged into what is stored by apply_media_notification (migration 013), so 'upload'
+    and 'eager' notifications can arrive in any order, and be handled by different workers at once.
+    """
+    message_resp = await db_manager.get_table("messages").select("id, chat_id, media_type, file_metadata").eq("client_temp_id", public_id).maybe_single().execute()
+    if not message_resp or not message_resp.data:
+        logger.warning(f"Webhook received for unknown public_id/client_temp_id: {public_id}")
+        return
+
+    message_db_id = message_resp.data['id']
+    chat_id = str(message_resp.data['chat_id'])
+    existing_metadata = _load_file_metadata(message_resp.data.get('file_metadata'))
+    latest = payloads[-1]
+
+    urls = {"original": latest.secure_url}
+    for payload in payloads:
+        urls.update(map_eager_to_urls(payload.eager, payload.resource_type))
+
+    # None values leave what is already stored in place (see merge_media_metadata).
+    media_metadata = {
+        "public_id": latest.public_id,
+        "resource_type": latest.resource_type,
+        "format": latest.format,
+        "bytes": latest.bytes,
+        # MessageInDB.duration_seconds is an int; keep the precise value in duration_ms.
+        "duration_seconds": round(latest.duration) if latest.duration is not None else None,
+        "duration_ms": round(latest.duration * 1000) if latest.duration is not None else None,
+        "width": latest.width or None,
+        "height": latest.height or None,
+        "urls": urls,
+    }
+    # Derived metadata is computed once per asset; a concurrent duplicate computes the same values.
+    if processing.is_audio_message(message_resp.data.get("media_type"), {**existing_metadata, **media_metadata}) and "waveform" not in existing_metadata:
+        media_metadata.update(await processing.compute_audio_metadata(latest.public_id, latest.resource_type, latest.format))
+    elif latest.resource_type == "image" and "blurhash" not in existing_metadata:
+        media_metadata.update(await processing.compute_image_metadata(latest.public_id))
+
+    merged_resp = await db_manager.admin_client.rpc("apply_media_notification", {
+        "p_message_id": str(message_db_id),
+        "p_metadata": media_metadata,
+        "p_media_url": latest.secure_url,
+        "p_file_size": latest.bytes,
+    }).execute()
+    if not merged_resp.data:
+        logger.warning(f"Message {message_db_id} for {public_id} disappeared before its media metadata could be stored.")
+        return
+    final_media_metadata = _load_file_metadata(merged_resp.data)
+    await upload_queue.mark_upload_ready(public_id)
+    if final_media_metadata.get("content_hash"):
+        final_urls = final_media_metadata.get("urls", {})
+        await media_assets.refresh_asset(final_media_metadata["content_hash"], latest.public_id, latest.secure_url, final_urls.get("static_thumbnail") or final_urls.get("thumbnail_250"), final_media_metadata)
+
+    updated_message = await get_message_with_details_from_db(message_db_id)
+    if updated_message:
+        await ws_manager.broadcast_media_processed(chat_id, updated_message)
+
+async def _process_entries(redis, entries: List[Tuple[str, Dict[str, str]]]):
+    """Groups a batch of stream entries by asset, processes each asset once and acks what succeeded."""
+    by_asset: "OrderedDict[str, List[Tuple[str, CloudinaryWebhookPayload]]]" = OrderedDict()
+    for entry_id, fields in entries:
+        try:
+            payload = CloudinaryWebhookPayload.model_validate_json(fields["body"])
+        except Exception as e:
+            logger.error(f"Dropping malformed webhook stream entry {entry_id}: {e}")
+            await redis.xack(WEBHOOK_STREAM_KEY, WEBHOOK_CONSUMER_GROUP, entry_id)
+            continue
+        by_asset.setdefault(payload.public_id, []).append((entry_id, payload))
+
+    for public_id, items in by_asset.items():
+        entry_ids = [entry_id for entry_id, _ in items]
+        try:
+            await process_asset_notifications(public_id, [payload for _, payload in items])
+            await redis.xack(WEBHOOK_STREAM_KEY, WEBHOOK_CONSUMER_GROUP, *entry_ids)
+        except Exception as e:
+            # Left pending; _reclaim_stale_entries retries it after WEBHOOK_RECLAIM_IDLE_MS.
+            logger.error(f"Error processing {len(entry_ids)} webhook notifications for {public_id}: {e}", exc_info=True)
+
+async def _reclaim_stale_entries(redis, consumer_name: str) -> List[Tuple[str, Dict[str, str]]]:
+    """Takes over entries another worker left pending, dropping those that keep failing."""
+    _, claimed, *_ = await redis.xautoclaim(WEBHOOK_STREAM_KEY, WEBHOOK_CONSUMER_GROUP, consumer_name, WEBHOOK_RECLAIM_IDLE_MS, "0-0", count=WEBHOOK_READ_BATCH_SIZE)
+    retryable = []
+    for entry_id, fields in claimed:
+        if not fields: # Trimmed from the stream while pending.
+            await redis.xack(WEBHOOK_STREAM_KEY, WEBHOOK_CONSUMER_GROUP, entry_id)
+            continue
+        pending = await redis.xpending_range(WEBHOOK_STREAM_KEY, WEBHOOK_CONSUMER_GROUP, min=entry_id, max=entry_id, count=1)
+        if pending and pending[0]["times_delivered"] > WEBHOOK_MAX_DELIVERIES:
+            logger.error(f"Giving up on webhook stream entry {entry_id} after {pending[0]['times_delivered']} deliveries.")
+            await redis.xack(WEBHOOK_STREAM_KEY, WEBHOOK_CONSUMER_GROUP, entry_id)
+        else:
+            retryable.append((entry_id, fields))
+    return retryable
+
+async def _ensure_consumer_group(redis):
+    try:
+        await redis.xgroup_create(WEBHOOK_STREAM_KEY, WEBHOOK_CONSUMER_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e): raise
+
+async def _run_worker(consumer_name: str):
+    logger.info(f"Webhook worker {consumer_name} starting.")
+    # Start with "0" to finish entries this consumer read before a restart, then switch to new ones.
+    read_id = "0"
+    while True:
+        try:
+            redis = await get_redis_client()
+            await _ensure_consumer_group(redis)
+            stale = await _reclaim_stale_entries(redis, consumer_name)
+            if stale: await _process_entries(redis, stale)
+            response = await redis.xreadgroup(WEBHOOK_CONSUMER_GROUP, consumer_name, {WEBHOOK_STREAM_KEY: read_id}, count=WEBHOOK_READ_BATCH_SIZE, block=WEBHOOK_READ_BLOCK_MS)
+            entries = response[0][1] if response else []
+            read_id = ">"
+            if entries: await _process_entries(redis, entries)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in webhook worker {consumer_name}: {e}", exc_info=True)
+            await asyncio.sleep(5)
+
+async def run_webhook_workers():
+    """Starts the webhook worker pool for this instance; intended to be launched at app startup."""
+    await asyncio.gather(*[_run_worker(f"{settings.SERVER_INSTANCE_ID}-{i}") for i in range(settings.WEBHOOK_WORKER_COUNT)])
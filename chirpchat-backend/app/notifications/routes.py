@@ -3,11 +3,12 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from typing import Optional
 from uuid import UUID
 
-from app.auth.dependencies import get_current_active_user
+from app.auth.dependencies import get_current_active_user, get_current_admin_user
 from app.auth.schemas import UserPublic
 from app.database import db_manager
 from app.utils.logging import logger
-from app.notifications.schemas import PushSubscriptionCreate, NotificationSettingsUpdate, NotificationSettingsResponse
+from app.notifications.schemas import PushSubscriptionCreate, NotificationSettingsUpdate, NotificationSettingsResponse, PushRoutingStats
+from app.notifications.service import notification_service
 from postgrest.exceptions import APIError
 
 router = APIRouter(prefix="/notifications", tags=["Notifications"])
@@ -141,7 +142,14 @@ async def update_notification_settings(
         if not updated_settings_resp or not updated_settings_resp.data:
              raise HTTPException(status_code=404, detail="Failed to update settings or user not found")
 
+        # Turning DND off or moving quiet hours may release a held digest.
+        await notification_service.reschedule_deferred(current_user.id)
         return NotificationSettingsResponse(**updated_settings_resp.data)
     except APIError as e:
         logger.error(f"Error updating notification settings for user {current_user.id}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Could not update notification settings")
+
+@router.get("/push-stats", response_model=PushRoutingStats)
+async def get_push_routing_stats(current_user: UserPublic = Depends(get_current_admin_user)):
+    """Message pushes sent, deferred to a digest, and avoided (recipient was live on a WebSocket, or the push was collapsed), across all instances. Admin only."""
+    return await notification_service.get_push_stats()
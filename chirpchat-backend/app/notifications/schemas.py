@@ -49,3 +49,10 @@ class NotificationSettingsResponse(BaseModel):
 class NotificationPayload(BaseModel):
     title: str
     options: Dict
+
+class PushRoutingStats(BaseModel):
+    sent: int
+    deferred: int # Held by quiet hours or DND and folded into a digest.
+    suppressed_online: int
+    collapsed: int
+    pushes_avoided: int
@@ -1,9 +1,14 @@
 
+import asyncio
 import json
 from uuid import UUID
-from pywebpush import webpush, WebPushException
-from typing import List, Optional
-from datetime import datetime
+from pywebpush import WebPusher, WebPushException
+from py_vapid import Vapid
+import requests
+from urllib.parse import urlparse
+from typing import Dict, List, Optional, Set, Tuple
+from datetime import datetime, timedelta
+import time
 import pytz
 
 from app.config import settings
@@ -11,11 +16,67 @@ from app.database import db_manager
 from app.utils.logging import logger
 from app.auth.schemas import UserPublic
 from app.chat.schemas import MessageInDB
+from app.redis_client import get_redis_client
+from app.websocket import manager as ws_manager
+from app.utils.cache import ExpiringCache
+
+# Push icons render at roughly 64-96 CSS px; the 128px avatar is the smallest variant that stays sharp.
+NOTIFICATION_ICON_SIZE = 128
+PUSH_COLLAPSE_PREFIX = "push_collapse:"
+PUSH_STATS_KEY = "push_routing_stats"
+# What _send_notification_to_user did with a notification; None when the user has that type turned off.
+PUSH_SENT = "sent"
+PUSH_DEFERRED = "deferred"
+# Notifications held back by quiet hours or DND: a per-user digest hash, plus one sorted set
+# of users scored by when their digest is due (the end of their quiet window).
+DEFERRED_DIGEST_PREFIX = "notification_digest:"
+DEFERRED_DUE_KEY = "notification_digests_due"
+DEFERRED_DIGEST_TTL_SECONDS = 60 * 60 * 24 * 3
+DEFERRED_DISPATCH_BATCH_SIZE = 100
+DEFERRED_DISPATCH_MAX_SLEEP_SECONDS = 30
+DIGEST_LABELS = {"messages": ("new message", "new messages"), "mood_updates": ("mood update", "mood updates"), "thinking_of_you": ("thought of you", "thoughts of you")}
+
+# A VAPID JWT is valid for one push-service origin for up to 24h; sign one per origin and reuse it.
+VAPID_TOKEN_TTL_SECONDS = 12 * 60 * 60
+VAPID_REFRESH_MARGIN_SECONDS = 60 * 60
+vapid_header_cache = ExpiringCache(max_entries=100)
+
+# (user_id, settings fingerprint) -> (start, end) of the current or next quiet window, valid until that window ends.
+quiet_window_cache = ExpiringCache(max_entries=50_000)
+
+def compute_quiet_window(settings_data: dict, now: datetime) -> Optional[Tuple[datetime, datetime]]:
+    """
+    Returns the quiet-hours window (UTC start, UTC end) that contains `now`, or else the next one.
+    Windows may cross midnight; with quiet_hours_weekdays_only, windows starting on a weekend are skipped.
+    """
+    if not settings_data.get("quiet_hours_enabled"): return None
+    q_start_str, q_end_str = settings_data.get("quiet_hours_start"), settings_data.get("quiet_hours_end")
+    if not q_start_str or not q_end_str: return None
+    try:
+        user_tz = pytz.timezone(settings_data.get("timezone") or "UTC")
+    except pytz.UnknownTimeZoneError:
+        user_tz = pytz.utc
+    q_start = datetime.strptime(q_start_str, '%H:%M:%S').time()
+    q_end = datetime.strptime(q_end_str, '%H:%M:%S').time()
+
+    local_today = now.astimezone(user_tz).date()
+    # A window that crosses midnight may have started yesterday, so check from the previous day onwards.
+    for day_offset in range(-1, 8):
+        day = local_today + timedelta(days=day_offset)
+        if settings_data.get("quiet_hours_weekdays_only") and day.weekday() >= 5: continue
+        start = user_tz.localize(datetime.combine(day, q_start))
+        end_day = day if q_start <= q_end else day + timedelta(days=1)
+        end = user_tz.localize(datetime.combine(end_day, q_end))
+        if end > now: return start.astimezone(pytz.utc), end.astimezone(pytz.utc)
+    return None
 
 class NotificationService:
     def __init__(self):
         self.vapid_private_key = settings.VAPID_PRIVATE_KEY
         self.vapid_admin_email = settings.VAPID_ADMIN_EMAIL
+        self._vapid: Optional[Vapid] = None
+        self._push_session = requests.Session() # Keeps connections to each push service alive between sends.
+        self._flush_tasks: Set[asyncio.Task] = set() # The loop only keeps weak references to tasks.
 
     def is_configured(self) -> bool:
         return bool(self.vapid_private_key and self.vapid_admin_email)
@@ -36,31 +97,35 @@ class NotificationService:
             logger.error(f"Error fetching notification settings for user {user_id}: {e}")
             return None
 
-    def _is_in_quiet_hours(self, settings_data: dict) -> bool:
-        if not settings_data.get("quiet_hours_enabled"): return False
-        tz_str = settings_data.get("timezone", "UTC")
-        try:
-            user_tz = pytz.timezone(tz_str)
-        except pytz.UnknownTimeZoneError:
-            user_tz = pytz.utc
-        
-        now_user_time = datetime.now(user_tz)
-        q_start_str = settings_data.get("quiet_hours_start")
-        q_end_str = settings_data.get("quiet_hours_end")
-        if not q_start_str or not q_end_str: return False
-        
-        q_start = datetime.strptime(q_start_str, '%H:%M:%S').time()
-        q_end = datetime.strptime(q_end_str, '%H:%M:%S').time()
+    def _get_quiet_window(self, user_id: UUID, settings_data: dict, now: datetime) -> Optional[Tuple[datetime, datetime]]:
+        """Quiet-window boundaries are computed once per window and reused until it ends, so each check is a lookup."""
+        fingerprint = tuple(settings_data.get(k) for k in ("quiet_hours_enabled", "quiet_hours_start", "quiet_hours_end", "quiet_hours_weekdays_only", "timezone"))
+        cache_key = (user_id, fingerprint)
+        window = quiet_window_cache.get(cache_key)
+        if window is None:
+            window = compute_quiet_window(settings_data, now)
+            if window: quiet_window_cache.set(cache_key, window, window[1].timestamp())
+        return window
 
-        if settings_data.get("quiet_hours_weekdays_only") and now_user_time.weekday() >= 5: return False
-        current_time = now_user_time.time()
-        if q_start <= q_end: return q_start <= current_time <= q_end
-        else: return current_time >= q_start or current_time <= q_end
+    def _get_vapid_headers(self, endpoint: str) -> dict:
+        """Returns the VAPID Authorization header for the endpoint's origin, signing a new JWT only near expiry."""
+        url = urlparse(endpoint)
+        audience = f"{url.scheme}://{url.netloc}"
+        headers = vapid_header_cache.get(audience)
+        if headers is None:
+            if self._vapid is None: self._vapid = Vapid.from_string(private_key=self.vapid_private_key)
+            expires_at = int(time.time()) + VAPID_TOKEN_TTL_SECONDS
+            headers = self._vapid.sign({"sub": self.vapid_admin_email, "aud": audience, "exp": expires_at})
+            vapid_header_cache.set(audience, headers, expires_at - VAPID_REFRESH_MARGIN_SECONDS)
+        return dict(headers) # WebPusher.send adds its own headers to the dict it is given.
 
     def _send_web_push(self, subscription_info: dict, payload: str):
         sub_info_for_webpush = {"endpoint": subscription_info["endpoint"], "keys": {"p256dh": subscription_info["p256dh_key"], "auth": subscription_info["auth_key"]}}
         try:
-            webpush(subscription_info=sub_info_for_webpush, data=payload, vapid_private_key=self.vapid_private_key, vapid_claims={"sub": self.vapid_admin_email})
+            # Same as pywebpush.webpush(), minus the per-call key parsing and JWT signing; only the payload is encrypted per send.
+            response = WebPusher(sub_info_for_webpush, requests_session=self._push_session).send(payload, headers=self._get_vapid_headers(subscription_info["endpoint"]), ttl=0, content_encoding="aes128gcm")
+            if response.status_code > 202:
+                raise WebPushException(f"Push failed: {response.status_code} {response.reason}", response=response)
         except WebPushException as ex:
             logger.error(f"WebPushException for endpoint {subscription_info['endpoint']}: {ex}")
             if ex.response and ex.response.status_code == 410:
@@ -68,27 +133,111 @@ class NotificationService:
         except Exception as e:
             logger.error(f"Generic error sending push to {subscription_info['endpoint']}: {e}")
 
-    async def _send_notification_to_user(self, user_id: UUID, notification_type: str, payload_data: dict):
-        if not self.is_configured(): return
+    async def _deliver_push(self, user_id: UUID, payload_data: dict):
+        subscriptions = await self._get_active_subscriptions(user_id)
+        if not subscriptions: return
+            
+        payload_json = json.dumps(payload_data)
+        for sub in subscriptions:
+            self._send_web_push(sub, payload_json)
+
+    async def _send_notification_to_user(self, user_id: UUID, notification_type: str, payload_data: dict) -> Optional[str]:
+        """Returns PUSH_SENT, PUSH_DEFERRED (held for the user's digest), or None if nothing was sent."""
+        if not self.is_configured(): return None
         
         settings = await self._get_user_notification_settings(user_id)
-        if not settings or not settings.get(notification_type, False): return
+        if not settings or not settings.get(notification_type, False): return None
         
         if settings.get("is_dnd_enabled", False):
-            logger.info(f"Notification to user {user_id} suppressed due to DND mode.")
-            return
+            # No known end time; the digest is scheduled when DND is switched off (see reschedule_deferred).
+            await self._defer_notification(user_id, notification_type, payload_data, due_at=None)
+            return PUSH_DEFERRED
+
+        now = datetime.now(pytz.utc)
+        window = self._get_quiet_window(user_id, settings, now)
+        if window and window[0] <= now < window[1]:
+            await self._defer_notification(user_id, notification_type, payload_data, due_at=window[1])
+            return PUSH_DEFERRED
+
+        await self._deliver_push(user_id, payload_data)
+        return PUSH_SENT
 
-        if self._is_in_quiet_hours(settings):
-            logger.info(f"Notification to user {user_id} suppressed due to quiet hours.")
+    async def _defer_notification(self, user_id: UUID, notification_type: str, payload_data: dict, due_at: Optional[datetime]):
+        """Folds the notification into the user's digest and, if the window end is known, schedules the digest for it."""
+        redis = await get_redis_client()
+        digest_key = f"{DEFERRED_DIGEST_PREFIX}{user_id}"
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.hincrby(digest_key, f"count:{notification_type}", 1)
+            pipe.hset(digest_key, f"title:{notification_type}", payload_data.get("title", ""))
+            pipe.expire(digest_key, DEFERRED_DIGEST_TTL_SECONDS)
+            # NX: the first deferral in a window sets the due time; later ones fold into the same digest.
+            if due_at: pipe.zadd(DEFERRED_DUE_KEY, {str(user_id): due_at.timestamp()}, nx=True)
+            await pipe.execute()
+        logger.info(f"Deferred {notification_type} notification for user {user_id} until {due_at.isoformat() if due_at else 'DND ends'}.")
+
+    async def reschedule_deferred(self, user_id: UUID):
+        """Called after the user changes their settings; the dispatcher re-evaluates any held digest right away."""
+        redis = await get_redis_client()
+        if await redis.exists(f"{DEFERRED_DIGEST_PREFIX}{user_id}"):
+            await redis.zadd(DEFERRED_DUE_KEY, {str(user_id): time.time()})
+
+    def _build_digest_payload(self, user_id: UUID, digest: Dict[str, str]) -> Optional[dict]:
+        counts = {field.split(":", 1)[1]: int(value) for field, value in digest.items() if field.startswith("count:")}
+        if not counts: return None
+        if sum(counts.values()) == 1:
+            notification_type = next(iter(counts))
+            return {"type": "digest", "title": digest.get(f"title:{notification_type}") or "You have a new notification", "options": {"body": "Sent while notifications were paused.", "icon": "/icons/icon-192x192.png", "tag": f"digest-{user_id}"}}
+        parts = []
+        for notification_type, count in counts.items():
+            singular, plural = DIGEST_LABELS.get(notification_type, ("notification", "notifications"))
+            parts.append(f"{count} {singular if count == 1 else plural}")
+        return {"type": "digest", "title": "While notifications were paused", "options": {"body": ", ".join(parts), "icon": "/icons/icon-192x192.png", "badge": "/icons/badge-96x96.png", "tag": f"digest-{user_id}"}}
+
+    async def _dispatch_digest(self, redis, user_id: UUID):
+        settings = await self._get_user_notification_settings(user_id) or {}
+        if settings.get("is_dnd_enabled", False): return # Stays held until DND is switched off.
+        now = datetime.now(pytz.utc)
+        window = self._get_quiet_window(user_id, settings, now)
+        if window and window[0] <= now < window[1]:
+            await redis.zadd(DEFERRED_DUE_KEY, {str(user_id): window[1].timestamp()})
             return
 
-        subscriptions = await self._get_active_subscriptions(user_id)
-        if not subscriptions: return
-            
-        payload_json = json.dumps(payload_data)
-        for sub in subscriptions:
-            self._send_web_push(sub, payload_json)
-    
+        digest_key = f"{DEFERRED_DIGEST_PREFIX}{user_id}"
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hgetall(digest_key)
+            pipe.delete(digest_key)
+            digest, _ = await pipe.execute()
+        payload = self._build_digest_payload(user_id, digest)
+        if payload and self.is_configured(): await self._deliver_push(user_id, payload)
+
+    async def dispatch_due_digests(self) -> Optional[float]:
+        """Sends every digest that is due. Returns the due time of the next pending one, if any."""
+        redis = await get_redis_client()
+        due_user_ids = await redis.zrangebyscore(DEFERRED_DUE_KEY, "-inf", time.time(), start=0, num=DEFERRED_DISPATCH_BATCH_SIZE)
+        for user_id in due_user_ids:
+            # ZREM doubles as the claim: only the instance that removes the entry sends the digest.
+            if not await redis.zrem(DEFERRED_DUE_KEY, user_id): continue
+            try:
+                await self._dispatch_digest(redis, UUID(user_id))
+            except Exception as e:
+                logger.error(f"Error dispatching notification digest for user {user_id}: {e}", exc_info=True)
+        next_due = await redis.zrange(DEFERRED_DUE_KEY, 0, 0, withscores=True)
+        return next_due[0][1] if next_due else None
+
+    async def run_deferred_dispatcher(self):
+        """Sleeps until the earliest digest is due (capped, so new earlier entries are noticed), then sends what is due."""
+        logger.info("Deferred notification dispatcher starting.")
+        while True:
+            try:
+                next_due = await self.dispatch_due_digests()
+                delay = DEFERRED_DISPATCH_MAX_SLEEP_SECONDS if next_due is None else min(DEFERRED_DISPATCH_MAX_SLEEP_SECONDS, max(0.0, next_due - time.time()))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in deferred notification dispatcher: {e}", exc_info=True)
+                delay = DEFERRED_DISPATCH_MAX_SLEEP_SECONDS
+            await asyncio.sleep(delay)
+
     async def _get_recipients_for_chat(self, chat_id: UUID, exclude_user_id: UUID) -> List[UUID]:
         try:
             resp = await db_manager.get_table("chat_participants").select("user_id").eq("chat_id", str(chat_id)).neq("user_id", str(exclude_user_id)).execute()
@@ -107,20 +256,90 @@ class NotificationService:
         if message.text: return message.text[:100]
         return "You have a new message."
 
-    async def send_new_message_notification(self, sender: UserPublic, chat_id: UUID, message: MessageInDB):
+    def _build_message_payload(self, sender: UserPublic, chat_id: UUID, notification_body: str) -> dict:
+        return {"type": "message", "title": f"New message from {sender.display_name}", "options": {"body": notification_body, "icon": sender.avatar_url_for(NOTIFICATION_ICON_SIZE) or "/icons/icon-192x192.png", "badge": "/icons/badge-96x96.png", "tag": f"conversation-{chat_id}", "data": {"conversationId": str(chat_id)}}}
+
+    async def _record_push_stats(self, **counts: int):
+        counts = {field: n for field, n in counts.items() if n}
+        if not counts: return
+        try:
+            redis = await get_redis_client()
+            async with redis.pipeline(transaction=False) as pipe:
+                for field, n in counts.items(): pipe.hincrby(PUSH_STATS_KEY, field, n)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Could not record push stats: {e}")
+
+    async def get_push_stats(self) -> dict:
+        redis = await get_redis_client()
+        stats = {field: int(value) for field, value in (await redis.hgetall(PUSH_STATS_KEY)).items()}
+        suppressed, collapsed = stats.get("suppressed_online", 0), stats.get("collapsed", 0)
+        return {"sent": stats.get("sent", 0), "deferred": stats.get("deferred", 0), "suppressed_online": suppressed, "collapsed": collapsed, "pushes_avoided": suppressed + collapsed}
+
+    async def _flush_collapsed_messages(self, recipient_id: UUID, chat_id: UUID, sender: UserPublic, window_key: str, first_push_count: int):
+        """window_key counts every message in the window, including the first_push_count the opening push announced."""
+        await asyncio.sleep(settings.PUSH_COLLAPSE_WINDOW_SECONDS)
+        try:
+            redis = await get_redis_client()
+            total = int(await redis.getdel(window_key) or 0)
+            pending = total - first_push_count
+            if pending <= 0: return
+            # The recipient may have opened the app during the window and seen the messages live.
+            if recipient_id in await ws_manager.get_reachable_users([recipient_id]):
+                await self._record_push_stats(suppressed_online=pending)
+                return
+            # Same conversation tag, so the device replaces the earlier notification: the count covers the whole window.
+            outcome = await self._send_notification_to_user(recipient_id, "messages", self._build_message_payload(sender, chat_id, f"{total} new messages"))
+            await self._record_push_stats(sent=int(outcome == PUSH_SENT), deferred=int(outcome == PUSH_DEFERRED))
+        except Exception as e:
+            logger.error(f"Error flushing collapsed notifications for user {recipient_id} in chat {chat_id}: {e}", exc_info=True)
+
+    async def _route_message_push(self, sender: UserPublic, chat_id: UUID, payload: dict, message_count: int):
+        """
+        Pushes to recipients who won't see the messages live. Recipients with an active WebSocket are skipped,
+        and within PUSH_COLLAPSE_WINDOW_SECONDS of a push, further messages in the chat are counted and
+        delivered as one trailing "N new messages" push.
+        """
         recipients = await self._get_recipients_for_chat(chat_id, sender.id)
-        notification_body = self._get_message_notification_text(sender.display_name, message)
-        payload = {"type": "message", "title": f"New message from {sender.display_name}", "options": {"body": notification_body, "icon": sender.avatar_url or "/icons/icon-192x192.png", "badge": "/icons/badge-96x96.png", "tag": f"conversation-{chat_id}", "data": {"conversationId": str(chat_id)}}}
+        if not recipients: return
+        reachable = await ws_manager.get_reachable_users(recipients)
+        redis = await get_redis_client()
+        sent, deferred, collapsed = 0, 0, 0
         for recipient_id in recipients:
-            await self._send_notification_to_user(recipient_id, "messages", payload)
+            if recipient_id in reachable: continue
+            window_key = f"{PUSH_COLLAPSE_PREFIX}{recipient_id}:{chat_id}"
+            # The key outlives the window slightly so the flush task always finds it.
+            if await redis.set(window_key, message_count, ex=settings.PUSH_COLLAPSE_WINDOW_SECONDS + 10, nx=True):
+                outcome = await self._send_notification_to_user(recipient_id, "messages", payload)
+                sent += int(outcome == PUSH_SENT)
+                deferred += int(outcome == PUSH_DEFERRED)
+                task = asyncio.create_task(self._flush_collapsed_messages(recipient_id, chat_id, sender, window_key, message_count))
+                self._flush_tasks.add(task)
+                task.add_done_callback(self._flush_tasks.discard)
+            else:
+                await redis.incrby(window_key, message_count)
+                collapsed += message_count
+        await self._record_push_stats(sent=sent, deferred=deferred, suppressed_online=len(reachable) * message_count, collapsed=collapsed)
+
+    async def send_new_message_notification(self, sender: UserPublic, chat_id: UUID, message: MessageInDB):
+        notification_body = self._get_message_notification_text(sender.display_name, message)
+        await self._route_message_push(sender, chat_id, self._build_message_payload(sender, chat_id, notification_body), 1)
+
+    async def send_new_messages_notification(self, sender: UserPublic, chat_id: UUID, messages: List[MessageInDB]):
+        """Sends one collapsed push for a batch of messages instead of one push per message."""
+        if not messages: return
+        if len(messages) == 1:
+            await self.send_new_message_notification(sender, chat_id, messages[0])
+            return
+        await self._route_message_push(sender, chat_id, self._build_message_payload(sender, chat_id, f"{len(messages)} new messages"), len(messages))
 
     async def send_mood_change_notification(self, user: UserPublic, new_mood: str):
         if not user.partner_id: return
-        payload = {"type": "mood_update", "title": f"{user.display_name} has updated their mood!", "options": {"body": f"They are now feeling: {new_mood}", "icon": user.avatar_url, "tag": f"mood-{user.id}"}}
+        payload = {"type": "mood_update", "title": f"{user.display_name} has updated their mood!", "options": {"body": f"They are now feeling: {new_mood}", "icon": user.avatar_url_for(NOTIFICATION_ICON_SIZE), "tag": f"mood-{user.id}"}}
         await self._send_notification_to_user(user.partner_id, "mood_updates", payload)
 
     async def send_thinking_of_you_notification(self, sender: UserPublic, recipient_id: UUID):
-         payload = {"type": "thinking_of_you", "title": f"{sender.display_name} is thinking of you!", "options": {"body": "Send a thought back from the app.", "icon": sender.avatar_url, "badge": "/icons/badge-96x96.png", "tag": f"ping-{sender.id}-{recipient_id}", "data": {"senderId": str(sender.id)}}}
+         payload = {"type": "thinking_of_you", "title": f"{sender.display_name} is thinking of you!", "options": {"body": "Send a thought back from the app.", "icon": sender.avatar_url_for(NOTIFICATION_ICON_SIZE), "badge": "/icons/badge-96x96.png", "tag": f"ping-{sender.id}-{recipient_id}", "data": {"senderId": str(sender.id)}}}
          await self._send_notification_to_user(recipient_id, "thinking_of_you", payload)
 
     async def send_mood_ping_notification(self, sender: UserPublic, recipient_id: UUID, mood_id: str, mood_emoji: str):
@@ -129,7 +348,7 @@ class NotificationService:
             "title": f"{sender.display_name} is feeling {mood_id} {mood_emoji}",
             "options": {
                 "body": "They wanted to share this mood with you.",
-                "icon": sender.avatar_url,
+                "icon": sender.avatar_url_for(NOTIFICATION_ICON_SIZE),
                 "tag": f"moodping-{sender.id}-{recipient_id}",
                 "data": {"senderId": str(sender.id), "mood": mood_id}
             }
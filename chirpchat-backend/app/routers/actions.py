@@ -10,7 +10,8 @@ from app.database import db_manager
 from app.websocket import manager as ws_manager
 from app.utils.logging import logger
 from app.actions.schemas import MoodUpdatePayload, MoodPingPayload
-from app.analytics.schemas import MoodAnalyticsCreate, MoodAnalyticsContext
+from app.analytics.schemas import MoodAnalyticsContext
+from app.analytics.ingest import analytics_buffer, mood_analytics_row
 
 router = APIRouter(prefix="/actions", tags=["Quick Actions"])
 
@@ -30,28 +31,7 @@ async def _track_mood_analytics(user_id: UUID, mood_name: str, mood_emoji: str |
         source=context.get("source")
     )
     
-    # This is for validation only
-    analytics_payload = MoodAnalyticsCreate(
-        mood_name=mood_name,
-        mood_emoji=mood_emoji,
-        context=analytics_context_payload
-    )
-
-    analytics_data = {
-        "user_id": str(user_id),
-        "partner_id": str(context.get("partner_id")) if context.get("partner_id") else None,
-        "mood_name": mood_name,
-        "mood_emoji": mood_emoji,
-        "source": context.get("source"),
-        "context": analytics_context_payload.model_dump_json(),
-        "created_at": now.isoformat(),
-    }
-    
-    try:
-        await db_manager.admin_client.table("mood_analytics").insert(analytics_data).execute()
-        logger.info(f"Logged mood analytics for user {user_id}: {mood_name}")
-    except Exception as e:
-        logger.error(f"Failed to log mood analytics for user {user_id}: {e}", exc_info=True)
+    analytics_buffer.add("mood_analytics", [mood_analytics_row(user_id, mood_name, mood_emoji, analytics_context_payload, created_at=now)])
 
 
 @router.post("/update-mood", response_model=UserPublic)
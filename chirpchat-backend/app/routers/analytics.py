@@ -1,13 +1,12 @@
 
 
-from fastapi import APIRouter, Depends, HTTPException, status, BaseModel
-from app.auth.dependencies import get_current_active_user
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from pydantic import BaseModel
+from app.auth.dependencies import get_current_active_user, get_current_admin_user
 from app.auth.schemas import UserPublic
-from app.database import db_manager
-from app.utils.logging import logger
-from app.analytics.schemas import FileAnalyticsCreate, MoodAnalyticsCreate
-from app.analytics.service import analytics_service
-from datetime import datetime, timezone
+from app.analytics.schemas import FileAnalyticsCreate, MoodAnalyticsCreate, AnalyticsBatchCreate, AnalyticsBufferStats
+from app.analytics.service import MOOD_ROLLUP_RETENTION_DAYS, analytics_service, rebuild_mood_rollups
+from app.analytics.ingest import analytics_buffer, file_analytics_row, mood_analytics_row
 from typing import Optional, List
 
 router = APIRouter(prefix="/analytics", tags=["Analytics"])
@@ -28,30 +27,11 @@ async def track_file_analytics(
     current_user: UserPublic = Depends(get_current_active_user)
 ):
     """
-    Receives and stores file upload analytics from the client.
-    This is a fire-and-forget endpoint from the client's perspective.
+    Receives file upload analytics from the client.
+    This is a fire-and-forget endpoint; rows are buffered and written in bulk.
     """
-    logger.info(f"Received file analytics for message {payload.message_id} from user {current_user.id}")
-    
-    analytics_data = {
-        "user_id": str(current_user.id),
-        "message_id": str(payload.message_id),
-        "upload_duration_seconds": payload.upload_duration_seconds,
-        "file_size_bytes": payload.file_size_bytes,
-        "compressed_size_bytes": payload.compressed_size_bytes,
-        "network_quality": payload.network_quality,
-        "file_type": payload.file_type,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-    }
-    
-    try:
-        await db_manager.admin_client.table("file_analytics").insert(analytics_data).execute()
-        return {"status": "ok"}
-    except Exception as e:
-        logger.error(f"Could not store file analytics: {e}", exc_info=True)
-        # We don't raise an HTTPException because the client doesn't need to know about this failure.
-        # This is a background tracking task.
-        return {"status": "error"}
+    analytics_buffer.add("file_analytics", [file_analytics_row(current_user.id, payload)])
+    return {"status": "ok"}
 
 @router.post("/mood", status_code=status.HTTP_201_CREATED)
 async def track_mood_analytics(
@@ -59,33 +39,40 @@ async def track_mood_analytics(
     current_user: UserPublic = Depends(get_current_active_user)
 ):
     """
-    Receives and stores mood selection analytics from the client.
+    Receives mood selection analytics from the client.
     This captures the initial mood selection event. The outcome fields
     can be populated later by a separate process.
     """
-    logger.info(f"Received mood analytics for '{payload.mood_id}' from user {current_user.id}")
-    
-    analytics_data = {
-        "user_id": str(current_user.id),
-        "mood_id": payload.mood_id,
-        "mood_emoji": payload.mood_emoji,
-        "context": payload.context.model_dump_json(), # Store context as a JSON string
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        # Outcome fields are null initially, to be filled in later by another service/process
-        "partner_response_time": None,
-        "partner_reaction": None,
-        "conversation_started": None,
-        "mood_reciprocated": None,
-    }
-    
-    try:
-        # Assumes a 'mood_analytics' table exists in the database
-        await db_manager.admin_client.table("mood_analytics").insert(analytics_data).execute()
-        return {"status": "ok"}
-    except Exception as e:
-        logger.error(f"Could not store mood analytics: {e}", exc_info=True)
-        # This is a background task, so we don't want to fail the user's primary action.
-        return {"status": "error"}
+    analytics_buffer.add("mood_analytics", [mood_analytics_row(current_user.id, payload.mood_name, payload.mood_emoji, payload.context)])
+    return {"status": "ok"}
+
+@router.post("/batch", status_code=status.HTTP_201_CREATED)
+async def track_analytics_batch(
+    payload: AnalyticsBatchCreate,
+    current_user: UserPublic = Depends(get_current_active_user)
+):
+    """
+    Receives many file and mood analytics events in one request, e.g. when a client flushes its offline queue.
+    """
+    if payload.file_events: analytics_buffer.add("file_analytics", [file_analytics_row(current_user.id, event) for event in payload.file_events])
+    if payload.mood_events: analytics_buffer.add("mood_analytics", [mood_analytics_row(current_user.id, event.mood_name, event.mood_emoji, event.context) for event in payload.mood_events])
+    return {"status": "ok", "accepted": len(payload.file_events) + len(payload.mood_events)}
+
+@router.get("/buffer-stats", response_model=AnalyticsBufferStats)
+async def get_analytics_buffer_stats(current_user: UserPublic = Depends(get_current_admin_user)):
+    """Buffered, spilled and dead-lettered row counts and bulk-insert latency for this instance. Admin only."""
+    return await analytics_buffer.stats()
+
+@router.post("/moods/rollups/rebuild")
+async def rebuild_mood_daily_counts(
+    days_ago: int = Query(MOOD_ROLLUP_RETENTION_DAYS, ge=1, le=MOOD_ROLLUP_RETENTION_DAYS),
+    current_user: UserPublic = Depends(get_current_admin_user)
+):
+    """
+    Repair job: recomputes the mood_daily_counts rollup for the last `days_ago` days from mood_analytics,
+    e.g. after events were bulk-loaded with the trigger disabled. Safe to re-run. Admin only.
+    """
+    return {"status": "ok", "rebuilt_day_buckets": await rebuild_mood_rollups(days_ago)}
 
 
 @router.get("/moods/suggestions", response_model=MoodSuggestionResponse)
@@ -1,17 +1,19 @@
 
 
+import json
 import time
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from pydantic import BaseModel
-from typing import Literal, Dict, Any
+from pydantic import BaseModel, Field
+from typing import Literal, Dict, Any, List, Optional, Tuple
 import cloudinary
 import cloudinary.utils
 from uuid import UUID
 
-from app.auth.dependencies import get_current_user
+from app.auth.dependencies import get_current_user, get_current_admin_user
 from app.auth.schemas import UserPublic
 from app.database import db_manager
 from app.utils.logging import logger
+from app.media.signed_urls import SIGNED_URL_TTL_SECONDS, signed_url_cache, cache_signed_url, get_cached_signed_urls, is_hidden_by_clear
 from app.config import settings
 
 router = APIRouter(prefix="/media", tags=["Media"])
@@ -23,9 +25,116 @@ cloudinary.config(
     secure=True
 )
 
+MAX_SIGNED_URL_BATCH_SIZE = 100
+
 class SignedUrlResponse(BaseModel):
     url: str
 
+class SignedUrlRequestItem(BaseModel):
+    message_id: UUID
+    version: str = 'original'
+
+class SignedUrlBatchRequest(BaseModel):
+    items: List[SignedUrlRequestItem] = Field(..., min_length=1, max_length=MAX_SIGNED_URL_BATCH_SIZE)
+
+class SignedUrlBatchItem(BaseModel):
+    message_id: UUID
+    version: str
+    url: Optional[str] = None
+    expires_at: Optional[int] = None
+    error: Optional[str] = None
+
+class SignedUrlBatchResponse(BaseModel):
+    urls: List[SignedUrlBatchItem]
+
+def _load_media_metadata(raw_metadata: Any) -> Optional[Dict[str, Any]]:
+    if isinstance(raw_metadata, str):
+        try: raw_metadata = json.loads(raw_metadata)
+        except json.JSONDecodeError: return None
+    return raw_metadata if isinstance(raw_metadata, dict) else None
+
+def _sign_media_version(metadata: Optional[Dict[str, Any]], version: str) -> Tuple[str, int]:
+    """
+    Signs a private media asset for the requested version and returns (url, expires_at).
+    Raises LookupError with a client-facing message when the metadata cannot be signed.
+    """
+    if not metadata:
+        raise LookupError("Media metadata is missing or invalid.")
+
+    public_id = metadata.get('public_id')
+    resource_type = metadata.get('resource_type', 'image')
+    if not public_id:
+        raise LookupError("Media public_id not found in metadata.")
+
+    urls: Dict[str, Any] = metadata.get('urls', {})
+    if not urls.get(version) and not urls.get('original'):
+        raise LookupError(f"Media version '{version}' or 'original' not found.")
+
+    expires_at = int(time.time()) + SIGNED_URL_TTL_SECONDS
+    # Transformations are applied via presets, so only the asset itself needs signing.
+    url_options = {
+        "resource_type": resource_type,
+        "type": "private",
+        "expires_at": expires_at,
+    }
+    signed_url = cloudinary.utils.cloudinary_url(public_id, **url_options)[0]
+    return signed_url, expires_at
+
+@router.post("/signed-urls", response_model=SignedUrlBatchResponse)
+async def get_signed_media_urls(
+    batch: SignedUrlBatchRequest,
+    current_user: UserPublic = Depends(get_current_user)
+):
+    """
+    Signs many private media URLs in one request.
+    Cached URLs are returned without touching the DB once Redis confirms they are still allowed; the rest
+    are authorized with one message lookup and one membership query, then signed in a batch.
+    """
+    results: List[SignedUrlBatchItem] = []
+    misses: List[int] = []
+    cached_urls = await get_cached_signed_urls(current_user.id, [(item.message_id, item.version) for item in batch.items])
+    for index, (item, cached) in enumerate(zip(batch.items, cached_urls)):
+        if cached:
+            results.append(SignedUrlBatchItem(message_id=item.message_id, version=item.version, url=cached[0], expires_at=cached[1]))
+        else:
+            results.append(SignedUrlBatchItem(message_id=item.message_id, version=item.version))
+            misses.append(index)
+    if not misses:
+        return SignedUrlBatchResponse(urls=results)
+
+    message_ids = list({str(batch.items[i].message_id) for i in misses})
+    messages_resp = await db_manager.get_table("messages").select("id, chat_id, file_metadata, created_at").in_("id", message_ids).execute()
+    messages_by_id = {str(row["id"]): row for row in messages_resp.data or []}
+
+    chat_ids = list({str(row["chat_id"]) for row in messages_by_id.values()})
+    cleared_at_by_chat: Dict[str, Optional[str]] = {}
+    if chat_ids:
+        membership_resp = await db_manager.get_table("chat_participants").select("chat_id, cleared_at").eq("user_id", str(current_user.id)).in_("chat_id", chat_ids).execute()
+        cleared_at_by_chat = {str(row["chat_id"]): row.get("cleared_at") for row in membership_resp.data or []}
+
+    for index in misses:
+        item, result = batch.items[index], results[index]
+        message = messages_by_id.get(str(item.message_id))
+        if not message:
+            result.error = "Media message not found."
+        elif str(message["chat_id"]) not in cleared_at_by_chat or is_hidden_by_clear(message.get("created_at"), cleared_at_by_chat[str(message["chat_id"])]):
+            result.error = "You are not authorized to view this media."
+        else:
+            try:
+                result.url, result.expires_at = _sign_media_version(_load_media_metadata(message.get("file_metadata")), item.version)
+                cache_signed_url(item.message_id, item.version, current_user.id, result.url, result.expires_at, message["chat_id"], message.get("created_at"))
+            except LookupError as e:
+                result.error = str(e)
+            except Exception as e:
+                logger.error(f"Error generating signed URL for message {item.message_id}: {e}", exc_info=True)
+                result.error = "Could not generate secure media URL."
+    return SignedUrlBatchResponse(urls=results)
+
+@router.get("/signed-urls/cache-stats")
+async def get_signed_url_cache_stats(current_user: UserPublic = Depends(get_current_admin_user)):
+    """Reports hit/miss counters and size of this instance's signed URL cache."""
+    return signed_url_cache.stats()
+
 @router.get("/{message_id}", response_model=SignedUrlResponse)
 async def get_signed_media_url(
     message_id: UUID,
@@ -37,54 +146,27 @@ async def get_signed_media_url(
     This endpoint verifies that the user is a participant in the chat
     before generating the signed URL for a specific media version.
     """
-    message_resp = await db_manager.get_table("messages").select("chat_id, file_metadata").eq("id", str(message_id)).maybe_single().execute()
+    cached = (await get_cached_signed_urls(current_user.id, [(message_id, version)]))[0]
+    if cached:
+        return SignedUrlResponse(url=cached[0])
+
+    message_resp = await db_manager.get_table("messages").select("chat_id, file_metadata, created_at").eq("id", str(message_id)).maybe_single().execute()
     if not message_resp.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Media message not found.")
         
     chat_id = message_resp.data.get('chat_id')
-    participant_resp = await db_manager.get_table("chat_participants").select("user_id").eq("chat_id", str(chat_id)).eq("user_id", str(current_user.id)).maybe_single().execute()
+    participant_resp = await db_manager.get_table("chat_participants").select("user_id, cleared_at").eq("chat_id", str(chat_id)).eq("user_id", str(current_user.id)).maybe_single().execute()
     
-    if not participant_resp.data:
+    if not participant_resp.data or is_hidden_by_clear(message_resp.data.get('created_at'), participant_resp.data.get('cleared_at')):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not authorized to view this media.")
 
-    metadata = message_resp.data.get('file_metadata')
-    if not isinstance(metadata, dict):
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Media metadata is missing or invalid.")
-
-    public_id = metadata.get('public_id')
-    resource_type = metadata.get('resource_type', 'image')
-    
-    if not public_id:
-         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Media public_id not found in metadata.")
-         
-    urls: Dict[str, Any] = metadata.get('urls', {})
-    
-    target_url_path = urls.get(version)
-    if not target_url_path:
-        target_url_path = urls.get('original')
-        if not target_url_path:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Media version '{version}' or 'original' not found.")
-
     try:
-        expires_at = int(time.time()) + 600 # 10 minutes expiry
-        
-        # Cloudinary URLs might already be fully qualified. We just need to sign them.
-        # Let's rebuild the URL with transformations to be safe.
-        url_options = {
-            "resource_type": resource_type,
-            "type": "private",
-            "expires_at": expires_at,
-        }
-        
-        # Extract transformations if they exist in the path, e.g. /t_my_preset/
-        # This is a simplified example. Production logic might need to be more robust.
-        # For now, we assume the full path is not needed and transformations are applied via presets if any
-        
-        signed_url = cloudinary.utils.cloudinary_url(public_id, **url_options)[0]
-        
-        return SignedUrlResponse(url=signed_url)
-
+        signed_url, expires_at = _sign_media_version(_load_media_metadata(message_resp.data.get('file_metadata')), version)
+    except LookupError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
     except Exception as e:
-        logger.error(f"Error generating signed URL for public_id {public_id}: {e}", exc_info=True)
+        logger.error(f"Error generating signed URL for message {message_id}: {e}", exc_info=True)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not generate secure media URL.")
 
+    cache_signed_url(message_id, version, current_user.id, signed_url, expires_at, chat_id, message_resp.data.get('created_at'))
+    return SignedUrlResponse(url=signed_url)
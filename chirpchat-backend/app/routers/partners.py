@@ -26,7 +26,7 @@ async def get_partner_suggestions(current_user: UserPublic = Depends(get_current
     try:
         # Exclude self and users who already have a partner
         response = await db_manager.get_table("users").select(
-            "id, display_name, avatar_url, mood, phone, email, is_online, last_seen, partner_id"
+            "id, display_name, avatar_url, avatar_variants, mood, phone, email, is_online, last_seen, partner_id"
         ).is_("partner_id", "NULL").neq("id", str(current_user.id)).execute()
         
         users = [UserPublic(**user_data) for user_data in response.data] if response.data else []
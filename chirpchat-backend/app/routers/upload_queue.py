@@ -0,0 +1,66 @@
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from uuid import UUID
+
+from app.auth.dependencies import get_current_active_user, get_current_admin_user
+from app.auth.schemas import UserPublic
+from app.media import upload_queue
+from app.media.schemas import (
+    ClaimedUpload, UploadClaimRequest, UploadClaimResponse, UploadFailureReport, UploadProgressUpdate,
+    UploadQueueCreate, UploadQueueGlobalStats, UploadQueueItem, UploadQueueStats, UploadSignatureBatchRequest, UploadSignatureBatchResponse,
+)
+from app.routers.uploads import build_upload_signature
+from app.websocket import manager as ws_manager
+
+router = APIRouter(prefix="/uploads/queue", tags=["Upload Queue"])
+
+UPLOAD_QUEUE_FOLDER = "user_media_uploads"
+
+def sign_queue_item(item: dict, user_id: UUID):
+    # The temp message id doubles as the Cloudinary public_id, so the webhook can find both the message and the queue item.
+    return build_upload_signature(str(item["temp_message_id"]), upload_queue.resource_type_for(item["file_type"]), UPLOAD_QUEUE_FOLDER, user_id)
+
+@router.post("", response_model=UploadQueueItem, status_code=status.HTTP_201_CREATED)
+async def enqueue_upload(upload: UploadQueueCreate, current_user: UserPublic = Depends(get_current_active_user)):
+    if not await ws_manager.is_user_in_chat(current_user.id, upload.chat_id): raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a participant of this chat")
+    item = await upload_queue.enqueue_upload(current_user.id, upload)
+    if not item: raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="temp_message_id is already in use")
+    return item
+
+@router.post("/claim", response_model=UploadClaimResponse)
+async def claim_uploads(request: UploadClaimRequest, current_user: UserPublic = Depends(get_current_active_user)):
+    """Hands out the next uploads to run, highest priority first, each with its upload signature."""
+    items = await upload_queue.claim_uploads(current_user.id, request.limit)
+    return UploadClaimResponse(uploads=[ClaimedUpload(item=item, signature=sign_queue_item(item, current_user.id)) for item in items])
+
+@router.post("/signatures", response_model=UploadSignatureBatchResponse)
+async def get_upload_signatures(request: UploadSignatureBatchRequest, current_user: UserPublic = Depends(get_current_active_user)):
+    """Re-signs several queued uploads at once, e.g. when signatures expired while the client was offline."""
+    items = await upload_queue.get_user_items(current_user.id, request.item_ids)
+    if len(items) != len(set(request.item_ids)): raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="One or more upload queue items not found")
+    return UploadSignatureBatchResponse(signatures=[sign_queue_item(item, current_user.id) for item in items])
+
+@router.post("/{item_id}/progress", status_code=status.HTTP_204_NO_CONTENT)
+async def report_upload_progress(item_id: UUID, update: UploadProgressUpdate, current_user: UserPublic = Depends(get_current_active_user)):
+    if not await upload_queue.record_progress(current_user.id, item_id, update.progress, update.bytes_uploaded):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No active upload queue item with this id")
+
+@router.post("/{item_id}/complete", status_code=status.HTTP_204_NO_CONTENT)
+async def complete_upload(item_id: UUID, current_user: UserPublic = Depends(get_current_active_user)):
+    # Idempotent: the Cloudinary webhook may already have completed the item.
+    await upload_queue.complete_upload(current_user.id, item_id)
+
+@router.post("/{item_id}/fail", response_model=UploadQueueItem)
+async def fail_upload(item_id: UUID, report: UploadFailureReport, current_user: UserPublic = Depends(get_current_active_user)):
+    item = await upload_queue.fail_upload(current_user.id, item_id, report.error_message, report.retryable)
+    if not item: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload queue item not found")
+    return item
+
+@router.get("/stats", response_model=UploadQueueStats)
+async def get_upload_queue_stats(current_user: UserPublic = Depends(get_current_active_user)):
+    return await upload_queue.get_queue_stats(current_user.id)
+
+@router.get("/stats/global", response_model=UploadQueueGlobalStats)
+async def get_global_upload_queue_stats(current_user: UserPublic = Depends(get_current_admin_user)):
+    """Completions and average time to ready across all users. Admin only."""
+    return await upload_queue.get_global_queue_stats()
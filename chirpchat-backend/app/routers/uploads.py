@@ -2,8 +2,9 @@
 import os
 import time
 from fastapi import APIRouter, HTTPException, Depends, status
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Literal, Optional, List, Dict, Any
+from uuid import UUID
 
 import cloudinary
 from cloudinary.utils import api_sign_request
@@ -13,11 +14,14 @@ from app.auth.dependencies import get_current_active_user
 from app.auth.schemas import UserPublic
 from app.utils.logging import logger
 from app.config import settings
+from app.media.schemas import UploadSignatureResponse
+from app.media import upload_queue
 
 cloudinary.config(
     cloud_name=settings.CLOUDINARY_CLOUD_NAME,
     api_key=settings.CLOUDINARY_API_KEY,
     api_secret=settings.CLOUDINARY_API_SECRET,
+    upload_prefix=settings.CLOUDINARY_API_PREFIX, # Lets a local stand-in server replace api.cloudinary.com.
     secure=True
 )
 
@@ -28,18 +32,80 @@ class GetUploadSignatureRequest(BaseModel):
     resource_type: Literal["image", "video", "raw", "auto"] = "auto"
     folder: str = "user_media_uploads"
 
-class UploadSignatureResponse(BaseModel):
-    signature: str
-    timestamp: int
-    api_key: str
-    cloud_name: str
+UPLOAD_PRESET_NAME = "my_signed__upload_preset"
+MAX_SIGNATURE_BATCH_SIZE = 50
+
+EAGER_TRANSFORMATIONS: Dict[str, List[Dict[str, Any]]] = {
+    "image": [
+        {"width": 250, "height": 250, "crop": "fill", "quality": "auto", "format": "jpg"},
+        {"width": 800, "quality": "auto", "format": "webp"}
+    ],
+    "video": [
+        {"format": "mp4", "quality": "auto:low", "video_codec": "auto"},
+        {"format": "mp3"},
+        {"streaming_profile": "auto", "format": "m3u8"},
+        {"format": "jpg", "start_offset": "1", "width": 400, "crop": "scale"},
+        {"format": "gif", "duration": "5", "width": 250, "crop": "fill"}
+    ],
+    "raw": [
+        {"format": "mp3"}
+    ],
+}
+
+def _serialize_eager(transformations: List[Dict[str, Any]]) -> str:
+    return "|".join("/".join(f"{k}_{v}" for k, v in sorted(t.items())) for t in transformations)
+
+# Serialized once at import; the strings are identical for every upload of a resource type.
+EAGER_BY_RESOURCE_TYPE: Dict[str, str] = {resource_type: _serialize_eager(t) for resource_type, t in EAGER_TRANSFORMATIONS.items()}
+
+class UploadSignatureFile(BaseModel):
     public_id: str
-    folder: str
-    resource_type: str
-    upload_preset: str
-    eager: Optional[str] = None
-    notification_url: Optional[str] = None
-    type: str
+    resource_type: Literal["image", "video", "raw", "auto"] = "auto"
+
+class GetUploadSignaturesRequest(BaseModel):
+    files: List[UploadSignatureFile] = Field(..., min_length=1, max_length=MAX_SIGNATURE_BATCH_SIZE)
+    folder: str = "user_media_uploads"
+
+class UploadSignaturesResponse(BaseModel):
+    signatures: List[UploadSignatureResponse]
+
+def build_upload_signature(public_id: str, resource_type: str, folder: str, user_id: UUID, timestamp: Optional[int] = None) -> UploadSignatureResponse:
+    """Signs the direct-upload parameters for one file. Raises HTTPException if uploads are not configured."""
+    if not settings.CLOUDINARY_WEBHOOK_URL:
+        logger.error("CLOUDINARY_WEBHOOK_URL is not configured in the environment.")
+        raise HTTPException(status_code=500, detail="Server is not configured for upload notifications.")
+
+    timestamp = timestamp or int(time.time())
+    final_folder = f"{folder}/user_{user_id}"
+    notification_url = settings.CLOUDINARY_WEBHOOK_URL
+
+    params_to_sign: Dict[str, Any] = {
+        "timestamp": timestamp,
+        "public_id": public_id,
+        "folder": final_folder,
+        "resource_type": resource_type,
+        "type": "private", # This is the 'type' parameter (e.g., 'upload', 'private', 'authenticated')
+        "notification_url": notification_url,
+        "upload_preset": UPLOAD_PRESET_NAME,
+    }
+    eager = EAGER_BY_RESOURCE_TYPE.get(resource_type)
+    if eager: params_to_sign["eager"] = eager
+
+    signature = api_sign_request(params_to_sign, settings.CLOUDINARY_API_SECRET)
+
+    return UploadSignatureResponse(
+        signature=signature,
+        timestamp=timestamp,
+        api_key=settings.CLOUDINARY_API_KEY,
+        cloud_name=settings.CLOUDINARY_CLOUD_NAME,
+        public_id=public_id,
+        folder=final_folder,
+        resource_type=resource_type,
+        upload_preset=UPLOAD_PRESET_NAME,
+        eager=eager,
+        notification_url=notification_url,
+        type="private"
+    )
 
 @router.post("/get-cloudinary-upload-signature", response_model=UploadSignatureResponse, summary="Generate a signature for direct Cloudinary upload")
 async def get_cloudinary_upload_signature(
@@ -51,91 +117,31 @@ async def get_cloudinary_upload_signature(
     to upload a file directly to Cloudinary, bypassing our backend.
     """
     try:
-        timestamp = int(time.time())
-        final_folder = f"{request.folder}/user_{current_user.id}"
-        upload_preset_name = "my_signed__upload_preset"
-
-        if not settings.CLOUDINARY_WEBHOOK_URL:
-            logger.error("CLOUDINARY_WEBHOOK_URL is not configured in the environment.")
-            raise HTTPException(status_code=500, detail="Server is not configured for upload notifications.")
-
-        notification_url = settings.CLOUDINARY_WEBHOOK_URL
-
-        params_to_sign: Dict[str, Any] = {
-            "timestamp": timestamp,
-            "public_id": request.public_id,
-            "folder": final_folder,
-            "resource_type": request.resource_type,
-            "type": "private", # This is the 'type' parameter (e.g., 'upload', 'private', 'authenticated')
-            "notification_url": notification_url,
-            "upload_preset": upload_preset_name,
-        }
-
-        eager_transformations: List[Dict[str, Any]] = []
-        if request.resource_type == "image":
-            eager_transformations.extend([
-                {"width": 250, "height": 250, "crop": "fill", "quality": "auto", "format": "jpg"},
-                {"width": 800, "quality": "auto", "format": "webp"}
-            ])
-        elif request.resource_type == "video":
-            eager_transformations.extend([
-                {"format": "mp4", "quality": "auto:low", "video_codec": "auto"},
-                {"format": "mp3"},
-                {"streaming_profile": "auto", "format": "m3u8"},
-                {"format": "jpg", "start_offset": "1", "width": 400, "crop": "scale"},
-                {"format": "gif", "duration": "5", "width": 250, "crop": "fill"}
-            ])
-        elif request.resource_type == "raw":
-            eager_transformations.extend([
-                {"format": "mp3"}
-            ])
-
-        if eager_transformations:
-            eager_strings = []
-            for t in eager_transformations:
-                sorted_t_items = sorted(t.items())
-                eager_strings.append("/".join([f"{k}_{v}" for k, v in sorted_t_items]))
-            params_to_sign["eager"] = "|".join(eager_strings)
-
-        logger.info(f"Parameters to sign: {params_to_sign}")
-        signature = api_sign_request(params_to_sign, settings.CLOUDINARY_API_SECRET)
-
-        return UploadSignatureResponse(
-            signature=signature,
-            timestamp=timestamp,
-            api_key=settings.CLOUDINARY_API_KEY,
-            cloud_name=settings.CLOUDINARY_CLOUD_NAME,
-            public_id=request.public_id,
-            folder=final_folder,
-            resource_type=request.resource_type,
-            upload_preset=upload_preset_name,
-            eager=params_to_sign.get("eager"),
-            notification_url=notification_url,
-            type="private"
-        )
+        signature = build_upload_signature(request.public_id, request.resource_type, request.folder, current_user.id)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error generating Cloudinary signature: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Could not generate upload signature.")
+    await upload_queue.mark_upload_started(current_user.id, request.public_id)
+    return signature
 
-async def delete_cloudinary_asset(public_id: str, resource_type: str):
+@router.post("/cloudinary-upload-signatures", response_model=UploadSignaturesResponse, summary="Generate signatures for several direct Cloudinary uploads")
+async def get_cloudinary_upload_signatures(
+    request: GetUploadSignaturesRequest,
+    current_user: UserPublic = Depends(get_current_active_user)
+):
     """
-    Asynchronously deletes a media asset from Cloudinary.
-    Intended to be run as a background task.
+    Batch form of /get-cloudinary-upload-signature, so picking several files
+    costs one round-trip before the uploads can start.
     """
+    timestamp = int(time.time())
     try:
-        logger.info(f"Background task: Deleting Cloudinary asset {public_id} (Type: {resource_type})")
-        result = cloudinary.uploader.destroy(
-            public_id,
-            resource_type=resource_type,
-            invalidate=True
-        )
-        if result.get("result") == "ok":
-            logger.info(f"Successfully deleted Cloudinary asset: {public_id}")
-        elif result.get("result") == "not found":
-            logger.warning(f"Cloudinary asset {public_id} not found, assuming already deleted.")
-        else:
-            logger.error(f"Cloudinary API reported an error for asset {public_id}: {result.get('error', 'Unknown error')}")
+        signatures = [build_upload_signature(f.public_id, f.resource_type, request.folder, current_user.id, timestamp) for f in request.files]
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Exception during Cloudinary deletion for asset {public_id}: {e}", exc_info=True)
+        logger.error(f"Error generating Cloudinary signatures: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Could not generate upload signatures.")
+    await upload_queue.mark_uploads_started(current_user.id, [f.public_id for f in request.files])
+    return UploadSignaturesResponse(signatures=signatures)
@@ -13,7 +13,7 @@ from app.chat.schemas import MessageCreate, MessageStatusEnum, SUPPORTED_EMOJIS,
 from app.database import db_manager
 from app.utils.logging import logger
 from app.notifications.service import notification_service
-from app.chat.routes import get_message_with_details_from_db
+from app.chat.routes import get_message_with_details_from_db, build_message_row, find_invalid_reply_targets
 from pydantic import ValidationError
 from starlette.websockets import WebSocketState
 
@@ -40,6 +40,7 @@ async def websocket_endpoint(websocket: WebSocket, token: Optional[str] = Query(
         while True:
             raw_data = await websocket.receive_text()
             await ws_manager.update_user_last_seen_throttled(user_id)
+            await ws_manager.mark_client_active(user_id)
             try:
                 data = json.loads(raw_data)
                 event_type = data.get("event_type")
@@ -75,7 +76,11 @@ async def handle_send_message(data: Dict[str, Any], websocket: WebSocket, curren
     if await ws_manager.is_message_processed(client_temp_id):
         await ws_manager.send_ack(websocket, client_temp_id)
         return
-    if not await ws_manager.is_user_in_chat(user_id, chat_id): return
+    membership = await ws_manager.get_chat_membership(user_id, chat_id)
+    if membership is None: return
+    if message_create.reply_to_message_id and await find_invalid_reply_targets(chat_id, [message_create.reply_to_message_id], membership.get("cleared_at")):
+        await ws_manager.send_personal_message(websocket, {"event_type": "error", "detail": "reply_to_message_id is not a message in this chat", "client_temp_id": client_temp_id})
+        return
     
     now, message_db_id = datetime.now(timezone.utc), uuid4()
     if message_create.mode == MessageModeEnum.INCOGNITO:
@@ -85,40 +90,7 @@ async def handle_send_message(data: Dict[str, Any], websocket: WebSocket, curren
         await ws_manager.broadcast_chat_message(str(chat_id), incognito_message)
         return
 
-    # Map frontend schema to new DB schema
-    message_data_to_insert = {
-        "id": str(message_db_id),
-        "chat_id": str(chat_id),
-        "user_id": str(user_id),
-        "text": message_create.text,
-        "media_type": message_create.message_subtype.value if message_create.message_subtype else 'text',
-        "mode": message_create.mode.value if message_create.mode else MessageModeEnum.NORMAL.value,
-        "status": MessageStatusEnum.SENT.value,
-        "upload_status": "completed", # Since this is after upload
-        "created_at": "now()",
-        "updated_at": "now()",
-        "reactions": {},
-        "client_temp_id": client_temp_id,
-        "reply_to_message_id": str(message_create.reply_to_message_id) if message_create.reply_to_message_id else None,
-        "sticker_id": str(message_create.sticker_id) if message_create.sticker_id else None,
-    }
-
-    # Handle media-specific fields
-    file_metadata = {}
-    if message_create.message_subtype in ['image', 'video', 'audio', 'document', 'voice_message', 'clip']:
-        message_data_to_insert["media_url"] = message_create.image_url or message_create.clip_url or message_create.document_url
-        message_data_to_insert["thumbnail_url"] = message_create.image_thumbnail_url
-        
-        file_metadata = {
-            "duration_seconds": message_create.duration_seconds,
-            "file_size_bytes": message_create.file_size_bytes,
-            "audio_format": message_create.audio_format,
-            "document_name": message_create.document_name,
-            "clip_type": message_create.clip_type.value if message_create.clip_type else None,
-        }
-        message_data_to_insert["file_metadata"] = json.dumps({k: v for k, v in file_metadata.items() if v is not None})
-        message_data_to_insert["file_size"] = message_create.file_size_bytes
-
+    message_data_to_insert = build_message_row(message_create, message_db_id, chat_id, user_id)
     await db_manager.get_table("messages").insert(message_data_to_insert).execute()
     await ws_manager.mark_message_as_processed(client_temp_id)
     await ws_manager.send_ack(websocket, client_temp_id, str(message_db_id))
@@ -1,48 +1,168 @@
-
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
+import asyncio
+from collections import defaultdict
+from email.message import EmailMessage
+from typing import Dict, List, NamedTuple, Optional
+import aiosmtplib
 from pydantic import EmailStr
-from typing import List, Optional
 from app.config import settings
 from app.utils.logging import logger # Assuming you have a logger setup
-from pathlib import Path
-import os
 
-# Determine the base directory of the project if needed for templates
-# For simple HTML string, it's not strictly necessary.
-# BASE_DIR = Path(__file__).resolve().parent.parent # This would be app/
+# Emails go through one long-lived SMTP session owned by a background worker instead of a fresh
+# connect + TLS + AUTH per message. Bursts are coalesced: when several login notifications for the
+# same recipient are waiting at once, they are sent as a single digest.
+EMAIL_QUEUE_MAX_SIZE = 1000
+EMAIL_DIGEST_THRESHOLD = 3 # Pending notifications per recipient before they are merged into one digest.
+EMAIL_BATCH_WINDOW_SECONDS = 2 # How long the worker lets a burst accumulate after the first message arrives.
+SMTP_IDLE_TIMEOUT_SECONDS = 60 # Most servers drop idle sessions after a few minutes; close ours first.
+SMTP_TIMEOUT_SECONDS = 30
+EMAIL_DRAIN_TIMEOUT_SECONDS = 10 # How long shutdown waits for queued emails to go out.
+EMAIL_MAX_SEND_ATTEMPTS = 2
+
+class QueuedEmail(NamedTuple):
+    subject: str
+    email_to: str
+    body: str
+    digest_entry: Optional[str] = None # HTML fragment used when this email is merged into a digest.
+
+def is_email_configured() -> bool:
+    return all([settings.SMTP_HOST, settings.SMTP_USER, settings.SMTP_PASSWORD, settings.SMTP_SENDER_EMAIL, settings.NOTIFICATION_EMAIL_TO])
+
+class EmailDispatcher:
+    def __init__(self):
+        self._queue: "asyncio.Queue[QueuedEmail]" = asyncio.Queue(maxsize=EMAIL_QUEUE_MAX_SIZE)
+        self._smtp: Optional[aiosmtplib.SMTP] = None
+        self._stopping = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+
+    def enqueue(self, email: QueuedEmail) -> bool:
+        try:
+            self._queue.put_nowait(email)
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"Email queue full ({EMAIL_QUEUE_MAX_SIZE}). Dropping email '{email.subject}' to {email.email_to}.")
+            return False
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        if self._smtp is not None and self._smtp.is_connected: return self._smtp
+        smtp = aiosmtplib.SMTP(hostname=settings.SMTP_HOST, port=settings.SMTP_PORT, use_tls=settings.SMTP_SSL, start_tls=settings.SMTP_TLS and not settings.SMTP_SSL, validate_certs=True, timeout=SMTP_TIMEOUT_SECONDS)
+        await smtp.connect()
+        await smtp.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
+        logger.info(f"Opened SMTP session to {settings.SMTP_HOST}:{settings.SMTP_PORT}")
+        self._smtp = smtp
+        return smtp
+
+    async def _close(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is None or not smtp.is_connected: return
+        try:
+            await smtp.quit()
+        except Exception:
+            smtp.close()
+
+    async def _send(self, subject: str, email_to: str, body: str):
+        message = EmailMessage()
+        message["From"] = settings.SMTP_SENDER_EMAIL
+        message["To"] = email_to
+        message["Subject"] = subject
+        message.set_content(body, subtype="html")
+        for attempt in range(1, EMAIL_MAX_SEND_ATTEMPTS + 1):
+            try:
+                smtp = await self._connect()
+                await smtp.send_message(message)
+                logger.info(f"Email sent to {email_to} for subject: {subject}")
+                return
+            except (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError, ConnectionError) as e:
+                # The server closed our session (idle timeout, restart); reconnect and try again.
+                await self._close()
+                if attempt == EMAIL_MAX_SEND_ATTEMPTS:
+                    logger.error(f"Failed to send email to {email_to} after {attempt} attempts: {e}")
+            except Exception as e:
+                logger.error(f"Failed to send email to {email_to}: {e}")
+                return
+
+    async def _send_batch(self, batch: List[QueuedEmail]):
+        digestible: Dict[str, List[QueuedEmail]] = defaultdict(list)
+        for email in batch:
+            if email.digest_entry is not None: digestible[email.email_to].append(email)
+            else: await self._send(email.subject, email.email_to, email.body)
+        for email_to, emails in digestible.items():
+            if len(emails) < EMAIL_DIGEST_THRESHOLD:
+                for email in emails: await self._send(email.subject, email.email_to, email.body)
+            else:
+                await self._send(f"Kuchlu: {len(emails)} user logins", email_to, build_login_digest_body([email.digest_entry for email in emails]))
+
+    def _take_queued(self) -> List[QueuedEmail]:
+        batch = []
+        while not self._queue.empty(): batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _next_email(self) -> Optional[QueuedEmail]:
+        """Waits for the next email; None after SMTP_IDLE_TIMEOUT_SECONDS of quiet or once drain() has been called."""
+        get = asyncio.ensure_future(self._queue.get())
+        stop = asyncio.ensure_future(self._stopping.wait())
+        try:
+            await asyncio.wait({get, stop}, timeout=SMTP_IDLE_TIMEOUT_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stop.cancel()
+            if not get.done(): get.cancel()
+        return get.result() if get.done() and not get.cancelled() else None
+
+    async def run(self):
+        """Drains the email queue until drain() is called; intended to be launched once at app startup."""
+        logger.info("Email dispatcher starting.")
+        self._worker = asyncio.current_task()
+        while not self._stopping.is_set():
+            try:
+                first = await self._next_email()
+                if first is None:
+                    await self._close()
+                    continue
+                # Let a burst accumulate, unless the app is shutting down.
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=EMAIL_BATCH_WINDOW_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                await self._send_batch([first] + self._take_queued())
+            except asyncio.CancelledError:
+                await self._close()
+                raise
+            except Exception as e:
+                logger.error(f"Error in email dispatcher: {e}", exc_info=True)
+
+    async def drain(self, timeout: float):
+        """Called at shutdown: lets the worker finish its batch, sends whatever is still queued, and closes the session."""
+        self._stopping.set()
+        async def finish():
+            if self._worker and not self._worker.done(): await self._worker
+            remaining = self._take_queued()
+            if remaining: await self._send_batch(remaining)
+        try:
+            await asyncio.wait_for(finish(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Email queue not drained within {timeout}s; {self._queue.qsize()} queued emails were not sent.")
+        await self._close()
+
+email_dispatcher = EmailDispatcher()
 
 async def send_email_async(subject: str, email_to: EmailStr, body: str):
-    if not all([settings.SMTP_HOST, settings.SMTP_USER, settings.SMTP_PASSWORD, settings.SMTP_SENDER_EMAIL, settings.NOTIFICATION_EMAIL_TO]):
+    if not is_email_configured():
         logger.warning("SMTP settings or NOTIFICATION_EMAIL_TO not fully configured. Skipping email notification.")
         return
+    email_dispatcher.enqueue(QueuedEmail(subject, email_to, body))
 
-    conf = ConnectionConfig(
-        MAIL_USERNAME=settings.SMTP_USER,
-        MAIL_PASSWORD=settings.SMTP_PASSWORD,
-        MAIL_FROM=settings.SMTP_SENDER_EMAIL,
-        MAIL_PORT=settings.SMTP_PORT,
-        MAIL_SERVER=settings.SMTP_HOST,
-        MAIL_STARTTLS=settings.SMTP_TLS,
-        MAIL_SSL_TLS=settings.SMTP_SSL,
-        USE_CREDENTIALS=True,
-        VALIDATE_CERTS=True, # Consider making this configurable for dev environments
-        # TEMPLATE_FOLDER=Path(BASE_DIR, 'templates/email') # If using Jinja templates
-    )
-
-    message = MessageSchema(
-        subject=subject,
-        recipients=[email_to],
-        body=body,
-        subtype=MessageType.html 
-    )
-
-    fm = FastMail(conf)
-    try:
-        await fm.send_message(message)
-        logger.info(f"Login notification email sent to {email_to} for subject: {subject}")
-    except Exception as e:
-        logger.error(f"Failed to send email to {email_to}: {e}")
-
+def build_login_digest_body(entries: List[str]) -> str:
+    return f"""
+    <html>
+        <body>
+            <h2>Kuchlu User Login Notification</h2>
+            <p>{len(entries)} logins to Kuchlu:</p>
+            <ul>
+                {"".join(entries)}
+            </ul>
+            <p>This is an automated notification.</p>
+        </body>
+    </html>
+    """
 
 async def send_login_notification_email(
     logged_in_user_name: str,
@@ -53,11 +173,14 @@ async def send_login_notification_email(
     if not settings.NOTIFICATION_EMAIL_TO:
         logger.info("NOTIFICATION_EMAIL_TO not set. Skipping login notification email.")
         return
+    if not is_email_configured():
+        logger.warning("SMTP settings or NOTIFICATION_EMAIL_TO not fully configured. Skipping email notification.")
+        return
 
     subject = f"Kuchlu User Login: {logged_in_user_name}"
-    
+
     phone_info = logged_in_user_phone if logged_in_user_phone else "N/A"
-    
+
     ip_info_html = f"<p><strong>IP Address:</strong> {client_host}</p>" if client_host else ""
 
     html_body = f"""
@@ -75,9 +198,6 @@ async def send_login_notification_email(
         </body>
     </html>
     """
-    try:
-        await send_email_async(subject, settings.NOTIFICATION_EMAIL_TO, html_body)
-    except Exception as e:
-        # send_email_async already logs, but good to catch here too if needed
-        logger.error(f"Error dispatching login notification for {logged_in_user_name}: {e}")
-
+    ip_info = f", {client_host}" if client_host else ""
+    digest_entry = f"<li><strong>{logged_in_user_name}</strong> ({phone_info}) at {login_time} UTC{ip_info}</li>"
+    email_dispatcher.enqueue(QueuedEmail(subject, settings.NOTIFICATION_EMAIL_TO, html_body, digest_entry))
@@ -0,0 +1,19 @@
+import base64
+from datetime import datetime
+from typing import Tuple
+from uuid import UUID
+
+from fastapi import HTTPException, status
+
+# Keyset cursors for newest-first pages ordered by (created_at, id). The id breaks ties between rows
+# that share a timestamp, so no row is skipped or repeated at a page boundary.
+
+def encode_keyset_cursor(created_at: str, row_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{created_at}|{row_id}".encode()).decode()
+
+def decode_keyset_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), UUID(row_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
@@ -1,19 +1,46 @@
 
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import AsyncIterable, AsyncIterator, Callable, Iterator, Optional, Set, Tuple
 from jose import JWTError, jwt, ExpiredSignatureError
 from passlib.context import CryptContext
-from fastapi import UploadFile, HTTPException, status
+from prometheus_client import Histogram
+import magic
+from fastapi import UploadFile, HTTPException, Request, status
 from app.config import settings
 from app.utils.logging import logger
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes made with any other cost are flagged by verify_password_and_update and rewritten on the next successful login.
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=settings.BCRYPT_ROUNDS, bcrypt__min_rounds=settings.BCRYPT_ROUNDS, bcrypt__max_rounds=settings.BCRYPT_ROUNDS)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+# bcrypt takes 100ms+ of CPU per call, so it never runs on the event loop. The bcrypt backend releases
+# the GIL, and the pool size caps how many cores a login burst can take; further calls wait in its queue.
+_password_hash_pool = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+PASSWORD_HASH_QUEUE_SECONDS = Histogram("password_hash_queue_seconds", "Time a password hash waited for a free worker.", ["operation"])
+PASSWORD_HASH_SECONDS = Histogram("password_hash_seconds", "Time spent computing a password hash.", ["operation"])
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+def _timed(operation: str, func: Callable, *args):
+    submitted_at = time.perf_counter()
+    def run():
+        started_at = time.perf_counter()
+        PASSWORD_HASH_QUEUE_SECONDS.labels(operation).observe(started_at - submitted_at)
+        try:
+            return func(*args)
+        finally:
+            PASSWORD_HASH_SECONDS.labels(operation).observe(time.perf_counter() - started_at)
+    return asyncio.get_running_loop().run_in_executor(_password_hash_pool, run)
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await _timed("verify", pwd_context.verify, plain_password, hashed_password)
+
+async def verify_password_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Returns (valid, new_hash). new_hash is set when the stored hash doesn't use the configured cost and should be replaced."""
+    return await _timed("verify", pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def get_password_hash(password: str) -> str:
+    return await _timed("hash", pwd_context.hash, password)
 
 def _create_token(data: dict, expires_delta: timedelta, token_type: str) -> str:
     to_encode = data.copy()
@@ -52,21 +79,79 @@ MAX_IMAGE_SIZE = 10 * 1024 * 1024  # 10MB
 MAX_CLIP_SIZE = 100 * 1024 * 1024 # 100MB
 MAX_DOCUMENT_SIZE = 50 * 1024 * 1024 # 50MB
 
-def _validate_file(file: UploadFile, allowed_types: set, max_size: int):
-    if file.content_type not in allowed_types:
-        logger.warning(f"Invalid file type: {file.content_type}. Allowed: {allowed_types}")
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid file type: {file.content_type}.")
-    
-    # file.size might not be available for all streams, but we check if it is
-    if file.size and file.size > max_size:
-        logger.warning(f"File too large: {file.size} bytes. Max size: {max_size} bytes.")
-        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"File too large. Max size is {max_size/1024/1024:.0f}MB.")
+# libmagic names some formats differently from browsers; map its answer onto the names above.
+SNIFFED_TYPE_ALIASES = {
+    "audio/x-wav": "audio/wav",
+    "audio/vnd.wave": "audio/wav",
+    "video/ogg": "audio/ogg",
+    "application/CDFV2": "application/msword",
+    "application/x-ole-storage": "application/msword",
+}
+DOCX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+DOCX_MAIN_PART = b"word/document.xml"
+ZIP_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+ZIP_LOCAL_HEADER_SIZE = 30
+MAGIC_SNIFF_BYTES = 2048
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+def _zip_entry_names(head: bytes) -> Iterator[bytes]:
+    """File names from the zip local headers within head. Entries beyond it are not seen."""
+    offset = head.find(ZIP_LOCAL_HEADER_SIGNATURE)
+    while offset != -1 and offset + ZIP_LOCAL_HEADER_SIZE <= len(head):
+        name_length = int.from_bytes(head[offset + 26:offset + 28], "little")
+        name_start = offset + ZIP_LOCAL_HEADER_SIZE
+        yield head[name_start:name_start + name_length]
+        offset = head.find(ZIP_LOCAL_HEADER_SIGNATURE, name_start + name_length)
+
+def sniff_content_type(head: bytes) -> str:
+    detected = magic.from_buffer(head, mime=True)
+    # libmagic reports some .docx files as plain zips; only count it as one if it has the Word main part.
+    if detected == "application/zip" and DOCX_MAIN_PART in _zip_entry_names(head): return DOCX_CONTENT_TYPE
+    return SNIFFED_TYPE_ALIASES.get(detected, detected)
+
+def _reject_too_large(size: int, max_size: int):
+    logger.warning(f"File too large: {size}+ bytes. Max size: {max_size} bytes.")
+    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"File too large. Max size is {max_size/1024/1024:.0f}MB.")
+
+async def iter_upload_file(file: UploadFile, chunk_size: int = UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    while chunk := await file.read(chunk_size):
+        yield chunk
+
+async def iter_request_body(request: Request) -> AsyncIterator[bytes]:
+    """Raw request body as it arrives from the socket; nothing is spooled to disk."""
+    async for chunk in request.stream():
+        if chunk: yield chunk
 
-def validate_image_upload(file: UploadFile):
-    _validate_file(file, ALLOWED_IMAGE_TYPES, MAX_IMAGE_SIZE)
+async def validate_upload_stream(chunks: AsyncIterable[bytes], allowed_types: Set[str], max_size: int, declared_size: Optional[int] = None) -> AsyncIterator[bytes]:
+    """
+    Passes chunks through unchanged while validating them, raising HTTPException as soon as a check fails:
+    the declared size before anything is read, the sniffed type once MAGIC_SNIFF_BYTES have arrived,
+    and the running size on every chunk. Nothing is yielded until the type has been confirmed.
+    """
+    if declared_size is not None and declared_size > max_size: _reject_too_large(declared_size, max_size)
+    head, total, sniffed = b"", 0, False
+    async for chunk in chunks:
+        total += len(chunk)
+        if total > max_size: _reject_too_large(total, max_size)
+        if sniffed:
+            yield chunk
+            continue
+        head += chunk
+        if len(head) < MAGIC_SNIFF_BYTES: continue
+        _check_sniffed_type(head, allowed_types)
+        sniffed = True
+        yield head
+    if not sniffed:
+        if not head: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Empty file.")
+        _check_sniffed_type(head, allowed_types)
+        yield head
 
-def validate_clip_upload(file: UploadFile):
-    _validate_file(file, ALLOWED_CLIP_TYPES, MAX_CLIP_SIZE)
+def _check_sniffed_type(head: bytes, allowed_types: Set[str]):
+    detected_type = sniff_content_type(head)
+    if detected_type not in allowed_types:
+        logger.warning(f"Invalid file type: detected {detected_type}. Allowed: {allowed_types}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid file type: {detected_type}.")
 
-def validate_document_upload(file: UploadFile):
-    _validate_file(file, ALLOWED_DOCUMENT_TYPES, MAX_DOCUMENT_SIZE)
+async def read_validated_upload(chunks: AsyncIterable[bytes], allowed_types: Set[str], max_size: int, declared_size: Optional[int] = None) -> bytes:
+    """Collects a validated stream for callers that need the whole (already size-capped) payload."""
+    return b"".join([chunk async for chunk in validate_upload_stream(chunks, allowed_types, max_size, declared_size)])
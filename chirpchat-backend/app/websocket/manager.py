@@ -1,9 +1,11 @@
 
 import asyncio
 import json
+import orjson
 from uuid import UUID
 from typing import Dict, List, Any, Optional
-from fastapi import WebSocket, WebSocketState
+from fastapi import WebSocket
+from starlette.websockets import WebSocketState
 from datetime import datetime, timedelta, timezone
 
 from app.config import settings
@@ -15,16 +17,23 @@ from app.chat.schemas import MessageStatusEnum, MessageInDB
 USER_CONNECTIONS_KEY = "user_connections"
 BROADCAST_CHANNEL = "chirpchat:broadcast"
 PROCESSED_MESSAGES_PREFIX = "processed_messages:"
+CHAT_MEMBERSHIP_PREFIX = "chat_membership:"
+CLIENT_ACTIVE_PREFIX = "client_active:"
 EVENT_SEQUENCE_KEY = "global_event_sequence"
 EVENT_LOG_KEY = "event_log"
 PROCESSED_MESSAGE_TTL_SECONDS = 300
+CHAT_MEMBERSHIP_TTL_SECONDS = 300
 EVENT_LOG_TTL_SECONDS = 60 * 60 * 24
 TRIM_EVENT_LOG_AFTER_N_EVENTS = 5000
 SERVER_ID = settings.SERVER_INSTANCE_ID
 THROTTLE_LAST_SEEN_UPDATE_SECONDS = 120
+# A connected client counts as reachable (no push needed) while it has sent a frame within this window.
+CLIENT_ACTIVE_TTL_SECONDS = 60
+THROTTLE_CLIENT_ACTIVE_SECONDS = 15
 
 active_local_connections: Dict[UUID, WebSocket] = {}
 user_last_activity_update_db: Dict[UUID, datetime] = {}
+user_last_active_mark: Dict[UUID, datetime] = {}
 
 async def connect(websocket: WebSocket, user_id: UUID):
     await websocket.accept()
@@ -32,6 +41,7 @@ async def connect(websocket: WebSocket, user_id: UUID):
     active_local_connections[user_id] = websocket
     
     await redis.hset(USER_CONNECTIONS_KEY, str(user_id), SERVER_ID)
+    await mark_client_active(user_id)
     await db_manager.get_table("users").update({"is_online": True, "last_seen": "now()"}).eq("id", str(user_id)).execute()
     
     user_mood_resp = await db_manager.get_table("users").select("mood").eq("id", str(user_id)).maybe_single().execute()
@@ -43,8 +53,10 @@ async def disconnect(user_id: UUID):
     if user_id in active_local_connections:
         del active_local_connections[user_id]
     
+    user_last_active_mark.pop(user_id, None)
     redis = await get_redis_client()
     await redis.hdel(USER_CONNECTIONS_KEY, str(user_id))
+    await redis.delete(f"{CLIENT_ACTIVE_PREFIX}{user_id}")
     await db_manager.get_table("users").update({"is_online": False, "last_seen": "now()"}).eq("id", str(user_id)).execute()
     
     user_mood_resp = await db_manager.get_table("users").select("mood").eq("id", str(user_id)).maybe_single().execute()
@@ -69,6 +81,25 @@ async def mark_message_as_processed(client_temp_id: str):
     redis = await get_redis_client()
     await redis.set(f"{PROCESSED_MESSAGES_PREFIX}{client_temp_id}", "1", ex=PROCESSED_MESSAGE_TTL_SECONDS)
 
+async def claim_messages_for_processing(client_temp_ids: List[str]) -> List[bool]:
+    """
+    Marks a batch of client_temp_ids as processed with one pipelined SET NX pass.
+    Returns True for each id this call claimed and False for ids that were already processed.
+    """
+    if not client_temp_ids: return []
+    redis = await get_redis_client()
+    async with redis.pipeline(transaction=False) as pipe:
+        for client_temp_id in client_temp_ids:
+            pipe.set(f"{PROCESSED_MESSAGES_PREFIX}{client_temp_id}", "1", ex=PROCESSED_MESSAGE_TTL_SECONDS, nx=True)
+        results = await pipe.execute()
+    return [bool(result) for result in results]
+
+async def release_processed_messages(client_temp_ids: List[str]):
+    """Undoes claim_messages_for_processing so a failed batch can be retried by the client."""
+    if not client_temp_ids: return
+    redis = await get_redis_client()
+    await redis.delete(*[f"{PROCESSED_MESSAGES_PREFIX}{client_temp_id}" for client_temp_id in client_temp_ids])
+
 async def send_ack(websocket: WebSocket, client_temp_id: str, server_id: Optional[str] = None):
     await send_personal_message(websocket, {"event_type": "message_ack", "client_temp_id": client_temp_id, "server_assigned_id": server_id or client_temp_id, "status": MessageStatusEnum.SENT.value, "timestamp": datetime.now(timezone.utc).isoformat()})
 
@@ -78,7 +109,7 @@ async def broadcast_to_users(user_ids: List[UUID], payload: Dict[str, Any]):
     payload_with_seq = {**payload, "sequence": sequence_num}
     
     message_to_publish = {"target_user_ids": [str(uid) for uid in user_ids], "payload": payload_with_seq}
-    message_json = json.dumps(message_to_publish)
+    message_json = orjson.dumps(message_to_publish).decode()
 
     async with redis.pipeline(transaction=True) as pipe:
         pipe.zadd(EVENT_LOG_KEY, {message_json: sequence_num})
@@ -109,13 +140,19 @@ async def broadcast_chat_history_cleared(chat_id: str):
 
 async def broadcast_chat_message(chat_id: str, message_data: MessageInDB):
     participant_ids = await _get_chat_participants(chat_id)
-    payload = {"event_type": "new_message", "message": message_data.model_dump(mode='json'), "chat_id": chat_id}
+    payload = {"event_type": "new_message", "message": message_data.model_dump(), "chat_id": chat_id}
+    if participant_ids: await broadcast_to_users(participant_ids, payload)
+
+async def broadcast_chat_messages(chat_id: str, messages: List[MessageInDB]):
+    """Broadcasts several new messages of one chat as a single ordered event."""
+    participant_ids = await _get_chat_participants(chat_id)
+    payload = {"event_type": "new_message_batch", "messages": [message.model_dump() for message in messages], "chat_id": chat_id}
     if participant_ids: await broadcast_to_users(participant_ids, payload)
 
 async def broadcast_media_processed(chat_id: str, message_data: MessageInDB):
     """Broadcasts that a media message has been processed and is ready for display."""
     participant_ids = await _get_chat_participants(chat_id)
-    payload = {"event_type": "media_processed", "message": message_data.model_dump(mode='json')}
+    payload = {"event_type": "media_processed", "message": message_data.model_dump()}
     if participant_ids:
         await broadcast_to_users(participant_ids, payload)
 
@@ -179,7 +216,7 @@ async def listen_for_broadcasts():
             while True:
                 message = await ps_client.get_message(ignore_subscribe_messages=True, timeout=None)
                 if message and message["type"] == "message":
-                    message_data = json.loads(message["data"])
+                    message_data = orjson.loads(message["data"])
                     target_user_ids = [UUID(uid) for uid in message_data["target_user_ids"]]
                     payload = message_data["payload"]
                     locally_connected_targets = [uid for uid in target_user_ids if uid in active_local_connections]
@@ -196,7 +233,45 @@ async def update_user_last_seen_throttled(user_id: UUID):
         await db_manager.get_table("users").update({"last_seen": "now()"}).eq("id", str(user_id)).execute()
         user_last_activity_update_db[user_id] = now
 
+async def mark_client_active(user_id: UUID):
+    """Refreshes the user's 'recently heard from' marker; throttled so chatty clients don't write on every frame."""
+    now = datetime.now(timezone.utc)
+    last_mark = user_last_active_mark.get(user_id)
+    if last_mark and (now - last_mark) < timedelta(seconds=THROTTLE_CLIENT_ACTIVE_SECONDS): return
+    redis = await get_redis_client()
+    await redis.set(f"{CLIENT_ACTIVE_PREFIX}{user_id}", SERVER_ID, ex=CLIENT_ACTIVE_TTL_SECONDS)
+    user_last_active_mark[user_id] = now
+
+async def get_reachable_users(user_ids: List[UUID]) -> set:
+    """Users with a registered WebSocket that has also been active recently, i.e. who will see events live."""
+    if not user_ids: return set()
+    redis = await get_redis_client()
+    async with redis.pipeline(transaction=False) as pipe:
+        for user_id in user_ids:
+            pipe.hexists(USER_CONNECTIONS_KEY, str(user_id))
+            pipe.exists(f"{CLIENT_ACTIVE_PREFIX}{user_id}")
+        results = await pipe.execute()
+    return {user_id for i, user_id in enumerate(user_ids) if results[2 * i] and results[2 * i + 1]}
+
+async def get_chat_membership(user_id: UUID, chat_id: UUID) -> Optional[Dict[str, Any]]:
+    """
+    Returns the user's membership in a chat as {"cleared_at": ...}, or None if they are not a participant.
+    The membership check and the history-cleared watermark come from one query and are cached together in Redis.
+    """
+    redis = await get_redis_client()
+    cache_key = f"{CHAT_MEMBERSHIP_PREFIX}{chat_id}:{user_id}"
+    cached = await redis.get(cache_key)
+    if cached: return orjson.loads(cached)
+    resp = await db_manager.get_table("chat_participants").select("user_id, cleared_at").eq("chat_id", str(chat_id)).eq("user_id", str(user_id)).maybe_single().execute()
+    if not resp or not resp.data: return None
+    membership = {"cleared_at": resp.data.get("cleared_at")}
+    await redis.set(cache_key, orjson.dumps(membership), ex=CHAT_MEMBERSHIP_TTL_SECONDS)
+    return membership
+
+async def invalidate_chat_membership(user_id: UUID, chat_id: UUID):
+    redis = await get_redis_client()
+    await redis.delete(f"{CHAT_MEMBERSHIP_PREFIX}{chat_id}:{user_id}")
+
 async def is_user_in_chat(user_id: UUID, chat_id: UUID) -> bool:
-    resp = await db_manager.get_table("chat_participants").select("user_id").eq("chat_id", str(chat_id)).eq("user_id", str(user_id)).maybe_single().execute()
-    return bool(resp.data)
+    return await get_chat_membership(user_id, chat_id) is not None
 
@@ -0,0 +1,38 @@
+-- Migration: Replaces 'history_cleared_marker' messages with a per-user watermark.
+--
+-- Clearing a chat used to insert a marker row into 'messages', and every history
+-- request had to look up the latest marker before fetching the page. The clear point
+-- now lives on the participant row as 'cleared_at', which is read together with the
+-- membership check and filtered on directly by the history query.
+--
+-- How to apply this migration:
+-- 1. Go to your Supabase project dashboard.
+-- 2. In the left sidebar, click on the "SQL Editor" icon.
+-- 3. Paste the entire content of this file into the editor and click "Run".
+
+BEGIN;
+
+-- Step 1: Add the watermark column.
+ALTER TABLE public.chat_participants
+ADD COLUMN IF NOT EXISTS cleared_at TIMESTAMP WITH TIME ZONE NULL;
+
+COMMENT ON COLUMN public.chat_participants.cleared_at IS 'Messages created at or before this time are hidden from this participant''s history.';
+
+-- Step 2: Carry over the latest existing marker for each participant.
+UPDATE public.chat_participants AS cp
+SET cleared_at = markers.last_cleared_at
+FROM (
+    SELECT chat_id, user_id, MAX(created_at) AS last_cleared_at
+    FROM public.messages
+    WHERE message_subtype = 'history_cleared_marker'
+    GROUP BY chat_id, user_id
+) AS markers
+WHERE cp.chat_id = markers.chat_id
+  AND cp.user_id = markers.user_id
+  AND (cp.cleared_at IS NULL OR cp.cleared_at < markers.last_cleared_at);
+
+-- Step 3: Remove the marker rows so they no longer show up in chat lists or history.
+DELETE FROM public.messages
+WHERE message_subtype = 'history_cleared_marker';
+
+COMMIT;
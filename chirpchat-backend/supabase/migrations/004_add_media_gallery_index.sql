@@ -0,0 +1,13 @@
+-- Migration: Adds a partial index backing the per-chat shared-media gallery.
+--
+-- GET /chats/{chat_id}/media filters on chat_id and media_type and pages by created_at.
+-- Only rows that actually carry media are indexed, so text messages cost nothing here.
+--
+-- How to apply this migration:
+-- 1. Go to your Supabase project dashboard.
+-- 2. In the left sidebar, click on the "SQL Editor" icon.
+-- 3. Paste the entire content of this file into the editor and click "Run".
+
+CREATE INDEX IF NOT EXISTS idx_messages_chat_media_gallery
+ON public.messages(chat_id, media_type, created_at DESC)
+WHERE media_url IS NOT NULL;
@@ -0,0 +1,26 @@
+-- Migration: Prepares 'upload_queue' for server-side upload orchestration.
+--
+-- The queue is now driven by the /uploads/queue endpoints. Items belong to rows in
+-- 'public.users' (the table the API authenticates against), and claims read each
+-- user's pending items by priority, so that lookup gets its own partial index.
+--
+-- How to apply this migration:
+-- 1. Go to your Supabase project dashboard.
+-- 2. In the left sidebar, click on the "SQL Editor" icon.
+-- 3. Paste the entire content of this file into the editor and click "Run".
+
+BEGIN;
+
+-- Step 1: Point the owner column at the application's users table.
+ALTER TABLE public.upload_queue
+DROP CONSTRAINT IF EXISTS upload_queue_user_id_fkey;
+
+ALTER TABLE public.upload_queue
+ADD CONSTRAINT upload_queue_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(id) ON DELETE CASCADE;
+
+-- Step 2: Per-user claim order (see claim_uploads in app/media/upload_queue.py).
+CREATE INDEX IF NOT EXISTS idx_upload_queue_user_pending
+ON public.upload_queue(user_id, upload_priority DESC, created_at ASC)
+WHERE status = 'pending';
+
+COMMIT;
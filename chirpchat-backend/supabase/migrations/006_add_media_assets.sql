@@ -0,0 +1,82 @@
+-- Migration: Adds a content-hash index of uploaded media for deduplication.
+--
+-- Clients send the SHA-256 of a file before uploading it. If 'media_assets' already
+-- has that hash, the message is created against the existing Cloudinary asset and
+-- nothing is uploaded. 'ref_count' tracks how many messages point at each asset, so
+-- deleting a message only destroys the Cloudinary asset once its last reference is gone.
+-- The functions below do the count changes atomically; the API calls them via RPC.
+--
+-- How to apply this migration:
+-- 1. Go to your Supabase project dashboard.
+-- 2. In the left sidebar, click on the "SQL Editor" icon.
+-- 3. Paste the entire content of this file into the editor and click "Run".
+
+BEGIN;
+
+-- Step 1: Create the asset index.
+CREATE TABLE IF NOT EXISTS public.media_assets (
+    content_hash TEXT PRIMARY KEY CHECK (content_hash ~ '^[0-9a-f]{64}$'),
+    public_id TEXT NOT NULL UNIQUE,
+    resource_type TEXT NOT NULL,
+    media_url TEXT,
+    thumbnail_url TEXT,
+    file_size BIGINT,
+    file_metadata JSONB NOT NULL DEFAULT '{}',
+    ref_count INTEGER NOT NULL DEFAULT 1 CHECK (ref_count >= 0),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    last_referenced_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+COMMENT ON TABLE public.media_assets IS 'One row per distinct uploaded file, keyed by the SHA-256 of its bytes.';
+COMMENT ON COLUMN public.media_assets.ref_count IS 'Number of messages referencing this Cloudinary asset.';
+
+-- Step 2: Take a reference on an existing asset (dedup hit). Returns no row on a miss.
+CREATE OR REPLACE FUNCTION public.acquire_media_asset(p_content_hash TEXT)
+RETURNS SETOF public.media_assets
+LANGUAGE sql
+AS $$
+    UPDATE public.media_assets
+    SET ref_count = ref_count + 1, last_referenced_at = NOW()
+    WHERE content_hash = p_content_hash
+    RETURNING *;
+$$;
+
+-- Step 3: Record a freshly uploaded asset with its first reference.
+-- Returns FALSE if the same bytes were already registered by a concurrent upload.
+CREATE OR REPLACE FUNCTION public.register_media_asset(
+    p_content_hash TEXT, p_public_id TEXT, p_resource_type TEXT, p_media_url TEXT,
+    p_thumbnail_url TEXT, p_file_size BIGINT, p_file_metadata JSONB
+)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO public.media_assets (content_hash, public_id, resource_type, media_url, thumbnail_url, file_size, file_metadata)
+    VALUES (p_content_hash, p_public_id, p_resource_type, p_media_url, p_thumbnail_url, p_file_size, COALESCE(p_file_metadata, '{}'))
+    ON CONFLICT DO NOTHING;
+    RETURN FOUND;
+END;
+$$;
+
+-- Step 4: Drop one reference. Returns the remaining count (the row is removed at zero),
+-- or NULL if the asset is not tracked, in which case the caller owns it outright.
+CREATE OR REPLACE FUNCTION public.release_media_asset(p_public_id TEXT)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    remaining INTEGER;
+BEGIN
+    UPDATE public.media_assets
+    SET ref_count = ref_count - 1
+    WHERE public_id = p_public_id
+    RETURNING ref_count INTO remaining;
+
+    IF remaining IS NOT NULL AND remaining <= 0 THEN
+        DELETE FROM public.media_assets WHERE public_id = p_public_id AND ref_count <= 0;
+    END IF;
+    RETURN remaining;
+END;
+$$;
+
+COMMIT;
@@ -0,0 +1,15 @@
+-- Migration: Stores resized avatar variants alongside the avatar URL.
+--
+-- Avatars are resized server-side to 64, 128 and 512 px WebP. 'avatar_url' now holds
+-- the 128 px variant that chat lists and presence updates embed, and 'avatar_variants'
+-- maps each pixel size to its URL so callers can pick the smallest size that fits.
+--
+-- How to apply this migration:
+-- 1. Go to your Supabase project dashboard.
+-- 2. In the left sidebar, click on the "SQL Editor" icon.
+-- 3. Paste the entire content of this file into the editor and click "Run".
+
+ALTER TABLE public.users
+ADD COLUMN IF NOT EXISTS avatar_variants JSONB NULL;
+
+COMMENT ON COLUMN public.users.avatar_variants IS 'Avatar WebP URLs keyed by pixel size, e.g. {"64": "...", "128": "...", "512": "..."}.';
@@ -0,0 +1,102 @@
+-- Migration: Adds per-user daily mood counts for mood suggestions.
+--
+-- Suggestions used to read every 'mood_analytics' row in a 30-90 day window and count
+-- them in Python. 'mood_daily_counts' keeps one row per user, UTC day and mood instead,
+-- maintained by a statement-level trigger on 'mood_analytics' (one upsert per bulk insert).
+-- get_top_moods sums at most (days x distinct moods) rows per user, however many events
+-- there are. Days older than the longest suggestion window are pruned by the API.
+--
+-- How to apply this migration:
+-- 1. Go to your Supabase project dashboard.
+-- 2. In the left sidebar, click on the "SQL Editor" icon.
+-- 3. Paste the entire content of this file into the editor and click "Run".
+
+BEGIN;
+
+-- Step 1: Create the rollup table. A missing emoji is stored as '' so it can be part of the key.
+CREATE TABLE IF NOT EXISTS public.mood_daily_counts (
+    user_id UUID NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    mood_name TEXT NOT NULL,
+    mood_emoji TEXT NOT NULL DEFAULT '',
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day, mood_name, mood_emoji)
+);
+
+COMMENT ON TABLE public.mood_daily_counts IS 'Rollup of mood_analytics: events per user, UTC day and (mood_name, mood_emoji).';
+
+-- Step 2: Keep the rollup current. Runs once per INSERT statement over all inserted rows.
+CREATE OR REPLACE FUNCTION public.rollup_mood_analytics()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO public.mood_daily_counts (user_id, day, mood_name, mood_emoji, count)
+    SELECT user_id, (created_at AT TIME ZONE 'utc')::DATE, mood_name, COALESCE(mood_emoji, ''), COUNT(*)
+    FROM new_rows
+    WHERE user_id IS NOT NULL AND mood_name IS NOT NULL
+    GROUP BY 1, 2, 3, 4
+    ON CONFLICT (user_id, day, mood_name, mood_emoji) DO UPDATE SET count = public.mood_daily_counts.count + EXCLUDED.count;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS mood_analytics_rollup ON public.mood_analytics;
+CREATE TRIGGER mood_analytics_rollup
+AFTER INSERT ON public.mood_analytics
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION public.rollup_mood_analytics();
+
+-- Step 3: Top-k moods since a given day.
+CREATE OR REPLACE FUNCTION public.get_top_moods(p_user_id UUID, p_since DATE, p_limit INTEGER)
+RETURNS TABLE (mood_name TEXT, mood_emoji TEXT, total BIGINT)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT c.mood_name, NULLIF(c.mood_emoji, ''), SUM(c.count) AS total
+    FROM public.mood_daily_counts c
+    WHERE c.user_id = p_user_id AND c.day >= p_since
+    GROUP BY c.mood_name, c.mood_emoji
+    ORDER BY total DESC, c.mood_name
+    LIMIT p_limit;
+$$;
+
+-- Step 4: Drop days that no suggestion window reaches any more. Returns the number of rows removed.
+CREATE OR REPLACE FUNCTION public.prune_mood_daily_counts(p_keep_days INTEGER)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    removed INTEGER;
+BEGIN
+    DELETE FROM public.mood_daily_counts WHERE day < (NOW() AT TIME ZONE 'utc')::DATE - p_keep_days;
+    GET DIAGNOSTICS removed = ROW_COUNT;
+    RETURN removed;
+END;
+$$;
+
+-- Step 5: Backfill. Recomputes every day from p_since onwards from mood_analytics, so it is
+-- safe to re-run (e.g. after bulk-loading events with the trigger disabled).
+CREATE OR REPLACE FUNCTION public.rebuild_mood_daily_counts(p_since DATE)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    inserted INTEGER;
+BEGIN
+    -- Block concurrent inserts so no event is counted by both the trigger and the rebuild.
+    LOCK TABLE public.mood_analytics IN SHARE ROW EXCLUSIVE MODE;
+    DELETE FROM public.mood_daily_counts WHERE day >= p_since;
+    INSERT INTO public.mood_daily_counts (user_id, day, mood_name, mood_emoji, count)
+    SELECT user_id, (created_at AT TIME ZONE 'utc')::DATE, mood_name, COALESCE(mood_emoji, ''), COUNT(*)
+    FROM public.mood_analytics
+    WHERE user_id IS NOT NULL AND mood_name IS NOT NULL AND created_at >= (p_since::TIMESTAMP AT TIME ZONE 'utc')
+    GROUP BY 1, 2, 3, 4;
+    GET DIAGNOSTICS inserted = ROW_COUNT;
+    RETURN inserted;
+END;
+$$;
+
+SELECT public.rebuild_mood_daily_counts(((NOW() AT TIME ZONE 'utc')::DATE - 90));
+
+COMMIT;
@@ -0,0 +1,54 @@
+-- Migration: Adds an index-backed, paginated activity timeline.
+--
+-- The history screen used to load every 'mood_analytics' row ever recorded for a couple
+-- and filter and sort it in Python. get_activity_timeline returns one page of the events
+-- the timeline shows, newest first, using a keyset cursor (created_at, id). Each
+-- (user, source) branch is an ordered scan of the new index that stops after p_limit rows.
+--
+-- How to apply this migration:
+-- 1. Go to your Supabase project dashboard.
+-- 2. In the left sidebar, click on the "SQL Editor" icon.
+-- 3. Paste the entire content of this file into the editor and click "Run".
+
+BEGIN;
+
+-- Step 1: Index for per-user, per-source history in reverse chronological order.
+CREATE INDEX IF NOT EXISTS idx_mood_analytics_user_source_created
+ON public.mood_analytics(user_id, source, created_at DESC, id DESC);
+
+-- Step 2: One timeline page. The user's own mood updates and pings, plus pings sent by the partner.
+-- Pass NULL p_before on the first page and NULL p_since for no lower bound. p_before alone (no
+-- p_before_id) is an exclusive upper bound on created_at.
+CREATE OR REPLACE FUNCTION public.get_activity_timeline(
+    p_user_id UUID, p_partner_id UUID, p_since TIMESTAMP WITH TIME ZONE,
+    p_before TIMESTAMP WITH TIME ZONE, p_before_id UUID, p_limit INTEGER
+)
+RETURNS TABLE (id UUID, user_id UUID, source TEXT, mood_name TEXT, created_at TIMESTAMP WITH TIME ZONE)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT t.id, t.user_id, t.source, t.mood_name, t.created_at
+    FROM (
+        (SELECT m.id, m.user_id, m.source, m.mood_name, m.created_at FROM public.mood_analytics m
+         WHERE m.user_id = p_user_id AND m.source = 'profile_update'
+           AND (p_since IS NULL OR m.created_at >= p_since)
+           AND (p_before IS NULL OR (m.created_at, m.id) < (p_before, COALESCE(p_before_id, '00000000-0000-0000-0000-000000000000'::UUID)))
+         ORDER BY m.created_at DESC, m.id DESC LIMIT p_limit)
+        UNION ALL
+        (SELECT m.id, m.user_id, m.source, m.mood_name, m.created_at FROM public.mood_analytics m
+         WHERE m.user_id = p_user_id AND m.source = 'assistive_touch_ping'
+           AND (p_since IS NULL OR m.created_at >= p_since)
+           AND (p_before IS NULL OR (m.created_at, m.id) < (p_before, COALESCE(p_before_id, '00000000-0000-0000-0000-000000000000'::UUID)))
+         ORDER BY m.created_at DESC, m.id DESC LIMIT p_limit)
+        UNION ALL
+        (SELECT m.id, m.user_id, m.source, m.mood_name, m.created_at FROM public.mood_analytics m
+         WHERE p_partner_id IS NOT NULL AND m.user_id = p_partner_id AND m.source = 'assistive_touch_ping'
+           AND (p_since IS NULL OR m.created_at >= p_since)
+           AND (p_before IS NULL OR (m.created_at, m.id) < (p_before, COALESCE(p_before_id, '00000000-0000-0000-0000-000000000000'::UUID)))
+         ORDER BY m.created_at DESC, m.id DESC LIMIT p_limit)
+    ) t
+    ORDER BY t.created_at DESC, t.id DESC
+    LIMIT p_limit;
+$$;
+
+COMMIT;
@@ -0,0 +1,129 @@
+-- Migration: Fills in the outcome fields of 'mood_analytics' incrementally.
+--
+-- Mood events are stored with partner_response_time, partner_reaction,
+-- conversation_started and mood_reciprocated left NULL. compute_mood_outcomes fills them
+-- in for the next batch of events whose outcome window has closed, with a single UPDATE,
+-- and then advances a watermark in 'job_watermarks' in the same transaction. A crashed run
+-- therefore leaves neither half-written outcomes nor a skipped batch. Re-running a batch
+-- writes the same values, so the job is safe to restart or rewind.
+--
+-- Outcomes, all measured within p_window_seconds of the mood event:
+--   partner_response_time  Seconds until the partner's first message in a chat the two share.
+--   partner_reaction       The partner's reaction on the earliest of the user's messages they reacted to.
+--   conversation_started   Both of them sent at least one message in a shared chat.
+--   mood_reciprocated      The partner recorded a mood event of their own aimed at the user.
+-- Events without a partner_id only get conversation_started = FALSE.
+--
+-- How to apply this migration:
+-- 1. Go to your Supabase project dashboard.
+-- 2. In the left sidebar, click on the "SQL Editor" icon.
+-- 3. Paste the entire content of this file into the editor and click "Run".
+
+BEGIN;
+
+-- Step 1: Outcome columns (no-ops where they already exist) and a marker for processed rows.
+ALTER TABLE public.mood_analytics ADD COLUMN IF NOT EXISTS partner_response_time INTEGER;
+ALTER TABLE public.mood_analytics ADD COLUMN IF NOT EXISTS partner_reaction TEXT;
+ALTER TABLE public.mood_analytics ADD COLUMN IF NOT EXISTS conversation_started BOOLEAN;
+ALTER TABLE public.mood_analytics ADD COLUMN IF NOT EXISTS mood_reciprocated BOOLEAN;
+ALTER TABLE public.mood_analytics ADD COLUMN IF NOT EXISTS outcome_computed_at TIMESTAMP WITH TIME ZONE;
+
+-- Step 2: Watermarks for incremental jobs: the last (created_at, id) each job has processed.
+CREATE TABLE IF NOT EXISTS public.job_watermarks (
+    job_name TEXT PRIMARY KEY,
+    last_created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT '-infinity',
+    last_id UUID NOT NULL DEFAULT '00000000-0000-0000-0000-000000000000',
+    processed_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Step 3: Indexes for the batch scan and the per-event message lookups.
+CREATE INDEX IF NOT EXISTS idx_mood_analytics_created_id ON public.mood_analytics(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_messages_user_created ON public.messages(user_id, created_at);
+
+-- Step 4: Process one batch. Returns the number of mood events processed (< p_batch_size once caught up).
+CREATE OR REPLACE FUNCTION public.compute_mood_outcomes(p_batch_size INTEGER, p_window_seconds INTEGER)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    mark public.job_watermarks%ROWTYPE;
+    processed INTEGER;
+    batch_last_created_at TIMESTAMP WITH TIME ZONE;
+    batch_last_id UUID;
+BEGIN
+    INSERT INTO public.job_watermarks (job_name) VALUES ('mood_outcomes') ON CONFLICT DO NOTHING;
+    -- The row lock makes concurrent runs (one per API instance) take turns instead of repeating work.
+    SELECT * INTO mark FROM public.job_watermarks WHERE job_name = 'mood_outcomes' FOR UPDATE;
+
+    WITH batch AS (
+        SELECT m.id, m.user_id, m.partner_id, m.created_at, m.created_at + make_interval(secs => p_window_seconds) AS window_end
+        FROM public.mood_analytics m
+        WHERE (m.created_at, m.id) > (mark.last_created_at, mark.last_id)
+          AND m.created_at <= NOW() - make_interval(secs => p_window_seconds)
+        ORDER BY m.created_at, m.id
+        LIMIT p_batch_size
+    ),
+    outcomes AS (
+        SELECT
+            b.id,
+            EXTRACT(EPOCH FROM reply.created_at - b.created_at)::INTEGER AS partner_response_time,
+            reaction.emoji AS partner_reaction,
+            (reply.created_at IS NOT NULL AND sent.found IS NOT NULL) AS conversation_started,
+            CASE WHEN b.partner_id IS NULL THEN NULL ELSE reciprocated.found IS NOT NULL END AS mood_reciprocated
+        FROM batch b
+        -- Partner's first message in a chat the user is also in.
+        LEFT JOIN LATERAL (
+            SELECT msg.created_at FROM public.messages msg
+            JOIN public.chat_participants cp ON cp.chat_id = msg.chat_id AND cp.user_id = b.user_id
+            WHERE msg.user_id = b.partner_id AND msg.created_at > b.created_at AND msg.created_at <= b.window_end
+            ORDER BY msg.created_at LIMIT 1
+        ) reply ON TRUE
+        -- Any message from the user in a chat the partner is also in.
+        LEFT JOIN LATERAL (
+            SELECT TRUE AS found FROM public.messages msg
+            JOIN public.chat_participants cp ON cp.chat_id = msg.chat_id AND cp.user_id = b.partner_id
+            WHERE msg.user_id = b.user_id AND msg.created_at > b.created_at AND msg.created_at <= b.window_end
+            LIMIT 1
+        ) sent ON TRUE
+        -- The partner's reaction on the earliest such message they reacted to.
+        LEFT JOIN LATERAL (
+            SELECT r.key AS emoji FROM public.messages msg
+            JOIN public.chat_participants cp ON cp.chat_id = msg.chat_id AND cp.user_id = b.partner_id
+            CROSS JOIN LATERAL jsonb_each(COALESCE(msg.reactions, '{}'::JSONB)) r
+            WHERE msg.user_id = b.user_id AND msg.created_at > b.created_at AND msg.created_at <= b.window_end
+              AND r.value ? b.partner_id::TEXT
+            ORDER BY msg.created_at, r.key LIMIT 1
+        ) reaction ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT TRUE AS found FROM public.mood_analytics pm
+            WHERE pm.user_id = b.partner_id AND pm.partner_id = b.user_id
+              AND pm.created_at > b.created_at AND pm.created_at <= b.window_end
+            LIMIT 1
+        ) reciprocated ON TRUE
+    ),
+    updated AS (
+        UPDATE public.mood_analytics m
+        SET partner_response_time = o.partner_response_time,
+            partner_reaction = o.partner_reaction,
+            conversation_started = o.conversation_started,
+            mood_reciprocated = o.mood_reciprocated,
+            outcome_computed_at = NOW()
+        FROM outcomes o
+        WHERE m.id = o.id
+    )
+    SELECT COUNT(*), MAX(b.created_at), (ARRAY_AGG(b.id ORDER BY b.created_at DESC, b.id DESC))[1]
+    INTO processed, batch_last_created_at, batch_last_id
+    FROM batch b;
+
+    IF processed > 0 THEN
+        UPDATE public.job_watermarks
+        SET last_created_at = batch_last_created_at, last_id = batch_last_id,
+            processed_count = processed_count + processed, updated_at = NOW()
+        WHERE job_name = 'mood_outcomes';
+    END IF;
+    RETURN processed;
+END;
+$$;
+
+COMMIT;
@@ -0,0 +1,42 @@
+-- Migration: Inserts a batch of messages with database timestamps in batch order.
+--
+-- The batch send endpoint used to stamp created_at with the API server's clock, so messages
+-- from servers with skewed clocks could sort before messages that were sent earlier.
+-- insert_messages_batch inserts the rows in one statement and stamps them with the
+-- transaction time, adding one microsecond per position so the outbox order survives the
+-- (created_at, id) sort used by history. Only the columns present in the first row are
+-- written, like a PostgREST bulk insert; created_at and updated_at are always set here.
+--
+-- How to apply this migration:
+-- 1. Go to your Supabase project dashboard.
+-- 2. In the left sidebar, click on the "SQL Editor" icon.
+-- 3. Paste the entire content of this file into the editor and click "Run".
+
+BEGIN;
+
+-- Returns the ids of the inserted rows, in batch order.
+CREATE OR REPLACE FUNCTION public.insert_messages_batch(p_rows JSONB)
+RETURNS SETOF UUID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    columns TEXT;
+BEGIN
+    SELECT string_agg(quote_ident(key), ', ') INTO columns
+    FROM jsonb_object_keys(p_rows->0) AS key
+    WHERE key NOT IN ('created_at', 'updated_at');
+
+    RETURN QUERY EXECUTE format(
+        'INSERT INTO public.messages (%1$s, created_at, updated_at)
+         SELECT %1$s, stamped_at, stamped_at FROM (
+             SELECT r.*, NOW() + (r.ordinality - 1) * INTERVAL ''1 microsecond'' AS stamped_at
+             FROM jsonb_populate_recordset(NULL::public.messages, $1) WITH ORDINALITY AS r
+             ORDER BY r.ordinality
+         ) batch
+         RETURNING id',
+        columns
+    ) USING p_rows;
+END;
+$$;
+
+COMMIT;
@@ -0,0 +1,19 @@
+-- Migration: Adds the id tie-breaker to the shared-media gallery index.
+--
+-- GET /chats/{chat_id}/media now pages with a (created_at, id) keyset cursor, so media that
+-- share a timestamp (e.g. a batch of photos sent together) are neither skipped nor repeated
+-- at a page boundary. The index gains id so the new sort order is still an index scan.
+--
+-- How to apply this migration:
+-- 1. Go to your Supabase project dashboard.
+-- 2. In the left sidebar, click on the "SQL Editor" icon.
+-- 3. Paste the entire content of this file into the editor and click "Run".
+
+BEGIN;
+
+DROP INDEX IF EXISTS public.idx_messages_chat_media_gallery;
+CREATE INDEX idx_messages_chat_media_gallery
+ON public.messages(chat_id, media_type, created_at DESC, id DESC)
+WHERE media_url IS NOT NULL;
+
+COMMIT;
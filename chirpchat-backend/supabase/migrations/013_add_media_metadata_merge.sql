@@ -0,0 +1,57 @@
+-- Migration: Merges Cloudinary webhook results into a message's file_metadata in the database.
+--
+-- Webhook workers used to read file_metadata, merge the new URLs in Python and write the whole
+-- document back. Two workers handling the 'upload' and 'eager' notifications of one asset at the
+-- same time could each overwrite the other's URLs. apply_media_notification does the merge inside
+-- the UPDATE, against the row version it locks, so concurrent notifications are applied one after
+-- the other and nothing is lost.
+--
+-- Merge rules (merge_media_metadata): keys in the incoming document replace stored ones, except
+-- that null incoming values never overwrite, and 'urls' is merged key by key. file_metadata stored
+-- as a JSON string (older rows written as serialized text) is read as the object it contains.
+--
+-- How to apply this migration:
+-- 1. Go to your Supabase project dashboard.
+-- 2. In the left sidebar, click on the "SQL Editor" icon.
+-- 3. Paste the entire content of this file into the editor and click "Run".
+
+BEGIN;
+
+-- Step 1: The merge itself.
+CREATE OR REPLACE FUNCTION public.merge_media_metadata(p_current JSONB, p_incoming JSONB)
+RETURNS JSONB
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT base || jsonb_strip_nulls(p_incoming)
+        || jsonb_build_object('urls', COALESCE(base->'urls', '{}'::JSONB) || COALESCE(p_incoming->'urls', '{}'::JSONB))
+    FROM (
+        SELECT CASE jsonb_typeof(p_current)
+            WHEN 'object' THEN p_current
+            WHEN 'string' THEN (p_current #>> '{}')::JSONB
+            ELSE '{}'::JSONB
+        END AS base
+    ) current_metadata;
+$$;
+
+-- Step 2: Apply one asset's notifications to its message. Returns the merged file_metadata,
+-- or no row if the message does not exist.
+CREATE OR REPLACE FUNCTION public.apply_media_notification(p_message_id UUID, p_metadata JSONB, p_media_url TEXT, p_file_size BIGINT)
+RETURNS JSONB
+LANGUAGE sql
+AS $$
+    UPDATE public.messages
+    SET file_metadata = public.merge_media_metadata(file_metadata, p_metadata),
+        thumbnail_url = COALESCE(
+            public.merge_media_metadata(file_metadata, p_metadata)->'urls'->>'static_thumbnail',
+            public.merge_media_metadata(file_metadata, p_metadata)->'urls'->>'thumbnail_250'
+        ),
+        media_url = p_media_url,
+        file_size = p_file_size,
+        upload_status = 'completed',
+        status = 'sent'
+    WHERE id = p_message_id
+    RETURNING file_metadata;
+$$;
+
+COMMIT;
@@ -0,0 +1,73 @@
+-- Migration: Scopes media deduplication to the user who uploaded the asset.
+--
+-- 'media_assets' was keyed by content hash alone, so anyone who knew (or guessed) the SHA-256
+-- of a file could send a message pointing at another user's Cloudinary asset, and the 404/200
+-- answer of the by-hash endpoint told them whether that file had ever been uploaded.
+-- Assets now belong to an owner, and a dedup hit only matches the caller's own uploads.
+--
+-- Existing assets are given the sender of the oldest message that references them. Assets no
+-- message references any more keep a NULL owner: they still count references for delete, but
+-- no longer match a dedup lookup.
+--
+-- How to apply this migration:
+-- 1. Go to your Supabase project dashboard.
+-- 2. In the left sidebar, click on the "SQL Editor" icon.
+-- 3. Paste the entire content of this file into the editor and click "Run".
+
+BEGIN;
+
+-- Step 1: Owner column, backfilled from the messages that use each asset.
+ALTER TABLE public.media_assets ADD COLUMN IF NOT EXISTS owner_id UUID REFERENCES public.users(id) ON DELETE SET NULL;
+
+UPDATE public.media_assets a
+SET owner_id = first_use.user_id
+FROM (
+    SELECT DISTINCT ON (metadata->>'public_id') metadata->>'public_id' AS public_id, user_id
+    FROM (
+        SELECT user_id, created_at, CASE jsonb_typeof(file_metadata)
+            WHEN 'string' THEN (file_metadata #>> '{}')::JSONB
+            ELSE file_metadata
+        END AS metadata
+        FROM public.messages
+        WHERE file_metadata IS NOT NULL
+    ) m
+    WHERE jsonb_typeof(metadata) = 'object' AND metadata ? 'public_id'
+    ORDER BY metadata->>'public_id', created_at
+) first_use
+WHERE a.public_id = first_use.public_id AND a.owner_id IS NULL;
+
+-- Step 2: The same bytes may now be registered once per owner.
+ALTER TABLE public.media_assets DROP CONSTRAINT IF EXISTS media_assets_pkey;
+ALTER TABLE public.media_assets DROP CONSTRAINT IF EXISTS media_assets_owner_content_hash_key;
+ALTER TABLE public.media_assets ADD CONSTRAINT media_assets_owner_content_hash_key UNIQUE (owner_id, content_hash);
+
+-- Step 3: Replace the hash-only functions so the unscoped lookup can no longer be called.
+DROP FUNCTION IF EXISTS public.acquire_media_asset(TEXT);
+DROP FUNCTION IF EXISTS public.register_media_asset(TEXT, TEXT, TEXT, TEXT, TEXT, BIGINT, JSONB);
+
+CREATE OR REPLACE FUNCTION public.acquire_media_asset(p_owner_id UUID, p_content_hash TEXT)
+RETURNS SETOF public.media_assets
+LANGUAGE sql
+AS $$
+    UPDATE public.media_assets
+    SET ref_count = ref_count + 1, last_referenced_at = NOW()
+    WHERE owner_id = p_owner_id AND content_hash = p_content_hash
+    RETURNING *;
+$$;
+
+CREATE OR REPLACE FUNCTION public.register_media_asset(
+    p_owner_id UUID, p_content_hash TEXT, p_public_id TEXT, p_resource_type TEXT, p_media_url TEXT,
+    p_thumbnail_url TEXT, p_file_size BIGINT, p_file_metadata JSONB
+)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO public.media_assets (owner_id, content_hash, public_id, resource_type, media_url, thumbnail_url, file_size, file_metadata)
+    VALUES (p_owner_id, p_content_hash, p_public_id, p_resource_type, p_media_url, p_thumbnail_url, p_file_size, COALESCE(p_file_metadata, '{}'))
+    ON CONFLICT DO NOTHING;
+    RETURN FOUND;
+END;
+$$;
+
+COMMIT;
@@ -0,0 +1,112 @@
+-- Migration: Selects mood events for outcome computation by state instead of by watermark.
+--
+-- compute_mood_outcomes (migration 010) took the next batch after a (created_at, id) watermark.
+-- created_at is set by the API when the event is recorded, but analytics rows can reach the
+-- table much later (they are buffered, and replayed from the Redis spill after an outage). A
+-- row that arrived more than p_window_seconds late sat behind the watermark and was never
+-- processed. Batches are now the oldest events whose window has closed and whose
+-- outcome_computed_at is still NULL, found through a partial index that only holds those rows,
+-- so a late row is picked up on the next run whatever its created_at. The mood_reciprocated
+-- lookup also gets the index it was missing.
+--
+-- Concurrent runs (one per API instance) lock their batch with SKIP LOCKED and work on
+-- disjoint rows. To recompute outcomes, set outcome_computed_at back to NULL.
+-- job_watermarks keeps counting processed events; its last_created_at and last_id are no
+-- longer read.
+--
+-- How to apply this migration:
+-- 1. Go to your Supabase project dashboard.
+-- 2. In the left sidebar, click on the "SQL Editor" icon.
+-- 3. Paste the entire content of this file into the editor and click "Run".
+
+BEGIN;
+
+-- Step 1: Index only the events still waiting for outcomes. It stays small however large
+-- mood_analytics grows, and replaces the full (created_at, id) index the watermark scan used.
+CREATE INDEX IF NOT EXISTS idx_mood_analytics_outcome_pending
+ON public.mood_analytics(created_at, id) WHERE outcome_computed_at IS NULL;
+
+DROP INDEX IF EXISTS public.idx_mood_analytics_created_id;
+
+-- Step 2: Index the mood_reciprocated lookup (the partner's events aimed at the user in the window),
+-- which otherwise scans mood_analytics once per event in the batch.
+CREATE INDEX IF NOT EXISTS idx_mood_analytics_user_partner_created
+ON public.mood_analytics(user_id, partner_id, created_at);
+
+-- Step 3: Process one batch. Returns the number of mood events processed (< p_batch_size once caught up).
+CREATE OR REPLACE FUNCTION public.compute_mood_outcomes(p_batch_size INTEGER, p_window_seconds INTEGER)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    processed INTEGER;
+BEGIN
+    WITH batch AS (
+        SELECT m.id, m.user_id, m.partner_id, m.created_at, m.created_at + make_interval(secs => p_window_seconds) AS window_end
+        FROM public.mood_analytics m
+        WHERE m.outcome_computed_at IS NULL
+          AND m.created_at <= NOW() - make_interval(secs => p_window_seconds)
+        ORDER BY m.created_at, m.id
+        LIMIT p_batch_size
+        FOR UPDATE SKIP LOCKED
+    ),
+    outcomes AS (
+        SELECT
+            b.id,
+            EXTRACT(EPOCH FROM reply.created_at - b.created_at)::INTEGER AS partner_response_time,
+            reaction.emoji AS partner_reaction,
+            (reply.created_at IS NOT NULL AND sent.found IS NOT NULL) AS conversation_started,
+            CASE WHEN b.partner_id IS NULL THEN NULL ELSE reciprocated.found IS NOT NULL END AS mood_reciprocated
+        FROM batch b
+        -- Partner's first message in a chat the user is also in.
+        LEFT JOIN LATERAL (
+            SELECT msg.created_at FROM public.messages msg
+            JOIN public.chat_participants cp ON cp.chat_id = msg.chat_id AND cp.user_id = b.user_id
+            WHERE msg.user_id = b.partner_id AND msg.created_at > b.created_at AND msg.created_at <= b.window_end
+            ORDER BY msg.created_at LIMIT 1
+        ) reply ON TRUE
+        -- Any message from the user in a chat the partner is also in.
+        LEFT JOIN LATERAL (
+            SELECT TRUE AS found FROM public.messages msg
+            JOIN public.chat_participants cp ON cp.chat_id = msg.chat_id AND cp.user_id = b.partner_id
+            WHERE msg.user_id = b.user_id AND msg.created_at > b.created_at AND msg.created_at <= b.window_end
+            LIMIT 1
+        ) sent ON TRUE
+        -- The partner's reaction on the earliest such message they reacted to.
+        LEFT JOIN LATERAL (
+            SELECT r.key AS emoji FROM public.messages msg
+            JOIN public.chat_participants cp ON cp.chat_id = msg.chat_id AND cp.user_id = b.partner_id
+            CROSS JOIN LATERAL jsonb_each(COALESCE(msg.reactions, '{}'::JSONB)) r
+            WHERE msg.user_id = b.user_id AND msg.created_at > b.created_at AND msg.created_at <= b.window_end
+              AND r.value ? b.partner_id::TEXT
+            ORDER BY msg.created_at, r.key LIMIT 1
+        ) reaction ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT TRUE AS found FROM public.mood_analytics pm
+            WHERE pm.user_id = b.partner_id AND pm.partner_id = b.user_id
+              AND pm.created_at > b.created_at AND pm.created_at <= b.window_end
+            LIMIT 1
+        ) reciprocated ON TRUE
+    ),
+    updated AS (
+        UPDATE public.mood_analytics m
+        SET partner_response_time = o.partner_response_time,
+            partner_reaction = o.partner_reaction,
+            conversation_started = o.conversation_started,
+            mood_reciprocated = o.mood_reciprocated,
+            outcome_computed_at = NOW()
+        FROM outcomes o
+        WHERE m.id = o.id
+    )
+    SELECT COUNT(*) INTO processed FROM batch;
+
+    IF processed > 0 THEN
+        INSERT INTO public.job_watermarks (job_name, processed_count, updated_at) VALUES ('mood_outcomes', processed, NOW())
+        ON CONFLICT (job_name) DO UPDATE
+        SET processed_count = public.job_watermarks.processed_count + EXCLUDED.processed_count, updated_at = NOW();
+    END IF;
+    RETURN processed;
+END;
+$$;
+
+COMMIT;
@@ -0,0 +1,37 @@
+-- Migration: Lets a chat participant forward media they can see without re-uploading it.
+--
+-- Since migration 014 a content-hash lookup only matches the caller's own uploads, so
+-- forwarding a partner's voice note or photo missed and forced a full re-upload.
+-- acquire_media_asset_for_forward takes the reference through the source message instead
+-- of the hash: it succeeds only when the caller is a participant of the source message's
+-- chat and the message is still in their history (after their cleared_at). Nothing about
+-- the asset is revealed to anyone who could not already open the message.
+--
+-- How to apply this migration:
+-- 1. Go to your Supabase project dashboard.
+-- 2. In the left sidebar, click on the "SQL Editor" icon.
+-- 3. Paste the entire content of this file into the editor and click "Run".
+
+BEGIN;
+
+-- Step 1: Take a reference on the asset behind a message the user can see. Returns no row otherwise.
+-- file_metadata written through the API is a JSON string inside the JSONB column; both shapes are read.
+CREATE OR REPLACE FUNCTION public.acquire_media_asset_for_forward(p_user_id UUID, p_message_id UUID)
+RETURNS SETOF public.media_assets
+LANGUAGE sql
+AS $$
+    UPDATE public.media_assets a
+    SET ref_count = a.ref_count + 1, last_referenced_at = NOW()
+    FROM public.messages m
+    JOIN public.chat_participants cp ON cp.chat_id = m.chat_id AND cp.user_id = p_user_id
+    WHERE m.id = p_message_id
+      AND m.mode <> 'incognito'
+      AND (cp.cleared_at IS NULL OR m.created_at > cp.cleared_at)
+      AND a.public_id = (CASE jsonb_typeof(m.file_metadata)
+            WHEN 'string' THEN (m.file_metadata #>> '{}')::JSONB
+            ELSE m.file_metadata
+        END)->>'public_id'
+    RETURNING a.*;
+$$;
+
+COMMIT;
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+# app.config reads these at import time; point everything at placeholders so no test reaches a real service.
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_ANON_KEY", "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.test")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.test")
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+os.environ.setdefault("CLOUDINARY_CLOUD_NAME", "test-cloud")
+os.environ.setdefault("CLOUDINARY_API_KEY", "test-key")
+os.environ.setdefault("CLOUDINARY_API_SECRET", "test-secret")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+class FakeQuery:
+    """Chainable stand-in for a PostgREST query builder. Records every call and answers execute() from FakeSupabase."""
+    def __init__(self, db: "FakeSupabase", target: str):
+        self.db, self.target, self.calls = db, target, []
+
+    def __getattr__(self, name):
+        def record(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return record
+
+    @property
+    def not_(self):
+        self.calls.append(("not_", (), {}))
+        return self
+
+    def called(self, name: str) -> list:
+        return [args for call, args, _ in self.calls if call == name]
+
+    async def execute(self):
+        self.db.queries.append(self)
+        if self.db.latency: await asyncio.sleep(self.db.latency)
+        return SimpleNamespace(data=self.db.answer(self))
+
+class FakeSupabase:
+    """
+    Minimal Supabase client: table() and rpc() return FakeQuery objects.
+    Queue results with on(target, data) (data may be a callable taking the query, or an exception to raise);
+    unqueued queries return []. latency is a simulated round trip added to every execute().
+    """
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.queries: list = []
+        self._results = defaultdict(deque)
+
+    def on(self, target: str, *results):
+        self._results[target].extend(results)
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: dict = None) -> FakeQuery:
+        query = FakeQuery(self, name)
+        query.calls.append(("rpc", (params or {},), {}))
+        return query
+
+    def answer(self, query: FakeQuery):
+        if not self._results[query.target]: return []
+        result = self._results[query.target].popleft()
+        if isinstance(result, Exception): raise result
+        return result(query) if callable(result) else result
+
+    def queries_for(self, target: str) -> list:
+        return [query for query in self.queries if query.target == target]
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    from app.database import db_manager
+    fake = FakeSupabase()
+    monkeypatch.setattr(db_manager, "client", fake)
+    monkeypatch.setattr(db_manager, "admin_client", fake)
+    return fake
+
+@pytest.fixture
+async def fake_redis(monkeypatch):
+    """An in-memory Redis (fakeredis, with Lua) patched in wherever app modules imported get_redis_client."""
+    fakeredis = pytest.importorskip("fakeredis")
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    async def get_redis_client(): return redis
+    for name, module in list(sys.modules.items()):
+        if name.startswith("app") and hasattr(module, "get_redis_client"): monkeypatch.setattr(module, "get_redis_client", get_redis_client)
+    yield redis
+    await redis.aclose()
+
+class FakeCloudinaryAdminApi:
+    """
+    Stand-in for the Cloudinary Admin API's bulk delete (DELETE /v1_1/<cloud>/resources/<resource_type>/<type>).
+    Every public_id is reported "deleted" unless statuses says otherwise; fail_next makes the next N calls
+    answer HTTP 500. Each call is recorded as (resource_type, delivery_type, public_ids).
+    """
+    def __init__(self):
+        self.statuses: dict = {}
+        self.fail_next = 0
+        self.calls: list = []
+        self._lock = threading.Lock()
+
+    def handle(self, path: str, query: str):
+        resource_type, delivery_type = path.rstrip("/").split("/")[-2:]
+        # The SDK sends lists as indexed fields: public_ids[0]=a&public_ids[1]=b.
+        fields = parse_qs(query)
+        public_ids = [fields[f"public_ids[{i}]"][0] for i in range(len(fields)) if f"public_ids[{i}]" in fields]
+        with self._lock:
+            self.calls.append((resource_type, delivery_type, public_ids))
+            if self.fail_next:
+                self.fail_next -= 1
+                return 500, {"error": {"message": "General Error"}}
+        return 200, {"deleted": {public_id: self.statuses.get(public_id, "deleted") for public_id in public_ids}, "partial": False}
+
+    def deleted_ids(self) -> list:
+        return [public_id for _, _, public_ids in self.calls for public_id in public_ids]
+
+@pytest.fixture
+def cloudinary_admin_api(monkeypatch):
+    """Runs FakeCloudinaryAdminApi on a local port and points the Cloudinary SDK's upload_prefix at it."""
+    import cloudinary
+    api = FakeCloudinaryAdminApi()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_DELETE(self):
+            url = urlsplit(self.path)
+            status, body = api.handle(url.path, url.query)
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args): pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    config = cloudinary.config()
+    for name, value in {"upload_prefix": f"http://127.0.0.1:{server.server_port}", "cloud_name": "test-cloud", "api_key": "test-key", "api_secret": "test-secret"}.items():
+        monkeypatch.setattr(config, name, value, raising=False)
+    yield api
+    server.shutdown()
+    server.server_close()
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "supabase" / "migrations"
+BASE_SCHEMA = Path(__file__).resolve().parent / "sql" / "base_schema.sql"
+
+@pytest.fixture(scope="session")
+def postgres_server(tmp_path_factory):
+    """A throwaway local PostgreSQL. SQL tests are skipped where pgserver is not installed."""
+    pgserver = pytest.importorskip("pgserver")
+    server = pgserver.get_server(str(tmp_path_factory.mktemp("pgdata")), cleanup_mode="stop")
+    yield server
+    server.cleanup()
+
+@pytest.fixture
+def pg(postgres_server, request):
+    """
+    A fresh database with the base schema and the migrations named by the test's
+    @pytest.mark.migrations(...) marker, as an autocommit psycopg2 connection.
+    """
+    import psycopg2
+    name = f"test_{abs(hash(request.node.nodeid))}"
+    postgres_server.psql(f"DROP DATABASE IF EXISTS {name};")
+    postgres_server.psql(f"CREATE DATABASE {name};")
+    conn = psycopg2.connect(postgres_server.get_uri(name))
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(BASE_SCHEMA.read_text())
+        marker = request.node.get_closest_marker("migrations")
+        for migration in marker.args if marker else ():
+            cur.execute((MIGRATIONS_DIR / migration).read_text())
+    yield conn
+    conn.close()
+    postgres_server.psql(f"DROP DATABASE IF EXISTS {name};")
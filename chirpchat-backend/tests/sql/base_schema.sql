@@ -0,0 +1,55 @@
+-- The tables the migrations in supabase/migrations build on, reduced to the columns the API uses.
+-- Only for tests against a throwaway PostgreSQL; the real schema lives in the Supabase project.
+CREATE SCHEMA IF NOT EXISTS auth;
+CREATE TABLE IF NOT EXISTS auth.users (id UUID PRIMARY KEY DEFAULT gen_random_uuid());
+
+CREATE TABLE public.users (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    display_name TEXT,
+    partner_id UUID,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE TABLE public.chats (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE TABLE public.chat_participants (
+    chat_id UUID NOT NULL REFERENCES public.chats(id) ON DELETE CASCADE,
+    user_id UUID NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+    joined_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (chat_id, user_id)
+);
+
+CREATE TABLE public.stickers (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    image_url TEXT
+);
+
+CREATE TABLE public.messages (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    chat_id UUID NOT NULL REFERENCES public.chats(id) ON DELETE CASCADE,
+    user_id UUID NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+    text TEXT,
+    message_subtype TEXT,
+    mode TEXT NOT NULL DEFAULT 'normal',
+    status TEXT NOT NULL DEFAULT 'sent',
+    reactions JSONB NOT NULL DEFAULT '{}',
+    client_temp_id TEXT,
+    sticker_id UUID REFERENCES public.stickers(id),
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE public.mood_analytics (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+    partner_id UUID,
+    mood_name TEXT,
+    mood_emoji TEXT,
+    source TEXT,
+    context JSONB,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
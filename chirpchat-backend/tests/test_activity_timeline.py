@@ -0,0 +1,114 @@
+import pytest
+
+MIGRATIONS = ("009_add_activity_timeline.sql",)
+HISTORY_DAYS = 730
+EVENTS_PER_DAY = 10 # Per user and source, so a 2-year couple has about 29k events each.
+PAGE = 50
+
+def new_user(cur) -> str:
+    cur.execute("INSERT INTO public.users DEFAULT VALUES RETURNING id")
+    return cur.fetchone()[0]
+
+def insert_history(cur, user_id: str, days: int, per_day: int):
+    """per_day profile_update and per_day assistive_touch_ping events a day for `days` days, in one statement."""
+    cur.execute("""
+        INSERT INTO public.mood_analytics (user_id, mood_name, source, created_at)
+        SELECT %s, 'mood_' || (i %% 12), source, NOW() - (i * (86400.0 / %s) || ' seconds')::INTERVAL
+        FROM generate_series(1, %s * %s) i, UNNEST(ARRAY['profile_update', 'assistive_touch_ping']) source
+    """, (user_id, per_day, days, per_day))
+
+def timeline(cur, user_id, partner_id, limit, since=None, before=None, before_id=None) -> list:
+    cur.execute("SELECT id, user_id, source, created_at FROM public.get_activity_timeline(%s, %s, %s, %s, %s, %s)",
+                (user_id, partner_id, since, before, before_id, limit))
+    return cur.fetchall()
+
+def expected_timeline(cur, user_id, partner_id, since=None) -> list:
+    cur.execute("""
+        SELECT id, user_id, source, created_at FROM public.mood_analytics
+        WHERE ((user_id = %(user)s AND source IN ('profile_update', 'assistive_touch_ping')) OR (user_id = %(partner)s AND source = 'assistive_touch_ping'))
+          AND (%(since)s::TIMESTAMPTZ IS NULL OR created_at >= %(since)s)
+        ORDER BY created_at DESC, id DESC
+    """, {"user": user_id, "partner": partner_id, "since": since})
+    return cur.fetchall()
+
+def all_pages(cur, user_id, partner_id, since=None) -> list:
+    events, before, before_id = [], None, None
+    while True:
+        page = timeline(cur, user_id, partner_id, PAGE, since, before, before_id)
+        events.extend(page)
+        if len(page) < PAGE: return events
+        before_id, _, _, before = page[-1]
+
+def legacy_history(cur, user_id, partner_id) -> list:
+    """The pre-009 endpoint: every row for the couple, filtered and sorted in Python."""
+    cur.execute("SELECT id, created_at, mood_name, source, user_id FROM public.mood_analytics WHERE user_id IN (%s, %s)", (user_id, partner_id))
+    events = [row for row in cur.fetchall() if (row[3] == "profile_update" and row[4] == user_id) or row[3] == "assistive_touch_ping"]
+    return sorted(events, key=lambda row: row[1], reverse=True)
+
+@pytest.fixture
+def couple(pg):
+    with pg.cursor() as cur:
+        user_id, partner_id = new_user(cur), new_user(cur)
+        insert_history(cur, user_id, 30, 3)
+        insert_history(cur, partner_id, 30, 3)
+        # Events sharing a timestamp must still page without gaps or repeats.
+        cur.execute("INSERT INTO public.mood_analytics (user_id, source, created_at) SELECT %s, 'assistive_touch_ping', NOW() - INTERVAL '3 days' FROM generate_series(1, 120)", (user_id,))
+    return user_id, partner_id
+
+@pytest.mark.migrations(*MIGRATIONS)
+def test_pages_cover_the_history_exactly_once_newest_first(pg, couple):
+    with pg.cursor() as cur:
+        assert all_pages(cur, *couple) == expected_timeline(cur, *couple)
+
+@pytest.mark.migrations(*MIGRATIONS)
+def test_since_bounds_the_timeline_and_partner_mood_updates_are_excluded(pg, couple):
+    user_id, partner_id = couple
+    with pg.cursor() as cur:
+        cur.execute("SELECT NOW() - INTERVAL '10 days'")
+        since = cur.fetchone()[0]
+        events = all_pages(cur, user_id, partner_id, since)
+        assert events == expected_timeline(cur, user_id, partner_id, since)
+        assert all(created_at >= since for *_, created_at in events)
+        assert not any(owner == partner_id and source == "profile_update" for _, owner, source, _ in events)
+
+@pytest.mark.migrations(*MIGRATIONS)
+def test_no_partner_returns_only_own_events(pg, couple):
+    user_id, _ = couple
+    with pg.cursor() as cur:
+        assert {owner for _, owner, _, _ in timeline(cur, user_id, None, 500)} == {user_id}
+
+@pytest.fixture
+def two_year_couple(pg):
+    """A couple with a 2-year history, among 10 other users with the same history."""
+    with pg.cursor() as cur:
+        users = [new_user(cur) for _ in range(12)]
+        for user_id in users: insert_history(cur, user_id, HISTORY_DAYS, EVENTS_PER_DAY)
+        cur.execute("ANALYZE")
+    return users[0], users[1]
+
+def record_p95(benchmark):
+    data = sorted(benchmark.stats.stats.data)
+    benchmark.extra_info["p95_ms"] = round(data[int(len(data) * 0.95) - 1] * 1000, 2)
+
+@pytest.mark.benchmark(group="activity-timeline-2y")
+@pytest.mark.migrations(*MIGRATIONS)
+def test_benchmark_first_page(benchmark, pg, two_year_couple):
+    with pg.cursor() as cur:
+        assert len(benchmark.pedantic(timeline, (cur, *two_year_couple, PAGE), rounds=200)) == PAGE
+    record_p95(benchmark)
+
+@pytest.mark.benchmark(group="activity-timeline-2y")
+@pytest.mark.migrations(*MIGRATIONS)
+def test_benchmark_page_a_year_back(benchmark, pg, two_year_couple):
+    with pg.cursor() as cur:
+        cur.execute("SELECT NOW() - INTERVAL '1 year'")
+        before = cur.fetchone()[0]
+        assert len(benchmark.pedantic(timeline, (cur, *two_year_couple, PAGE, None, before), rounds=200)) == PAGE
+    record_p95(benchmark)
+
+@pytest.mark.benchmark(group="activity-timeline-2y")
+@pytest.mark.migrations(*MIGRATIONS)
+def test_benchmark_legacy_full_history(benchmark, pg, two_year_couple):
+    with pg.cursor() as cur:
+        assert len(benchmark.pedantic(legacy_history, (cur, *two_year_couple), rounds=10)) > 0
+    record_p95(benchmark)
@@ -0,0 +1,95 @@
+import asyncio
+import gc
+import json
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from postgrest.exceptions import APIError
+
+from app.analytics import ingest
+from app.analytics.ingest import ANALYTICS_DEAD_LETTER_KEY_PREFIX, ANALYTICS_SPILL_KEY_PREFIX, AnalyticsBuffer
+from app.auth.dependencies import get_current_user
+from app.auth.schemas import UserPublic
+from app.config import settings
+from app.routers import analytics as analytics_router
+
+TABLE = "file_analytics"
+
+def row(i: int, bad: bool = False) -> dict:
+    return {"user_id": str(uuid.uuid4()), "message_id": "not-a-message" if bad else str(uuid.uuid4()), "file_size_bytes": i}
+
+class Table:
+    """Answers inserts like PostgREST: the whole statement fails with a foreign-key error if any row is bad."""
+    def __init__(self):
+        self.rows, self.inserts, self.down = [], 0, False
+
+    def insert(self, query):
+        self.inserts += 1
+        if self.down: raise ConnectionError("connection refused")
+        (rows,), = query.called("insert")
+        if any(r["message_id"] == "not-a-message" for r in rows):
+            raise APIError({"code": "23503", "message": 'insert or update on table "file_analytics" violates foreign key constraint', "details": None, "hint": None})
+        self.rows.extend(rows)
+        return rows
+
+@pytest.fixture
+def table(fake_db):
+    table = Table()
+    fake_db.on(TABLE, *[table.insert] * 1000)
+    return table
+
+@pytest.fixture
+def buffer(fake_redis):
+    return AnalyticsBuffer()
+
+async def dead_letters(redis) -> list:
+    return [json.loads(entry)["row"] for entry in await redis.lrange(ANALYTICS_DEAD_LETTER_KEY_PREFIX + TABLE, 0, -1)]
+
+async def test_bad_row_is_dead_lettered_and_the_rest_written(buffer, table, fake_redis):
+    rows = [row(i, bad=(i == 137)) for i in range(200)]
+    buffer.add(TABLE, rows)
+    await buffer.flush(TABLE)
+    assert len(table.rows) == 199
+    assert await dead_letters(fake_redis) == [rows[137]]
+    assert await fake_redis.llen(ANALYTICS_SPILL_KEY_PREFIX + TABLE) == 0
+    assert table.inserts <= 2 * 8 + 1 # Bisection: about two inserts per halving of the 200-row batch.
+
+async def test_outage_spills_and_the_spill_is_replayed(buffer, table, fake_redis):
+    table.down = True
+    buffer.add(TABLE, [row(i) for i in range(10)])
+    await buffer.flush(TABLE)
+    assert await fake_redis.llen(ANALYTICS_SPILL_KEY_PREFIX + TABLE) == 10
+    assert await dead_letters(fake_redis) == []
+    table.down = False
+    await buffer.flush(TABLE)
+    assert len(table.rows) == 10
+    assert await fake_redis.llen(ANALYTICS_SPILL_KEY_PREFIX + TABLE) == 0
+
+async def test_bad_spilled_row_does_not_block_the_replay(buffer, table, fake_redis):
+    spilled = [row(i, bad=(i == 3)) for i in range(20)]
+    await fake_redis.rpush(ANALYTICS_SPILL_KEY_PREFIX + TABLE, *[json.dumps(r) for r in spilled])
+    await buffer.flush(TABLE)
+    assert len(table.rows) == 19
+    assert await dead_letters(fake_redis) == [spilled[3]]
+    assert await fake_redis.llen(ANALYTICS_SPILL_KEY_PREFIX + TABLE) == 0
+
+async def test_size_triggered_flush_task_is_referenced_until_done(buffer, table, monkeypatch):
+    monkeypatch.setattr(ingest, "ANALYTICS_FLUSH_SIZE", 5)
+    buffer.add(TABLE, [row(i) for i in range(5)])
+    assert len(buffer._flush_tasks) == 1
+    gc.collect() # An unreferenced task could be collected here and its rows lost.
+    await asyncio.sleep(0.01)
+    assert buffer._flush_tasks == set()
+    assert len(table.rows) == 5
+
+def test_buffer_stats_are_admin_only(fake_redis, monkeypatch):
+    admin, member = UserPublic(id=uuid.uuid4(), display_name="Ops"), UserPublic(id=uuid.uuid4(), display_name="Sam")
+    monkeypatch.setattr(settings, "ADMIN_USER_IDS", str(admin.id))
+    app = FastAPI()
+    app.include_router(analytics_router.router)
+    client = TestClient(app)
+    for user, expected in [(member, 403), (admin, 200)]:
+        app.dependency_overrides[get_current_user] = lambda user=user: user
+        assert client.get("/analytics/buffer-stats").status_code == expected
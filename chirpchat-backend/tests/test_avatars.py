@@ -0,0 +1,103 @@
+import io
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.auth import routes as auth_routes
+from app.auth.dependencies import get_current_user
+from app.auth.schemas import UserPublic
+from app.media import avatars
+
+USER = UserPublic(id=uuid.uuid4(), display_name="Sam", avatar_url="https://placehold.co/100x100.png?text=S")
+RED, BLUE = (255, 0, 0), (0, 0, 255)
+
+def two_tone_jpeg(width: int, height: int, orientation: int = 1) -> bytes:
+    """Left half red, right half blue, with the given EXIF orientation tag."""
+    image = Image.new("RGB", (width, height), BLUE)
+    image.paste(RED, (0, 0, width // 2, height))
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=95, exif=exif)
+    return output.getvalue()
+
+def close_to(pixel, colour) -> bool:
+    return all(abs(a - b) < 40 for a, b in zip(pixel, colour))
+
+def test_variants_are_square_webp_at_each_size():
+    variants = avatars.render_avatar_variants(two_tone_jpeg(900, 600))
+    assert list(variants) == [64, 128, 512]
+    for size, data in variants.items():
+        with Image.open(io.BytesIO(data)) as image:
+            assert (image.format, image.size) == ("WEBP", (size, size))
+
+def test_exif_orientation_is_applied_before_cropping():
+    # Orientation 6 means "rotate 90 degrees clockwise to display": the stored left (red) half ends up on top.
+    with Image.open(io.BytesIO(avatars.render_avatar_variants(two_tone_jpeg(600, 400, orientation=6))[64])) as image:
+        image = image.convert("RGB")
+        assert close_to(image.getpixel((32, 8)), RED) and close_to(image.getpixel((32, 56)), BLUE)
+
+def test_center_crop_keeps_the_middle_of_a_wide_image():
+    with Image.open(io.BytesIO(avatars.render_avatar_variants(two_tone_jpeg(1200, 400))[64])) as image:
+        image = image.convert("RGB")
+        assert close_to(image.getpixel((8, 32)), RED) and close_to(image.getpixel((56, 32)), BLUE)
+
+def test_transparency_is_kept():
+    output = io.BytesIO()
+    Image.new("RGBA", (200, 200), (0, 0, 0, 0)).save(output, format="PNG")
+    with Image.open(io.BytesIO(avatars.render_avatar_variants(output.getvalue())[64])) as image:
+        assert image.mode == "RGBA" and image.getpixel((32, 32))[3] == 0
+
+def test_avatar_url_for_picks_the_smallest_sufficient_variant():
+    variants = {"64": "v64", "128": "v128", "512": "v512"}
+    user = USER.model_copy(update={"avatar_variants": variants})
+    assert [user.avatar_url_for(size) for size in (48, 64, 100, 300, 2000)] == ["v64", "v64", "v128", "v512", "v512"]
+
+def test_avatar_url_for_falls_back_to_avatar_url_without_variants():
+    assert USER.avatar_url_for(128) == USER.avatar_url
+    assert USER.model_copy(update={"avatar_variants": {}}).avatar_url_for(128) == USER.avatar_url
+
+@pytest.fixture
+def avatar_client(fake_db, monkeypatch):
+    """The users router with uploads and the process pool replaced by in-process stand-ins."""
+    async def inline(func, *args): return func(*args)
+    uploaded, broadcasts = [], []
+    def upload_variant(user_id, size, data):
+        uploaded.append((size, data))
+        return f"https://res.cloudinary.com/test/avatars/user_{user_id}/{size}.webp"
+    async def broadcast(user_id, updated_data): broadcasts.append((user_id, updated_data))
+    monkeypatch.setattr(avatars, "run_in_process_pool", inline)
+    monkeypatch.setattr(avatars, "_upload_variant", upload_variant)
+    monkeypatch.setattr(auth_routes.ws_manager, "broadcast_user_profile_update", broadcast)
+    def stored_user(query):
+        update, = [q for q in fake_db.queries_for("users") if q.called("update")]
+        return {"id": str(USER.id), "display_name": USER.display_name, **update.called("update")[0][0]}
+    fake_db.on("users", [], stored_user)
+    app = FastAPI()
+    app.include_router(auth_routes.user_router)
+    app.dependency_overrides[get_current_user] = lambda: USER
+    return TestClient(app), uploaded, broadcasts
+
+@pytest.mark.parametrize("method", ["put", "post"])
+def test_avatar_routes_store_the_variants_and_broadcast_them(avatar_client, fake_db, method):
+    client, uploaded, broadcasts = avatar_client
+    image = two_tone_jpeg(300, 300)
+    response = client.put("/users/me/avatar", content=image, headers={"Content-Type": "image/jpeg"}) if method == "put" \
+        else client.post("/users/me/avatar", files={"file": ("me.jpg", image, "image/jpeg")})
+    assert response.status_code == 200
+    assert sorted(size for size, _ in uploaded) == [64, 128, 512]
+    update, = [q.called("update")[0][0] for q in fake_db.queries_for("users") if q.called("update")]
+    assert set(update["avatar_variants"]) == {"64", "128", "512"}
+    assert update["avatar_url"] == update["avatar_variants"]["128"]
+    assert response.json()["avatar_variants"] == update["avatar_variants"]
+    assert broadcasts == [(USER.id, {"avatar_url": update["avatar_url"], "avatar_variants": update["avatar_variants"]})]
+
+def test_undecodable_image_is_rejected(avatar_client):
+    client, uploaded, broadcasts = avatar_client
+    # A valid PNG signature, so the type check passes, followed by garbage.
+    response = client.put("/users/me/avatar", content=b"\x89PNG\r\n\x1a\n" + b"\x00" * 4096, headers={"Content-Type": "image/png"})
+    assert response.status_code == 400
+    assert uploaded == [] and broadcasts == []
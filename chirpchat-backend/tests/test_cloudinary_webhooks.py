@@ -0,0 +1,101 @@
+import json
+import threading
+import time
+from hashlib import sha1
+
+import psycopg2
+import pytest
+
+import app.routers.media # noqa: F401  Configures the Cloudinary SDK with the test credentials.
+from app.config import settings
+from app.routers.webhooks import WEBHOOK_SIGNATURE_VALID_FOR_SECONDS, verify_cloudinary_signature
+
+BODY = json.dumps({"notification_type": "upload", "public_id": "chat/abc", "secure_url": "https://res.example.com/abc.jpg"}).encode()
+
+def cloudinary_signature(body: bytes, timestamp: int) -> str:
+    """What Cloudinary sends in X-Cld-Signature: hex SHA-1 of body + timestamp + API secret."""
+    return sha1(body + str(timestamp).encode() + settings.CLOUDINARY_API_SECRET.encode()).hexdigest()
+
+def test_genuine_notification_is_accepted():
+    timestamp = int(time.time())
+    assert verify_cloudinary_signature(BODY, cloudinary_signature(BODY, timestamp), str(timestamp))
+
+def test_tampered_body_is_rejected():
+    timestamp = int(time.time())
+    assert not verify_cloudinary_signature(BODY + b" ", cloudinary_signature(BODY, timestamp), str(timestamp))
+
+def test_stale_notification_is_rejected_as_replay():
+    timestamp = int(time.time()) - WEBHOOK_SIGNATURE_VALID_FOR_SECONDS - 1
+    assert not verify_cloudinary_signature(BODY, cloudinary_signature(BODY, timestamp), str(timestamp))
+
+def test_malformed_timestamp_is_rejected():
+    assert not verify_cloudinary_signature(BODY, cloudinary_signature(BODY, 0), "yesterday")
+
+MERGE_MIGRATIONS = ("001_add_replies.sql", "002_add_robust_upload_schema.sql", "013_add_media_metadata_merge.sql")
+
+def insert_message(cur, file_metadata) -> str:
+    cur.execute("INSERT INTO public.users DEFAULT VALUES RETURNING id")
+    user_id = cur.fetchone()[0]
+    cur.execute("INSERT INTO public.chats DEFAULT VALUES RETURNING id")
+    chat_id = cur.fetchone()[0]
+    cur.execute("INSERT INTO public.messages (chat_id, user_id, media_type, file_metadata) VALUES (%s, %s, 'image', %s) RETURNING id",
+                (chat_id, user_id, json.dumps(file_metadata)))
+    return cur.fetchone()[0]
+
+@pytest.mark.migrations(*MERGE_MIGRATIONS)
+def test_merge_keeps_stored_values_that_the_notification_lacks(pg):
+    with pg.cursor() as cur:
+        # Older rows hold file_metadata as a serialized JSON string.
+        message_id = insert_message(cur, json.dumps({"content_hash": "h", "width": 800, "urls": {"preview_800": "p"}}))
+        cur.execute("SELECT public.apply_media_notification(%s, %s, %s, %s)",
+                    (message_id, json.dumps({"width": None, "format": "jpg", "urls": {"original": "o", "thumbnail_250": "t"}}), "o", 10))
+        merged = cur.fetchone()[0]
+        cur.execute("SELECT thumbnail_url, media_url, upload_status FROM public.messages WHERE id = %s", (message_id,))
+        row = cur.fetchone()
+    assert merged == {"content_hash": "h", "width": 800, "format": "jpg", "urls": {"preview_800": "p", "original": "o", "thumbnail_250": "t"}}
+    assert row == ("t", "o", "completed")
+
+@pytest.mark.migrations(*MERGE_MIGRATIONS)
+def test_concurrent_notifications_for_one_asset_lose_no_urls(pg, postgres_server):
+    with pg.cursor() as cur:
+        message_id = insert_message(cur, {})
+        cur.execute("SELECT current_database()")
+        database = cur.fetchone()[0]
+    first, second = psycopg2.connect(postgres_server.get_uri(database)), psycopg2.connect(postgres_server.get_uri(database))
+    try:
+        # The upload notification's worker holds its update open while the eager one's worker runs.
+        first_cur = first.cursor()
+        first_cur.execute("SELECT public.apply_media_notification(%s, %s, 'o', 1)", (message_id, json.dumps({"urls": {"original": "o"}})))
+        def apply_eager():
+            with second.cursor() as cur:
+                cur.execute("SELECT public.apply_media_notification(%s, %s, 'o', 1)", (message_id, json.dumps({"urls": {"thumbnail_250": "t", "preview_800": "p"}})))
+            second.commit()
+        worker = threading.Thread(target=apply_eager)
+        worker.start()
+        time.sleep(0.2)
+        first.commit()
+        worker.join(timeout=10)
+    finally:
+        first.close()
+        second.close()
+    with pg.cursor() as cur:
+        cur.execute("SELECT file_metadata->'urls' FROM public.messages WHERE id = %s", (message_id,))
+        assert cur.fetchone()[0] == {"original": "o", "thumbnail_250": "t", "preview_800": "p"}
+
+async def test_worker_sends_only_new_metadata_to_the_merge_rpc(fake_db, monkeypatch):
+    from app.media import webhook_queue
+    from app.media.schemas import CloudinaryWebhookPayload
+    async def no_op(*args, **kwargs): return None
+    async def image_metadata(public_id): return {"blurhash": "LEHV6nWB2yk8"}
+    monkeypatch.setattr(webhook_queue.upload_queue, "mark_upload_ready", no_op)
+    monkeypatch.setattr(webhook_queue, "get_message_with_details_from_db", no_op)
+    monkeypatch.setattr(webhook_queue.processing, "compute_image_metadata", image_metadata)
+    fake_db.on("messages", {"id": "m1", "chat_id": "c1", "media_type": "image", "file_metadata": json.dumps({"urls": {"thumbnail_250": "t"}})})
+    fake_db.on("apply_media_notification", {"urls": {"thumbnail_250": "t", "original": "o"}})
+    payload = CloudinaryWebhookPayload(public_id="chat/abc", version=1, asset_id="a1", resource_type="image", format="jpg", bytes=10,
+                                       url="http://res.example.com/abc.jpg", secure_url="o", notification_type="upload")
+    await webhook_queue.process_asset_notifications("chat/abc", [payload])
+    params = fake_db.queries_for("apply_media_notification")[0].called("rpc")[0][0]
+    assert params["p_metadata"]["urls"] == {"original": "o"}
+    assert params["p_metadata"]["blurhash"] == "LEHV6nWB2yk8" and params["p_metadata"]["width"] is None
+    assert not [q for q in fake_db.queries_for("messages") if q.called("update")]
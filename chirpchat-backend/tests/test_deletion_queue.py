@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import pytest
+
+from app.media import deletion_queue as dq
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controls the time.time() the deletion queue scores and claims by."""
+    state = {"now": time.time()}
+    monkeypatch.setattr(dq.time, "time", lambda: state["now"])
+    return state
+
+async def test_due_deletions_are_batched_per_type(fake_redis, cloudinary_admin_api, clock):
+    await dq.enqueue_deletions([(f"img{i}", "image") for i in range(150)])
+    await dq.enqueue_deletions([(f"vid{i}", "video") for i in range(3)])
+
+    assert await dq.process_due_deletions() == 153
+    assert sorted((rt, dt, len(ids)) for rt, dt, ids in cloudinary_admin_api.calls) == [("image", "private", 50), ("image", "private", 100), ("video", "private", 3)]
+    assert await fake_redis.zcard(dq.DELETION_QUEUE_KEY) == 0
+
+async def test_not_found_counts_as_done_and_other_statuses_are_retried(fake_redis, cloudinary_admin_api, clock):
+    cloudinary_admin_api.statuses = {"gone": "not_found", "stuck": "rate_limited"}
+    await dq.enqueue_deletions([("gone", "image"), ("stuck", "image")])
+
+    await dq.process_due_deletions()
+    assert await fake_redis.zrange(dq.DELETION_QUEUE_KEY, 0, -1, withscores=True) == [("image:private:stuck", clock["now"] + dq.DELETION_RETRY_BASE_DELAY_SECONDS)]
+    assert await fake_redis.hgetall(dq.DELETION_ATTEMPTS_KEY) == {"image:private:stuck": "1"}
+
+    cloudinary_admin_api.statuses = {}
+    clock["now"] += dq.DELETION_RETRY_BASE_DELAY_SECONDS
+    assert await dq.process_due_deletions() == 1
+    assert await fake_redis.zcard(dq.DELETION_QUEUE_KEY) == 0
+    assert await fake_redis.hgetall(dq.DELETION_ATTEMPTS_KEY) == {}
+
+async def test_api_error_reschedules_the_whole_batch_with_backoff(fake_redis, cloudinary_admin_api, clock):
+    cloudinary_admin_api.fail_next = 2
+    await dq.enqueue_deletions([("a", "image"), ("b", "image")])
+    start = clock["now"]
+
+    await dq.process_due_deletions()
+    clock["now"] = start + dq._retry_delay(1)
+    await dq.process_due_deletions()
+    scores = dict(await fake_redis.zrange(dq.DELETION_QUEUE_KEY, 0, -1, withscores=True))
+    assert scores == {"image:private:a": clock["now"] + dq._retry_delay(2), "image:private:b": clock["now"] + dq._retry_delay(2)}
+
+    clock["now"] += dq._retry_delay(2)
+    await dq.process_due_deletions()
+    assert await fake_redis.zcard(dq.DELETION_QUEUE_KEY) == 0
+
+async def test_gives_up_after_max_attempts(fake_redis, cloudinary_admin_api, clock):
+    cloudinary_admin_api.statuses = {"stuck": "rate_limited"}
+    await dq.enqueue_deletion("stuck", "image")
+    for _ in range(dq.DELETION_MAX_ATTEMPTS):
+        clock["now"] += dq.DELETION_RETRY_MAX_DELAY_SECONDS
+        await dq.process_due_deletions()
+
+    assert len(cloudinary_admin_api.calls) == dq.DELETION_MAX_ATTEMPTS
+    assert await fake_redis.zcard(dq.DELETION_QUEUE_KEY) == 0
+    assert await fake_redis.zrange(dq.DELETION_FAILED_KEY, 0, -1) == ["image:private:stuck"]
+
+async def test_claim_is_leased_until_it_expires(fake_redis, cloudinary_admin_api, clock):
+    await dq.enqueue_deletion("orphan", "image")
+    # A worker claims the batch and dies before calling Cloudinary.
+    await fake_redis.eval(dq.CLAIM_DUE_DELETIONS_SCRIPT, 1, dq.DELETION_QUEUE_KEY, clock["now"], clock["now"] + dq.DELETION_LEASE_SECONDS, dq.DELETION_CLAIM_SIZE)
+
+    clock["now"] += dq.DELETION_LEASE_SECONDS - 1
+    assert await dq.process_due_deletions() == 0
+    clock["now"] += 1
+    assert await dq.process_due_deletions() == 1
+    assert cloudinary_admin_api.deleted_ids() == ["orphan"]
+
+async def test_concurrent_workers_never_claim_the_same_asset(fake_redis, cloudinary_admin_api, clock):
+    await dq.enqueue_deletions([(f"img{i}", "image") for i in range(dq.DELETION_CLAIM_SIZE)])
+    counts = await asyncio.gather(*[dq.process_due_deletions() for _ in range(4)])
+
+    assert sum(counts) == dq.DELETION_CLAIM_SIZE
+    deleted = cloudinary_admin_api.deleted_ids()
+    assert len(deleted) == len(set(deleted)) == dq.DELETION_CLAIM_SIZE
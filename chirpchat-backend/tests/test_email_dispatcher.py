@@ -0,0 +1,99 @@
+import asyncio
+import socket
+
+import pytest
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+from app.config import settings
+from app.utils import email_utils
+from app.utils.email_utils import EmailDispatcher, QueuedEmail
+
+class RecordingHandler:
+    """Keeps every delivered message with the client address it arrived from; one address per SMTP session."""
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((session.peer, envelope.content.decode()))
+        return "250 OK"
+
+    @property
+    def sessions(self) -> int:
+        return len({peer for peer, _ in self.messages})
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class SmtpServer:
+    def __init__(self, port: int):
+        self.handler, self.port = RecordingHandler(), port
+        self.controller = self._controller()
+
+    def _controller(self) -> Controller:
+        return Controller(self.handler, hostname="127.0.0.1", port=self.port, auth_require_tls=False,
+                          authenticator=lambda *args: AuthResult(success=True))
+
+    def restart(self):
+        """Drops every open session, like a server restart or idle timeout."""
+        self.controller.stop()
+        self.controller = self._controller()
+        self.controller.start()
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    server = SmtpServer(free_port())
+    server.controller.start()
+    for name, value in {"SMTP_HOST": "127.0.0.1", "SMTP_PORT": server.port, "SMTP_SSL": False, "SMTP_TLS": False,
+                        "SMTP_USER": "mailer", "SMTP_PASSWORD": "secret", "SMTP_SENDER_EMAIL": "noreply@example.com"}.items():
+        monkeypatch.setattr(settings, name, value)
+    monkeypatch.setattr(email_utils, "EMAIL_BATCH_WINDOW_SECONDS", 0.1)
+    yield server
+    server.controller.stop()
+
+@pytest.fixture
+async def dispatcher():
+    dispatcher = EmailDispatcher()
+    yield dispatcher
+    await dispatcher._close()
+
+def login(name: str) -> QueuedEmail:
+    return QueuedEmail(f"Kuchlu User Login: {name}", "admin@example.com", f"<p>{name}</p>", f"<li>{name}</li>")
+
+async def test_sends_reuse_one_session(smtp_server, dispatcher):
+    for i in range(3):
+        await dispatcher._send(f"subject {i}", "a@example.com", "<p>hi</p>")
+    assert len(smtp_server.handler.messages) == 3
+    assert smtp_server.handler.sessions == 1
+
+async def test_reconnects_after_the_server_drops_the_session(smtp_server, dispatcher):
+    await dispatcher._send("before", "a@example.com", "<p>hi</p>")
+    smtp_server.restart()
+    await dispatcher._send("after", "a@example.com", "<p>hi</p>")
+    subjects = [content for _, content in smtp_server.handler.messages]
+    assert len(subjects) == 2 and "Subject: after" in subjects[1]
+    assert smtp_server.handler.sessions == 2
+
+async def test_logins_at_the_threshold_become_one_digest(smtp_server, dispatcher):
+    await dispatcher._send_batch([login(name) for name in ["ana", "ben", "cy"]])
+    (_, content), = smtp_server.handler.messages
+    assert "Subject: Kuchlu: 3 user logins" in content
+    assert all(f"<li>{name}</li>" in content for name in ["ana", "ben", "cy"])
+
+async def test_logins_below_the_threshold_are_sent_individually(smtp_server, dispatcher):
+    await dispatcher._send_batch([login(name) for name in ["ana", "ben"]])
+    subjects = [line for _, content in smtp_server.handler.messages for line in content.splitlines() if line.startswith("Subject:")]
+    assert subjects == ["Subject: Kuchlu User Login: ana", "Subject: Kuchlu User Login: ben"]
+
+async def test_drain_sends_everything_queued_before_shutdown(smtp_server, dispatcher, monkeypatch):
+    monkeypatch.setattr(email_utils, "EMAIL_BATCH_WINDOW_SECONDS", 30) # Shutdown must not wait out the batch window.
+    worker = asyncio.create_task(dispatcher.run())
+    dispatcher.enqueue(QueuedEmail("first", "a@example.com", "<p>1</p>"))
+    await asyncio.sleep(0.05) # The worker has taken "first" and is waiting for the burst to accumulate.
+    for i in range(4): dispatcher.enqueue(QueuedEmail(f"queued {i}", "a@example.com", "<p>hi</p>"))
+    await asyncio.wait_for(dispatcher.drain(timeout=5), timeout=5)
+    assert worker.done()
+    assert len(smtp_server.handler.messages) == 5
+    assert dispatcher._smtp is None
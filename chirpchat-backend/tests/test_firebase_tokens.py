@@ -0,0 +1,103 @@
+import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from jose import jwt
+
+from app.auth import firebase_service as firebase_module
+from app.config import settings
+
+PROJECT_ID = settings.FIREBASE_PROJECT_ID
+
+def signing_key(kid: str):
+    """An RSA key and the {kid: PEM certificate} entry Google publishes for it."""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "securetoken.system.gserviceaccount.com")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key()).serial_number(1) \
+        .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=1)).sign(key, hashes.SHA256())
+    pem_key = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()).decode()
+    return pem_key, {kid: certificate.public_bytes(serialization.Encoding.PEM).decode()}
+
+OLD_KEY, OLD_CERTS = signing_key("old")
+NEW_KEY, NEW_CERTS = signing_key("new")
+
+def id_token(private_key: str, kid: str, lifetime: int = 3600, uid: str = "firebase-uid") -> str:
+    now = int(time.time())
+    claims = {"iss": f"https://securetoken.google.com/{PROJECT_ID}", "aud": PROJECT_ID, "sub": uid, "auth_time": now - 10, "iat": now - 10, "exp": now + lifetime}
+    return jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": kid})
+
+class KeyServer:
+    """Stand-in for Google's securetoken x509 endpoint: serves certs with a Cache-Control max-age and counts fetches."""
+    def __init__(self, certs: dict, max_age: int):
+        self.certs, self.max_age, self.fetches = certs, max_age, 0
+
+@pytest.fixture
+def key_server(monkeypatch):
+    server_state = KeyServer(OLD_CERTS, 3600)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            server_state.fetches += 1
+            body = json.dumps(server_state.certs).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Cache-Control", f"public, max-age={server_state.max_age}, must-revalidate, no-transform")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args): pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(settings, "FIREBASE_ID_TOKEN_CERT_URL", f"http://127.0.0.1:{server.server_port}/certs")
+    yield server_state
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def service(key_server):
+    firebase_module.verified_token_cache._entries.clear()
+    service = firebase_module.FirebaseService()
+    service._initialized = True # Only the Admin SDK needs service-account credentials; ID token checks don't.
+    return service
+
+async def test_keys_are_reused_for_their_max_age(service, key_server):
+    key_server.max_age = 600
+    assert (await service.verify_id_token(id_token(OLD_KEY, "old", uid="a")))["uid"] == "a"
+    assert (await service.verify_id_token(id_token(OLD_KEY, "old", uid="b")))["uid"] == "b"
+    assert key_server.fetches == 1
+    assert service._signing_keys_expire_at == pytest.approx(time.time() + 600, abs=5)
+
+async def test_unknown_kid_refetches_the_keys_once(service, key_server):
+    await service.verify_id_token(id_token(OLD_KEY, "old"))
+    key_server.certs = {**OLD_CERTS, **NEW_CERTS} # Google publishes a new key before signing with it.
+    assert (await service.verify_id_token(id_token(NEW_KEY, "new")))["uid"] == "firebase-uid"
+    assert key_server.fetches == 2
+    assert await service.verify_id_token(id_token(NEW_KEY, "unpublished")) is None
+    assert key_server.fetches == 3
+
+async def test_bad_signature_and_wrong_audience_are_rejected(service, key_server):
+    assert await service.verify_id_token(id_token(NEW_KEY, "old")) is None
+    claims = jwt.get_unverified_claims(id_token(OLD_KEY, "old"))
+    assert await service.verify_id_token(jwt.encode({**claims, "aud": "other-project"}, OLD_KEY, algorithm="RS256", headers={"kid": "old"})) is None
+
+async def test_memo_lasts_the_configured_ttl_at_most(service, key_server, monkeypatch):
+    monkeypatch.setattr(settings, "FIREBASE_TOKEN_MEMO_TTL_SECONDS", 60)
+    await service.verify_id_token(id_token(OLD_KEY, "old", lifetime=3600))
+    (_, expires_at), = firebase_module.verified_token_cache._entries.values()
+    assert expires_at == pytest.approx(time.time() + 60, abs=5)
+
+async def test_memo_ends_at_the_token_exp(service, key_server):
+    token = id_token(OLD_KEY, "old", lifetime=30)
+    await service.verify_id_token(token)
+    (_, expires_at), = firebase_module.verified_token_cache._entries.values()
+    assert expires_at == jwt.get_unverified_claims(token)["exp"]
@@ -0,0 +1,64 @@
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.chat import routes
+from app.websocket.manager import CHAT_MEMBERSHIP_PREFIX
+from tests.conftest import MIGRATIONS_DIR
+
+USER = SimpleNamespace(id=uuid.uuid4())
+CHAT_ID = uuid.uuid4()
+MEMBERSHIP_KEY = f"{CHAT_MEMBERSHIP_PREFIX}{CHAT_ID}:{USER.id}"
+MIGRATION = "003_add_history_cleared_watermark.sql"
+
+@pytest.mark.migrations(MIGRATION)
+def test_markers_become_watermarks_and_are_deleted(pg):
+    """Re-applies the migration over marker rows; a watermark already past a marker is left alone."""
+    with pg.cursor() as cur:
+        cur.execute("INSERT INTO public.users DEFAULT VALUES RETURNING id")
+        clearer = cur.fetchone()[0]
+        cur.execute("INSERT INTO public.users DEFAULT VALUES RETURNING id")
+        partner = cur.fetchone()[0]
+        cur.execute("INSERT INTO public.chats DEFAULT VALUES RETURNING id")
+        chat_id = cur.fetchone()[0]
+        cur.execute("INSERT INTO public.chat_participants (chat_id, user_id, cleared_at) VALUES (%s, %s, NULL), (%s, %s, NOW())", (chat_id, clearer, chat_id, partner))
+        for user_id, subtype, age in ((clearer, "history_cleared_marker", "3 days"), (clearer, None, "2 days"), (clearer, "history_cleared_marker", "1 day"),
+                                      (partner, "history_cleared_marker", "5 days"), (partner, None, "1 hour")):
+            cur.execute("INSERT INTO public.messages (chat_id, user_id, message_subtype, created_at) VALUES (%s, %s, %s, NOW() - %s::INTERVAL)", (chat_id, user_id, subtype, age))
+        cur.execute("SELECT MAX(created_at) FROM public.messages WHERE message_subtype = 'history_cleared_marker' AND user_id = %s", (clearer,))
+        latest_marker = cur.fetchone()[0]
+        cur.execute("SELECT cleared_at FROM public.chat_participants WHERE user_id = %s", (partner,))
+        partner_cleared_at = cur.fetchone()[0]
+        cur.execute((MIGRATIONS_DIR / MIGRATION).read_text())
+        cur.execute("SELECT user_id, cleared_at FROM public.chat_participants")
+        assert dict(cur.fetchall()) == {clearer: latest_marker, partner: partner_cleared_at}
+        cur.execute("SELECT COUNT(*), COUNT(*) FILTER (WHERE message_subtype = 'history_cleared_marker') FROM public.messages")
+        assert cur.fetchone() == (2, 0)
+
+async def test_history_is_filtered_on_the_cached_watermark(fake_db, fake_redis):
+    fake_db.on("chat_participants", {"user_id": str(USER.id), "cleared_at": "2024-05-01T10:00:00+00:00"})
+    for _ in range(2): await routes.get_messages(CHAT_ID, current_user=USER)
+    first, second = fake_db.queries_for("messages")
+    assert first.called("gt") == second.called("gt") == [("created_at", "2024-05-01T10:00:00+00:00")]
+    assert len(fake_db.queries_for("chat_participants")) == 1 # The second page came from the Redis membership cache.
+
+async def test_clearing_moves_the_watermark_and_drops_the_cached_membership(fake_db, fake_redis):
+    fake_db.on("chat_participants", {"user_id": str(USER.id), "cleared_at": None})
+    await routes.get_messages(CHAT_ID, current_user=USER)
+    assert await fake_redis.exists(MEMBERSHIP_KEY)
+    fake_db.on("chat_participants", [{"user_id": str(USER.id)}])
+    await routes.clear_chat_for_user(CHAT_ID, current_user=USER)
+    update, = [q for q in fake_db.queries_for("chat_participants") if q.called("update")]
+    cleared_at = update.called("update")[0][0]["cleared_at"]
+    assert not await fake_redis.exists(MEMBERSHIP_KEY)
+    fake_db.on("chat_participants", {"user_id": str(USER.id), "cleared_at": cleared_at})
+    await routes.get_messages(CHAT_ID, current_user=USER)
+    assert fake_db.queries_for("messages")[-1].called("gt") == [("created_at", cleared_at)]
+
+async def test_non_participants_cannot_clear(fake_db, fake_redis):
+    fake_db.on("chat_participants", [])
+    with pytest.raises(HTTPException) as error:
+        await routes.clear_chat_for_user(CHAT_ID, current_user=USER)
+    assert error.value.status_code == 403
@@ -0,0 +1,120 @@
+import json
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from app.chat import routes
+from tests.conftest import MIGRATIONS_DIR
+
+CONTENT_HASH = "a" * 64
+ASSET_MIGRATIONS = ("001_add_replies.sql", "002_add_robust_upload_schema.sql", "006_add_media_assets.sql", "014_scope_media_assets_to_owner.sql")
+
+def insert_user(cur) -> str:
+    cur.execute("INSERT INTO public.users DEFAULT VALUES RETURNING id")
+    return cur.fetchone()[0]
+
+def register(cur, owner_id, public_id: str) -> bool:
+    cur.execute("SELECT public.register_media_asset(%s, %s, %s, 'image', 'u', NULL, 1, '{}')", (owner_id, CONTENT_HASH, public_id))
+    return cur.fetchone()[0]
+
+@pytest.mark.migrations(*ASSET_MIGRATIONS)
+def test_assets_are_only_acquired_by_their_owner(pg):
+    with pg.cursor() as cur:
+        owner, other = insert_user(cur), insert_user(cur)
+        assert register(cur, owner, "owner/asset")
+        cur.execute("SELECT public_id, ref_count FROM public.acquire_media_asset(%s, %s)", (other, CONTENT_HASH))
+        assert cur.fetchall() == []
+        cur.execute("SELECT public_id, ref_count FROM public.acquire_media_asset(%s, %s)", (owner, CONTENT_HASH))
+        assert cur.fetchall() == [("owner/asset", 2)]
+
+@pytest.mark.migrations(*ASSET_MIGRATIONS)
+def test_same_bytes_register_once_per_owner(pg):
+    with pg.cursor() as cur:
+        owner, other = insert_user(cur), insert_user(cur)
+        assert register(cur, owner, "owner/asset")
+        assert not register(cur, owner, "owner/again")
+        assert register(cur, other, "other/asset")
+
+@pytest.mark.migrations("001_add_replies.sql", "002_add_robust_upload_schema.sql", "006_add_media_assets.sql")
+def test_existing_assets_are_owned_by_their_first_sender(pg):
+    with pg.cursor() as cur:
+        first, later = insert_user(cur), insert_user(cur)
+        cur.execute("INSERT INTO public.chats DEFAULT VALUES RETURNING id")
+        chat_id = cur.fetchone()[0]
+        cur.execute("INSERT INTO public.media_assets (content_hash, public_id, resource_type) VALUES (%s, 'shared/asset', 'image')", (CONTENT_HASH,))
+        for user_id, age in ((later, "1 hour"), (first, "2 hours")):
+            cur.execute("INSERT INTO public.messages (chat_id, user_id, file_metadata, created_at) VALUES (%s, %s, %s, NOW() - %s::INTERVAL)",
+                        (chat_id, user_id, '{"public_id": "shared/asset"}', age))
+        cur.execute((MIGRATIONS_DIR / "014_scope_media_assets_to_owner.sql").read_text())
+        cur.execute("SELECT owner_id FROM public.media_assets")
+        assert cur.fetchone()[0] == first
+
+@pytest.fixture
+def send_env(monkeypatch):
+    async def yes(*args): return True
+    async def no(*args): return False
+    monkeypatch.setattr(routes.ws_manager, "is_user_in_chat", yes)
+    monkeypatch.setattr(routes.ws_manager, "is_message_processed", no)
+    registered = []
+    async def register_asset(*args): registered.append(args)
+    monkeypatch.setattr(routes.media_assets, "register_asset", register_asset)
+    return registered
+
+async def test_failed_insert_registers_no_asset_reference(fake_db, send_env):
+    fake_db.on("messages", RuntimeError("insert failed"))
+    payload = routes.MediaMessagePayload(client_temp_id=str(uuid.uuid4()), chat_id=str(uuid.uuid4()), public_id="p", media_type="image",
+                                         cloudinary_metadata={"resource_type": "image", "secure_url": "u", "bytes": 1}, content_hash=CONTENT_HASH)
+    with pytest.raises(RuntimeError):
+        await routes.send_media_message(payload, SimpleNamespace(id=uuid.uuid4()))
+    assert send_env == []
+
+FORWARD_MIGRATIONS = ("001_add_replies.sql", "002_add_robust_upload_schema.sql", "003_add_history_cleared_watermark.sql",
+                      "006_add_media_assets.sql", "014_scope_media_assets_to_owner.sql", "016_acquire_media_asset_for_forward.sql")
+
+def forward(cur, user_id, message_id) -> list:
+    cur.execute("SELECT public_id, ref_count FROM public.acquire_media_asset_for_forward(%s, %s)", (user_id, message_id))
+    return cur.fetchall()
+
+@pytest.fixture
+def partner_voice_note(pg):
+    """A voice note the partner uploaded and sent in a chat both of them are in, as the API stores it."""
+    with pg.cursor() as cur:
+        sender, forwarder, outsider = insert_user(cur), insert_user(cur), insert_user(cur)
+        cur.execute("INSERT INTO public.chats DEFAULT VALUES RETURNING id")
+        chat_id = cur.fetchone()[0]
+        cur.execute("INSERT INTO public.chat_participants (chat_id, user_id) VALUES (%s, %s), (%s, %s)", (chat_id, sender, chat_id, forwarder))
+        assert register(cur, sender, "partner/voice")
+        metadata = json.dumps(json.dumps({"content_hash": CONTENT_HASH, "public_id": "partner/voice", "resource_type": "video"}))
+        cur.execute("INSERT INTO public.messages (chat_id, user_id, file_metadata, created_at) VALUES (%s, %s, %s, NOW() - INTERVAL '1 hour') RETURNING id",
+                    (chat_id, sender, metadata))
+        return SimpleNamespace(chat_id=chat_id, message_id=cur.fetchone()[0], forwarder=forwarder, outsider=outsider)
+
+@pytest.mark.migrations(*FORWARD_MIGRATIONS)
+def test_partner_media_is_forwarded_without_a_reupload(pg, partner_voice_note):
+    with pg.cursor() as cur:
+        cur.execute("SELECT * FROM public.acquire_media_asset(%s, %s)", (partner_voice_note.forwarder, CONTENT_HASH))
+        assert cur.fetchall() == [] # The hash alone still never matches someone else's upload.
+        assert forward(cur, partner_voice_note.forwarder, partner_voice_note.message_id) == [("partner/voice", 2)]
+
+@pytest.mark.migrations(*FORWARD_MIGRATIONS)
+def test_forward_requires_the_message_to_be_visible_to_the_forwarder(pg, partner_voice_note):
+    with pg.cursor() as cur:
+        assert forward(cur, partner_voice_note.outsider, partner_voice_note.message_id) == []
+        cur.execute("UPDATE public.chat_participants SET cleared_at = NOW() WHERE user_id = %s", (partner_voice_note.forwarder,))
+        assert forward(cur, partner_voice_note.forwarder, partner_voice_note.message_id) == []
+        cur.execute("SELECT ref_count FROM public.media_assets")
+        assert cur.fetchone()[0] == 1
+
+async def test_forward_route_sends_the_acquired_asset(fake_db, send_env, monkeypatch):
+    asset = {"content_hash": CONTENT_HASH, "public_id": "partner/voice", "resource_type": "video", "media_url": "u", "file_size": 10, "thumbnail_url": None, "file_metadata": {"duration_seconds": 3}}
+    async def acquire(user_id, message_id): return asset
+    published = []
+    async def publish(row, chat_id, client_temp_id, user): published.append(row)
+    monkeypatch.setattr(routes.media_assets, "acquire_asset_for_forward", acquire)
+    monkeypatch.setattr(routes, "publish_media_message", publish)
+    payload = routes.MediaMessageForwardCreate(client_temp_id="t1", source_message_id=uuid.uuid4(), media_type="voice_message")
+    await routes.forward_media_message(uuid.uuid4(), payload, SimpleNamespace(id=uuid.uuid4()))
+    row, = published
+    assert row["media_url"] == "u" and json.loads(row["file_metadata"]) == {"duration_seconds": 3, "content_hash": CONTENT_HASH, "public_id": "partner/voice", "resource_type": "video"}
+    assert fake_db.queries_for("messages")[0].called("insert")
@@ -0,0 +1,52 @@
+import re
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from app.chat import routes
+
+CHAT_ID = uuid.uuid4()
+SHARED_TIMESTAMP = "2024-05-01T12:00:00+00:00"
+
+def gallery_rows() -> list:
+    """Seven photos sent together (one timestamp) between two older and newer ones."""
+    stamps = ["2024-05-01T12:00:01+00:00"] * 2 + [SHARED_TIMESTAMP] * 7 + ["2024-05-01T11:59:59+00:00"] * 2
+    return [{"id": str(uuid.uuid4()), "user_id": str(uuid.uuid4()), "media_type": "image", "media_url": f"https://res.example.com/{i}.jpg",
+             "thumbnail_url": None, "file_size": 10, "file_metadata": None, "created_at": stamp} for i, stamp in enumerate(stamps)]
+
+def keyset_page(rows: list):
+    """Answers the gallery query like PostgREST: applies the (created_at, id) keyset filter, order and limit."""
+    def answer(query):
+        selected = sorted(rows, key=lambda r: (r["created_at"], r["id"]), reverse=True)
+        for (expression,) in query.called("or_"):
+            before, before_id = re.fullmatch(r'created_at\.lt\."(.+)",and\(created_at\.eq\."(.+)",id\.lt\.(.+)\)', expression).group(1, 3)
+            selected = [r for r in selected if (r["created_at"], r["id"]) < (before, before_id)]
+        assert query.called("order") == [("created_at",), ("id",)]
+        return selected[:query.called("limit")[0][0]]
+    return answer
+
+@pytest.fixture
+def member(monkeypatch):
+    async def get_chat_membership(user_id, chat_id): return {"cleared_at": None}
+    monkeypatch.setattr(routes.ws_manager, "get_chat_membership", get_chat_membership)
+
+async def test_pages_cover_media_sharing_a_timestamp_exactly_once(fake_db, member):
+    rows = gallery_rows()
+    user, cursor, seen = SimpleNamespace(id=uuid.uuid4()), None, []
+    for _ in range(len(rows)):
+        fake_db.on("messages", keyset_page(rows))
+        page = await routes.get_chat_media(CHAT_ID, media_type=None, cursor=cursor, limit=3, current_user=user)
+        seen.extend(str(item.message_id) for item in page.items)
+        cursor = page.next_cursor
+        if not cursor: break
+    assert sorted(seen) == sorted(row["id"] for row in rows)
+    assert len(seen) == len(set(seen))
+
+async def test_type_filter_and_invalid_cursor(fake_db, member):
+    fake_db.on("messages", [])
+    await routes.get_chat_media(CHAT_ID, media_type="image", cursor=None, limit=3, current_user=SimpleNamespace(id=uuid.uuid4()))
+    assert ("media_type", "image") in fake_db.queries[0].called("eq")
+    with pytest.raises(routes.HTTPException) as error:
+        await routes.get_chat_media(CHAT_ID, media_type=None, cursor="not-a-cursor", limit=3, current_user=SimpleNamespace(id=uuid.uuid4()))
+    assert error.value.status_code == 400
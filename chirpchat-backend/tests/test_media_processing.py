@@ -0,0 +1,66 @@
+import array
+import io
+import math
+import wave
+
+import pytest
+
+from app.media import processing
+
+def pcm_wav(seconds: float, rate: int = processing.WAVEFORM_SAMPLE_RATE, channels: int = 1) -> bytes:
+    """A 16-bit sine sweep that gets louder over time, like a voice note that starts quietly."""
+    frames = int(seconds * rate)
+    samples = array.array("h", (int(32767 * (i / frames) * math.sin(2 * math.pi * 440 * i / rate)) for i in range(frames) for _ in range(channels)))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+def test_waveform_has_one_peak_per_bucket_scaled_to_the_loudest():
+    peaks = processing.compute_waveform_peaks(pcm_wav(2))
+    assert len(peaks) == processing.WAVEFORM_BUCKETS
+    assert max(peaks) == 255
+    assert peaks == sorted(peaks), "the test signal only gets louder"
+
+def test_empty_audio_gives_a_flat_waveform():
+    assert processing.compute_waveform_peaks(pcm_wav(0)) == [0] * processing.WAVEFORM_BUCKETS
+
+def test_stereo_is_bucketed_across_both_channels():
+    assert processing.compute_waveform_peaks(pcm_wav(2, channels=2)) == processing.compute_waveform_peaks(pcm_wav(2))
+
+@pytest.mark.benchmark(group="waveform")
+@pytest.mark.parametrize("seconds", [30, 300])
+def test_benchmark_waveform_peaks(benchmark, seconds):
+    """Peaks of an 8 kHz rendition: a typical 30 s voice note and a long 5 minute one."""
+    audio = pcm_wav(seconds)
+    assert len(benchmark(processing.compute_waveform_peaks, audio)) == processing.WAVEFORM_BUCKETS
+
+def jpeg(width: int, height: int) -> bytes:
+    from PIL import Image
+    gradient = Image.linear_gradient("L").resize((width, height))
+    buffer = io.BytesIO()
+    Image.merge("RGB", (gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT), gradient.rotate(90))).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+def test_blurhash_layout_and_average_colour():
+    from PIL import Image
+    blurhash = processing.encode_blurhash(Image.new("RGB", (8, 8), (255, 0, 0)), 4, 3)
+    # Size flag, AC maximum, the DC (average) colour, then one pair of characters per AC component.
+    assert len(blurhash) == 2 + 4 + 2 * 11
+    assert blurhash[0] == processing._base83(3 + 2 * 9, 1)
+    assert blurhash[2:6] == processing._base83(0xFF0000, 4)
+
+def test_placeholder_is_oriented_like_the_image(monkeypatch):
+    monkeypatch.setattr(processing, "_download", lambda url: jpeg(32, 18) if url == "landscape" else jpeg(18, 32))
+    assert processing.analyze_image("landscape")["blurhash"][0] == processing._base83(3 + 2 * 9, 1)
+    assert processing.analyze_image("portrait")["blurhash"][0] == processing._base83(2 + 3 * 9, 1)
+
+@pytest.mark.benchmark(group="blurhash")
+def test_benchmark_placeholder_from_32px_rendition(benchmark, monkeypatch):
+    """analyze_image on the PLACEHOLDER_SOURCE_SIZE rendition Cloudinary returns, minus the download."""
+    rendition = jpeg(processing.PLACEHOLDER_SOURCE_SIZE, processing.PLACEHOLDER_SOURCE_SIZE)
+    monkeypatch.setattr(processing, "_download", lambda url: rendition)
+    assert len(benchmark(processing.analyze_image, "placeholder")["blurhash"]) == 28
@@ -0,0 +1,86 @@
+import json
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from app.chat import routes
+from app.chat.schemas import MessageBatchCreate, MessageCreate
+
+CHAT_ID = uuid.uuid4()
+
+@pytest.mark.migrations("001_add_replies.sql", "002_add_robust_upload_schema.sql", "011_add_insert_messages_batch.sql")
+def test_insert_messages_batch_keeps_batch_order_with_db_timestamps(pg):
+    with pg.cursor() as cur:
+        cur.execute("INSERT INTO public.users DEFAULT VALUES RETURNING id")
+        user_id = cur.fetchone()[0]
+        cur.execute("INSERT INTO public.chats DEFAULT VALUES RETURNING id")
+        chat_id = cur.fetchone()[0]
+        batch = MessageBatchCreate(messages=[MessageCreate(text=f"outbox {i}", client_temp_id=f"t{i}") for i in range(20)])
+        # Random ids, so (created_at, id) only sorts in batch order if created_at does.
+        rows = [routes.build_message_row(m, uuid.uuid4(), chat_id, user_id) for m in batch.messages]
+        cur.execute("SELECT * FROM public.insert_messages_batch(%s::jsonb)", (json.dumps(rows),))
+        assert [str(r[0]) for r in cur.fetchall()] == [row["id"] for row in rows]
+        cur.execute("SELECT text, created_at, updated_at, created_at <= NOW() FROM public.messages ORDER BY created_at, id")
+        stored = cur.fetchall()
+    assert [r[0] for r in stored] == [f"outbox {i}" for i in range(20)]
+    assert all(created == updated and in_past for _, created, updated, in_past in stored)
+    assert len({r[1] for r in stored}) == 20
+
+@pytest.fixture
+def batch_env(fake_db, monkeypatch):
+    calls = SimpleNamespace(released=[], broadcast=[], pushed=[])
+    async def get_chat_membership(user_id, chat_id): return {"cleared_at": None}
+    async def claim(ids): return [True] * len(ids)
+    async def release(ids): calls.released.extend(ids)
+    async def broadcast(chat_id, messages): calls.broadcast.extend(messages)
+    async def push(sender, chat_id, messages): calls.pushed.extend(messages)
+    monkeypatch.setattr(routes.ws_manager, "get_chat_membership", get_chat_membership)
+    monkeypatch.setattr(routes.ws_manager, "claim_messages_for_processing", claim)
+    monkeypatch.setattr(routes.ws_manager, "release_processed_messages", release)
+    monkeypatch.setattr(routes.ws_manager, "broadcast_chat_messages", broadcast)
+    monkeypatch.setattr(routes.notification_service, "send_new_messages_notification", push)
+    return calls
+
+def stored_rows(query) -> list:
+    """Answers the read-back select with the rows the batch inserted, as the DB would return them."""
+    ids = query.called("in_")[0][1]
+    return [{"id": i, "chat_id": str(CHAT_ID), "user_id": str(uuid.uuid4()), "text": "hi", "media_type": "text", "mode": "normal",
+             "status": "sent", "reactions": {}, "created_at": "2024-05-01T00:00:00+00:00", "updated_at": "2024-05-01T00:00:00+00:00"} for i in ids]
+
+async def test_batch_inserts_through_the_db_timestamping_rpc(fake_db, batch_env):
+    fake_db.on("messages", stored_rows)
+    batch = MessageBatchCreate(messages=[MessageCreate(text="a", client_temp_id="a"), MessageCreate(text="b", client_temp_id="b")])
+    response = await routes.send_message_batch(CHAT_ID, batch, SimpleNamespace(id=uuid.uuid4()))
+    rpc = fake_db.queries_for("insert_messages_batch")[0]
+    assert all(row["created_at"] == "now()" for row in rpc.called("rpc")[0][0]["p_rows"])
+    assert [ack.status for ack in response.acks] == ["sent", "sent"]
+    assert len(batch_env.broadcast) == 2
+
+async def test_a_row_that_fails_validation_after_insert_keeps_the_rest(fake_db, batch_env):
+    def one_bad_row(query):
+        rows = stored_rows(query)
+        rows[0]["status"] = "not-a-status"
+        return rows
+    fake_db.on("messages", one_bad_row)
+    batch = MessageBatchCreate(messages=[MessageCreate(text=str(i), client_temp_id=f"t{i}") for i in range(3)])
+    response = await routes.send_message_batch(CHAT_ID, batch, SimpleNamespace(id=uuid.uuid4()))
+    assert [ack.status for ack in response.acks] == ["sent"] * 3
+    assert response.acks[0].message is None and response.acks[0].server_assigned_id is not None
+    assert all(ack.message for ack in response.acks[1:])
+    assert len(batch_env.broadcast) == 2
+    assert batch_env.released == [], "stored messages must keep their claims"
+
+async def test_read_back_failure_still_acks_stored_messages(fake_db, batch_env):
+    fake_db.on("messages", RuntimeError("connection reset"))
+    batch = MessageBatchCreate(messages=[MessageCreate(text="a", client_temp_id="a")])
+    response = await routes.send_message_batch(CHAT_ID, batch, SimpleNamespace(id=uuid.uuid4()))
+    assert response.acks[0].status == "sent" and response.acks[0].server_assigned_id is not None
+    assert batch_env.released == [] and batch_env.broadcast == []
+
+async def test_insert_failure_releases_claims(fake_db, batch_env):
+    fake_db.on("insert_messages_batch", RuntimeError("insert failed"))
+    batch = MessageBatchCreate(messages=[MessageCreate(text="a", client_temp_id="a")])
+    with pytest.raises(routes.HTTPException):
+        await routes.send_message_batch(CHAT_ID, batch, SimpleNamespace(id=uuid.uuid4()))
+    assert batch_env.released == ["a"]
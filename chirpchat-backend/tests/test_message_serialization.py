@@ -0,0 +1,70 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import orjson
+import pytest
+
+from app.chat import routes
+from app.chat.schemas import MessageInDB
+
+PAGE_SIZE = 50
+
+def db_rows(count: int = PAGE_SIZE) -> list:
+    """A page of messages shaped like the PostgREST rows get_messages receives."""
+    chat_id, users = str(uuid.uuid4()), [str(uuid.uuid4()), str(uuid.uuid4())]
+    base = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    rows = []
+    for i in range(count):
+        created_at = (base + timedelta(seconds=i)).isoformat()
+        row = {
+            "id": str(uuid.uuid4()), "chat_id": chat_id, "user_id": users[i % 2], "text": f"message {i}",
+            "media_type": None, "media_url": None, "thumbnail_url": None, "file_size": None, "file_metadata": None,
+            "mode": "normal", "status": "sent_to_server", "sticker_id": None, "stickers": None,
+            "reactions": {"👍": [users[(i + 1) % 2]]} if i % 5 == 0 else {}, "client_temp_id": f"temp-{i}",
+            "reply_to_message_id": None, "created_at": created_at, "updated_at": created_at,
+        }
+        if i % 4 == 1:
+            row.update({"media_type": "image", "media_url": f"https://res.example.com/{i}.jpg", "thumbnail_url": f"https://res.example.com/{i}_t.jpg",
+                        "file_size": 2048, "file_metadata": orjson.dumps({"width": 800, "height": 600}).decode()})
+        if i % 7 == 3 and i > 0:
+            row["reply_to_message_id"] = rows[i - 1]["id"]
+            row["reply_preview"] = routes.build_reply_preview(rows[i - 1])
+        rows.append(row)
+    return rows
+
+def normalized(message: dict) -> dict:
+    """Parses the fields whose JSON spelling differs between the two paths (UUID case, 'Z' vs '+00:00')."""
+    message = dict(message)
+    for key in ("created_at", "updated_at"): message[key] = datetime.fromisoformat(message[key].replace("Z", "+00:00"))
+    return message
+
+def test_trusted_rows_serialize_like_validated_rows():
+    rows = db_rows()
+    validated = orjson.loads(routes.message_list_response(routes.messages_from_rows(rows)).body)["messages"]
+    trusted = orjson.loads(routes.message_list_response_from_trusted_rows(rows).body)["messages"]
+    assert [normalized(m) for m in trusted] == [normalized(m) for m in validated]
+
+def test_trusted_rows_leave_db_rows_untouched():
+    rows = db_rows(8)
+    before = orjson.dumps(rows)
+    routes.message_list_response_from_trusted_rows(rows)
+    assert orjson.dumps(rows) == before
+
+@pytest.mark.benchmark(group="message-page")
+def test_benchmark_validated_page(benchmark):
+    rows = db_rows()
+    benchmark(lambda: routes.message_list_response(routes.messages_from_rows(rows)))
+
+@pytest.mark.benchmark(group="message-page")
+def test_benchmark_constructed_page(benchmark):
+    """model_construct per row, kept as the yardstick for why the trusted path skips models entirely."""
+    rows = db_rows()
+    def constructed():
+        messages = [MessageInDB.model_construct(**routes.map_db_message_to_schema(row)) for row in rows]
+        return routes.message_list_adapter.dump_python(messages, warnings=False)
+    benchmark(constructed)
+
+@pytest.mark.benchmark(group="message-page")
+def test_benchmark_trusted_page(benchmark):
+    rows = db_rows()
+    benchmark(lambda: routes.message_list_response_from_trusted_rows(rows))
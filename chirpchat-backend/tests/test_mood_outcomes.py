@@ -0,0 +1,141 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+import pytest
+
+MIGRATIONS = ("010_add_mood_outcomes_job.sql", "015_select_pending_mood_outcomes.sql")
+WINDOW_SECONDS = 6 * 60 * 60
+BACKFILL_EVENTS = 1_000_000
+BACKFILL_MESSAGES = 200_000
+BATCH_SIZE = 1000
+
+def new_couple(cur) -> tuple:
+    """Two partnered users sharing a chat."""
+    cur.execute("INSERT INTO public.users DEFAULT VALUES RETURNING id")
+    user_id = cur.fetchone()[0]
+    cur.execute("INSERT INTO public.users (partner_id) VALUES (%s) RETURNING id", (user_id,))
+    partner_id = cur.fetchone()[0]
+    cur.execute("INSERT INTO public.chats DEFAULT VALUES RETURNING id")
+    chat_id = cur.fetchone()[0]
+    cur.execute("INSERT INTO public.chat_participants (chat_id, user_id) VALUES (%s, %s), (%s, %s)", (chat_id, user_id, chat_id, partner_id))
+    return user_id, partner_id, chat_id
+
+def mood_event(cur, user_id, partner_id, hours_ago: float) -> str:
+    cur.execute("INSERT INTO public.mood_analytics (user_id, partner_id, mood_name, source, created_at) VALUES (%s, %s, 'happy', 'profile_update', NOW() - make_interval(secs => %s)) RETURNING id",
+                (user_id, partner_id, hours_ago * 3600))
+    return cur.fetchone()[0]
+
+def message(cur, chat_id, user_id, hours_ago: float, reactions: dict = None):
+    cur.execute("INSERT INTO public.messages (chat_id, user_id, text, reactions, created_at) VALUES (%s, %s, 'hi', %s, NOW() - make_interval(secs => %s))",
+                (chat_id, user_id, json.dumps(reactions or {}), hours_ago * 3600))
+
+def compute(cur, batch_size: int = BATCH_SIZE) -> int:
+    cur.execute("SELECT public.compute_mood_outcomes(%s, %s)", (batch_size, WINDOW_SECONDS))
+    return cur.fetchone()[0]
+
+def outcome(cur, event_id) -> tuple:
+    cur.execute("SELECT partner_response_time, partner_reaction, conversation_started, mood_reciprocated, outcome_computed_at IS NOT NULL FROM public.mood_analytics WHERE id = %s", (event_id,))
+    return cur.fetchone()
+
+@pytest.mark.migrations(*MIGRATIONS)
+def test_outcomes_are_computed_from_messages_reactions_and_moods(pg):
+    with pg.cursor() as cur:
+        user_id, partner_id, chat_id = new_couple(cur)
+        event = mood_event(cur, user_id, partner_id, hours_ago=10)
+        message(cur, chat_id, user_id, hours_ago=9.5, reactions={"❤️": [str(partner_id)]})
+        message(cur, chat_id, partner_id, hours_ago=9)
+        mood_event(cur, partner_id, user_id, hours_ago=8)
+        message(cur, chat_id, partner_id, hours_ago=1) # Outside the 6 h window.
+        lonely = mood_event(cur, user_id, None, hours_ago=10)
+        open_window = mood_event(cur, user_id, partner_id, hours_ago=1)
+        assert compute(cur) == 3 # The partner's own event (8 h ago, no messages after it) is processed too.
+        assert outcome(cur, event) == (3600, "❤️", True, True, True)
+        assert outcome(cur, lonely) == (None, None, False, None, True)
+        assert outcome(cur, open_window) == (None, None, None, None, False)
+
+@pytest.mark.migrations(*MIGRATIONS)
+def test_rows_arriving_after_newer_rows_were_processed_are_still_picked_up(pg):
+    with pg.cursor() as cur:
+        user_id, partner_id, _ = new_couple(cur)
+        mood_event(cur, user_id, partner_id, hours_ago=7)
+        assert compute(cur) == 1
+        # Replayed from the spill hours later, with its original created_at: older than everything processed so far.
+        late = mood_event(cur, user_id, partner_id, hours_ago=30)
+        assert compute(cur) == 1
+        assert outcome(cur, late)[-1]
+
+@pytest.mark.migrations(*MIGRATIONS)
+def test_reruns_are_no_ops_and_reset_rows_recompute_identically(pg):
+    with pg.cursor() as cur:
+        user_id, partner_id, chat_id = new_couple(cur)
+        event = mood_event(cur, user_id, partner_id, hours_ago=10)
+        message(cur, chat_id, partner_id, hours_ago=9.9)
+        assert compute(cur) == 1 and compute(cur) == 0
+        first = outcome(cur, event)
+        cur.execute("UPDATE public.mood_analytics SET outcome_computed_at = NULL")
+        assert compute(cur) == 1
+        assert outcome(cur, event) == first
+        cur.execute("SELECT processed_count FROM public.job_watermarks WHERE job_name = 'mood_outcomes'")
+        assert cur.fetchone()[0] == 2
+
+@pytest.mark.migrations(*MIGRATIONS)
+def test_concurrent_runs_take_disjoint_batches(pg):
+    with pg.cursor() as cur:
+        user_id, partner_id, _ = new_couple(cur)
+        for i in range(10): mood_event(cur, user_id, partner_id, hours_ago=10 + i)
+    other = psycopg2.connect(pg.dsn)
+    try:
+        with other.cursor() as held:
+            assert compute(held, batch_size=4) == 4 # Not committed yet: its rows stay locked.
+            # The second run skips the locked rows; it then waits for the first to commit its processed_count.
+            with ThreadPoolExecutor(1) as pool, pg.cursor() as cur:
+                second = pool.submit(compute, cur, 100)
+                time.sleep(0.2)
+                other.commit()
+                assert second.result(timeout=10) == 6
+    finally:
+        other.close()
+    with pg.cursor() as cur:
+        cur.execute("SELECT COUNT(*), SUM(1) FILTER (WHERE outcome_computed_at IS NULL) FROM public.mood_analytics")
+        assert cur.fetchone() == (10, None)
+
+@pytest.mark.migrations(*MIGRATIONS)
+def test_pending_batch_scan_uses_the_partial_index(pg):
+    with pg.cursor() as cur:
+        cur.execute("SET enable_seqscan = off")
+        cur.execute("EXPLAIN SELECT id FROM public.mood_analytics WHERE outcome_computed_at IS NULL AND created_at <= NOW() ORDER BY created_at, id LIMIT 1000")
+        assert "idx_mood_analytics_outcome_pending" in " ".join(row[0] for row in cur.fetchall())
+
+@pytest.mark.benchmark(group="mood-outcomes-backfill")
+@pytest.mark.migrations(*MIGRATIONS)
+def test_benchmark_million_event_backfill(benchmark, pg):
+    """1M mood events from 500 couples over 60 days, with 200k messages (a quarter reacted to), drained in batches of 1000."""
+    with pg.cursor() as cur:
+        couples = [new_couple(cur) for _ in range(500)]
+        cur.execute("CREATE TEMP TABLE couples (n INT, user_id UUID, partner_id UUID, chat_id UUID)")
+        cur.executemany("INSERT INTO couples VALUES (%s, %s, %s, %s)", [(n, *couple) for n, couple in enumerate(couples)])
+        cur.execute("""
+            INSERT INTO public.mood_analytics (user_id, partner_id, mood_name, source, created_at)
+            SELECT CASE WHEN i %% 2 = 0 THEN c.user_id ELSE c.partner_id END, CASE WHEN i %% 2 = 0 THEN c.partner_id ELSE c.user_id END,
+                   'mood_' || (i %% 12), 'profile_update', NOW() - INTERVAL '7 hours' - make_interval(secs => (i %% (60 * 86400))::DOUBLE PRECISION)
+            FROM generate_series(1, %s) i JOIN couples c ON c.n = i %% 500
+        """, (BACKFILL_EVENTS,))
+        cur.execute("""
+            INSERT INTO public.messages (chat_id, user_id, text, reactions, created_at)
+            SELECT c.chat_id, CASE WHEN i %% 3 = 0 THEN c.partner_id ELSE c.user_id END, 'hi',
+                   CASE WHEN i %% 4 = 0 THEN jsonb_build_object('❤️', jsonb_build_array(c.partner_id::TEXT)) ELSE '{}'::JSONB END,
+                   NOW() - make_interval(secs => ((i * 37) %% (60 * 86400))::DOUBLE PRECISION)
+            FROM generate_series(1, %s) i JOIN couples c ON c.n = i %% 500
+        """, (BACKFILL_MESSAGES,))
+        cur.execute("ANALYZE")
+
+        def backfill() -> int:
+            total = 0
+            while (processed := compute(cur)) == BATCH_SIZE: total += processed
+            return total + processed
+
+        started_at = time.perf_counter()
+        assert benchmark.pedantic(backfill, rounds=1, iterations=1) == BACKFILL_EVENTS
+        benchmark.extra_info["events_per_s"] = round(BACKFILL_EVENTS / (time.perf_counter() - started_at))
@@ -0,0 +1,109 @@
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.auth.dependencies import get_current_user
+from app.auth.schemas import UserPublic
+from app.config import settings
+from app.routers import analytics as analytics_routes
+
+MIGRATIONS = ("008_add_mood_daily_counts.sql",)
+EVENTS_PER_USER = 100_000
+MOODS = 20
+
+def new_user(cur) -> str:
+    cur.execute("INSERT INTO public.users DEFAULT VALUES RETURNING id")
+    return cur.fetchone()[0]
+
+def insert_events(cur, user_id: str, count: int, days: int = 90, offset: int = 0):
+    """count events in one statement, spread over the last `days` days; mood_k gets a 2k+1 share, so the top k is distinct."""
+    cur.execute("""
+        INSERT INTO public.mood_analytics (user_id, mood_name, mood_emoji, source, created_at)
+        SELECT %s, 'mood_' || FLOOR(SQRT(i %% (%s * %s)))::INT, CASE WHEN i %% 7 = 0 THEN NULL ELSE '🙂' END, 'profile_update',
+               NOW() - ((i %% %s) || ' days')::INTERVAL - ((i %% 86400) || ' seconds')::INTERVAL
+        FROM generate_series(%s, %s) i
+    """, (user_id, MOODS, MOODS, days, offset + 1, offset + count))
+
+def raw_top_moods(cur, user_id: str, days: int, limit: int) -> list:
+    """How suggestions were computed before the rollup: fetch the window, count in Python."""
+    cur.execute("SELECT mood_name, mood_emoji FROM public.mood_analytics WHERE user_id = %s AND created_at >= (NOW() AT TIME ZONE 'utc')::DATE - %s",
+                (user_id, days))
+    return Counter(cur.fetchall()).most_common(limit)
+
+def top_moods(cur, user_id: str, days: int, limit: int) -> list:
+    cur.execute("SELECT mood_name, mood_emoji, total FROM public.get_top_moods(%s, (NOW() AT TIME ZONE 'utc')::DATE - %s, %s)", (user_id, days, limit))
+    return [((name, emoji), total) for name, emoji, total in cur.fetchall()]
+
+@pytest.mark.migrations(*MIGRATIONS)
+def test_rollup_matches_the_raw_events_across_bulk_inserts(pg):
+    with pg.cursor() as cur:
+        user_id, other = new_user(cur), new_user(cur)
+        for batch in range(3): insert_events(cur, user_id, 500, offset=batch * 500)
+        insert_events(cur, other, 300)
+        assert dict(top_moods(cur, user_id, 30, MOODS)) == dict(raw_top_moods(cur, user_id, 30, MOODS))
+        assert dict(top_moods(cur, other, 90, MOODS)) == dict(raw_top_moods(cur, other, 90, MOODS))
+
+@pytest.mark.migrations(*MIGRATIONS)
+def test_top_k_is_ordered_by_count(pg):
+    with pg.cursor() as cur:
+        user_id = new_user(cur)
+        insert_events(cur, user_id, 2000)
+        totals = [total for _, total in top_moods(cur, user_id, 90, 5)]
+        assert len(totals) == 5 and totals == sorted(totals, reverse=True)
+        assert totals == [total for _, total in raw_top_moods(cur, user_id, 90, 5)]
+
+@pytest.mark.migrations(*MIGRATIONS)
+def test_rebuild_is_idempotent_and_prune_drops_old_days(pg):
+    with pg.cursor() as cur:
+        user_id = new_user(cur)
+        insert_events(cur, user_id, 1000, days=120)
+        before = top_moods(cur, user_id, 200, MOODS)
+        for _ in range(2): cur.execute("SELECT public.rebuild_mood_daily_counts('2000-01-01')")
+        assert top_moods(cur, user_id, 200, MOODS) == before
+        cur.execute("SELECT public.prune_mood_daily_counts(90)")
+        cur.execute("SELECT MIN(day) >= (NOW() AT TIME ZONE 'utc')::DATE - 90 FROM public.mood_daily_counts")
+        assert cur.fetchone()[0]
+
+def test_rollup_rebuild_is_an_admin_only_repair_job(fake_db, monkeypatch):
+    admin, member = UserPublic(id=uuid.uuid4(), display_name="Ops"), UserPublic(id=uuid.uuid4(), display_name="Sam")
+    monkeypatch.setattr(settings, "ADMIN_USER_IDS", str(admin.id))
+    fake_db.on("rebuild_mood_daily_counts", 42)
+    app = FastAPI()
+    app.include_router(analytics_routes.router)
+    client = TestClient(app)
+
+    app.dependency_overrides[get_current_user] = lambda: member
+    assert client.post("/analytics/moods/rollups/rebuild").status_code == 403
+    app.dependency_overrides[get_current_user] = lambda: admin
+    assert client.post("/analytics/moods/rollups/rebuild", params={"days_ago": 365}).status_code == 422 # Older days are pruned anyway.
+    response = client.post("/analytics/moods/rollups/rebuild", params={"days_ago": 7})
+    assert response.json() == {"status": "ok", "rebuilt_day_buckets": 42}
+    (rebuild,) = fake_db.queries_for("rebuild_mood_daily_counts")
+    assert date.fromisoformat(rebuild.called("rpc")[0][0]["p_since"]) == (datetime.now(timezone.utc) - timedelta(days=7)).date()
+
+@pytest.fixture
+def heavy_user(pg):
+    """One user with EVENTS_PER_USER events over 90 days, among 20 lighter users."""
+    with pg.cursor() as cur:
+        user_id = new_user(cur)
+        for _ in range(20): insert_events(cur, new_user(cur), 5_000)
+        insert_events(cur, user_id, EVENTS_PER_USER)
+        cur.execute("ANALYZE")
+    return user_id
+
+@pytest.mark.benchmark(group="mood-suggestions-100k")
+@pytest.mark.migrations(*MIGRATIONS)
+def test_benchmark_top_moods_from_rollup(benchmark, pg, heavy_user):
+    with pg.cursor() as cur:
+        assert len(benchmark(top_moods, cur, heavy_user, 90, 5)) == 5
+
+@pytest.mark.benchmark(group="mood-suggestions-100k")
+@pytest.mark.migrations(*MIGRATIONS)
+def test_benchmark_top_moods_from_raw_events(benchmark, pg, heavy_user):
+    """The pre-rollup path, minus PostgREST's JSON encoding of every row, so it flatters the old code."""
+    with pg.cursor() as cur:
+        assert len(benchmark.pedantic(raw_top_moods, (cur, heavy_user, 90, 5), rounds=10)) == 5
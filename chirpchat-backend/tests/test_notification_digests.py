@@ -0,0 +1,123 @@
+import asyncio
+import uuid
+from datetime import datetime
+
+import pytest
+import pytz
+
+from app.notifications import service as service_module
+from app.notifications.service import DEFERRED_DIGEST_PREFIX, DEFERRED_DUE_KEY, PUSH_DEFERRED, PUSH_SENT, NotificationService, compute_quiet_window
+
+USER_ID = uuid.uuid4()
+NIGHT = {"quiet_hours_enabled": True, "quiet_hours_start": "22:00:00", "quiet_hours_end": "07:00:00", "timezone": "UTC"}
+
+def utc(*args) -> datetime:
+    return datetime(*args, tzinfo=pytz.utc)
+
+class Clock:
+    """Fixed 'now' for the service module: both datetime.now() and time.time() read it."""
+    def __init__(self, now: datetime):
+        self.now = now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(utc(2024, 5, 6, 23, 0)) # A Monday.
+    class FixedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None): return clock.now.astimezone(tz) if tz else clock.now.replace(tzinfo=None)
+    monkeypatch.setattr(service_module, "datetime", FixedDatetime)
+    monkeypatch.setattr(service_module.time, "time", lambda: clock.now.timestamp())
+    return clock
+
+@pytest.fixture
+def user_settings(fake_db):
+    """The user's notification settings row; tests edit it in place."""
+    current = {"messages": True, "mood_updates": True, **NIGHT}
+    fake_db.on("user_notification_settings", *[lambda query: dict(current)] * 50)
+    return current
+
+@pytest.fixture
+def service(fake_redis, user_settings, clock):
+    service_module.quiet_window_cache._entries.clear()
+    service = NotificationService()
+    service.vapid_private_key, service.vapid_admin_email = "key", "admin@example.com"
+    service.pushed = []
+    async def deliver_push(user_id, payload): service.pushed.append((user_id, payload))
+    service._deliver_push = deliver_push
+    return service
+
+def message(title: str = "New message from Sam") -> dict:
+    return {"type": "message", "title": title, "options": {"body": "hi"}}
+
+async def due_at(redis):
+    return await redis.zscore(DEFERRED_DUE_KEY, str(USER_ID))
+
+def test_window_crossing_midnight_contains_times_on_both_sides():
+    assert compute_quiet_window(NIGHT, utc(2024, 5, 6, 23, 30)) == (utc(2024, 5, 6, 22), utc(2024, 5, 7, 7))
+    assert compute_quiet_window(NIGHT, utc(2024, 5, 7, 3)) == (utc(2024, 5, 6, 22), utc(2024, 5, 7, 7))
+    assert compute_quiet_window(NIGHT, utc(2024, 5, 7, 12)) == (utc(2024, 5, 7, 22), utc(2024, 5, 8, 7))
+    assert compute_quiet_window({**NIGHT, "quiet_hours_enabled": False}, utc(2024, 5, 7, 3)) is None
+
+def test_weekdays_only_skips_windows_starting_on_the_weekend():
+    weekdays = {**NIGHT, "quiet_hours_weekdays_only": True}
+    # Friday night's window starts on a weekday, so it still runs into Saturday morning.
+    assert compute_quiet_window(weekdays, utc(2024, 5, 11, 3)) == (utc(2024, 5, 10, 22), utc(2024, 5, 11, 7))
+    # Saturday and Sunday nights are skipped; the next window is Monday night.
+    assert compute_quiet_window(weekdays, utc(2024, 5, 11, 23)) == (utc(2024, 5, 13, 22), utc(2024, 5, 14, 7))
+
+def test_window_is_localised_across_a_dst_change():
+    new_york = {**NIGHT, "timezone": "America/New_York"}
+    # Clocks go forward at 02:00 on 2024-03-10: the window starts at 22:00 EST and ends at 07:00 EDT, 8 hours later.
+    assert compute_quiet_window(new_york, utc(2024, 3, 10, 4)) == (utc(2024, 3, 10, 3), utc(2024, 3, 10, 11))
+    assert compute_quiet_window({**new_york, "timezone": "Not/AZone"}, utc(2024, 3, 10, 4)) == (utc(2024, 3, 9, 22), utc(2024, 3, 10, 7))
+
+async def test_notifications_in_quiet_hours_fold_into_one_digest_due_at_the_window_end(service, fake_redis):
+    assert await service._send_notification_to_user(USER_ID, "messages", message()) == PUSH_DEFERRED
+    assert await due_at(fake_redis) == utc(2024, 5, 7, 7).timestamp()
+    await fake_redis.zadd(DEFERRED_DUE_KEY, {str(USER_ID): utc(2024, 5, 7, 9).timestamp()}, xx=True) # Pretend a later end was recorded...
+    await service._send_notification_to_user(USER_ID, "messages", message())
+    assert await due_at(fake_redis) == utc(2024, 5, 7, 9).timestamp() # ...NX keeps the first due time.
+    assert await fake_redis.hget(f"{DEFERRED_DIGEST_PREFIX}{USER_ID}", "count:messages") == "2"
+    assert service.pushed == []
+
+async def test_digest_scheduled_at_the_window_end_is_sent_exactly_once(service, fake_redis, clock):
+    for _ in range(3): await service._send_notification_to_user(USER_ID, "messages", message())
+    await service._send_notification_to_user(USER_ID, "mood_updates", message("Sam is feeling happy"))
+    clock.now = utc(2024, 5, 7, 6, 59)
+    assert await service.dispatch_due_digests() == utc(2024, 5, 7, 7).timestamp()
+    assert service.pushed == []
+    clock.now = utc(2024, 5, 7, 7)
+    assert await service.dispatch_due_digests() is None
+    assert await service.dispatch_due_digests() is None
+    (user_id, payload), = service.pushed
+    assert user_id == USER_ID and payload["options"]["body"] == "3 new messages, 1 mood update"
+    assert not await fake_redis.exists(f"{DEFERRED_DIGEST_PREFIX}{USER_ID}")
+
+async def test_only_the_instance_that_claims_the_entry_sends(service, fake_redis, clock):
+    await service._send_notification_to_user(USER_ID, "messages", message())
+    clock.now = utc(2024, 5, 7, 7)
+    other = NotificationService()
+    other.vapid_private_key, other.vapid_admin_email, other._deliver_push = service.vapid_private_key, service.vapid_admin_email, service._deliver_push
+    await asyncio.gather(service.dispatch_due_digests(), other.dispatch_due_digests())
+    assert len(service.pushed) == 1
+    assert service.pushed[0][1]["title"] == "New message from Sam" # A single held notification keeps its own title.
+
+async def test_digest_due_inside_a_window_is_deferred_again(service, fake_redis, user_settings):
+    await service._send_notification_to_user(USER_ID, "messages", message())
+    await service.reschedule_deferred(USER_ID) # e.g. the user saved settings; due now, but still in quiet hours.
+    assert await service.dispatch_due_digests() == utc(2024, 5, 7, 7).timestamp()
+    assert service.pushed == []
+    assert await fake_redis.exists(f"{DEFERRED_DIGEST_PREFIX}{USER_ID}")
+
+async def test_dnd_holds_the_digest_until_it_is_switched_off(service, fake_redis, user_settings, clock):
+    user_settings.update(is_dnd_enabled=True, quiet_hours_enabled=False)
+    assert await service._send_notification_to_user(USER_ID, "messages", message()) == PUSH_DEFERRED
+    assert await due_at(fake_redis) is None # No known end time, so nothing is scheduled.
+    await service.reschedule_deferred(USER_ID)
+    await service.dispatch_due_digests()
+    assert service.pushed == [] and await fake_redis.exists(f"{DEFERRED_DIGEST_PREFIX}{USER_ID}")
+    user_settings["is_dnd_enabled"] = False
+    await service.reschedule_deferred(USER_ID)
+    assert await service.dispatch_due_digests() is None
+    assert len(service.pushed) == 1
+    assert await service._send_notification_to_user(USER_ID, "messages", message()) == PUSH_SENT
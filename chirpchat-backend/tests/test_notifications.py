@@ -0,0 +1,91 @@
+import asyncio
+import gc
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.auth.dependencies import get_current_user
+from app.auth.schemas import UserPublic
+from app.config import settings
+from app.notifications import routes as notification_routes
+from app.notifications.service import NotificationService
+from app.websocket import manager as ws_manager
+
+SENDER = UserPublic(id=uuid.uuid4(), display_name="Sam")
+RECIPIENT_ID = uuid.uuid4()
+CHAT_ID = uuid.uuid4()
+
+@pytest.fixture
+def service(fake_db, fake_redis, monkeypatch):
+    """A configured service whose pushes are recorded instead of sent, with a 1 s collapse window."""
+    monkeypatch.setattr(settings, "PUSH_COLLAPSE_WINDOW_SECONDS", 1)
+    service = NotificationService()
+    service.vapid_private_key, service.vapid_admin_email = "key", "admin@example.com"
+    service.pushed = []
+    async def deliver_push(user_id, payload): service.pushed.append((user_id, payload["options"]["body"]))
+    service._deliver_push = deliver_push
+    fake_db.on("chat_participants", *[[{"user_id": str(RECIPIENT_ID)}]] * 10)
+    return service
+
+def notification_settings(fake_db, **overrides):
+    fake_db.on("user_notification_settings", *[{"messages": True, **overrides}] * 10)
+
+async def go_live(redis, user_id):
+    await redis.hset(ws_manager.USER_CONNECTIONS_KEY, str(user_id), "instance-1")
+    await redis.set(f"{ws_manager.CLIENT_ACTIVE_PREFIX}{user_id}", "1")
+
+async def send(service, count: int):
+    for i in range(count):
+        await service._route_message_push(SENDER, CHAT_ID, service._build_message_payload(SENDER, CHAT_ID, f"message {i}"), 1)
+
+async def test_messages_in_the_window_collapse_into_one_trailing_push(service, fake_db):
+    notification_settings(fake_db)
+    await send(service, 3)
+    await asyncio.sleep(1.1)
+    assert [body for _, body in service.pushed] == ["message 0", "3 new messages"] # Replaces the first notification on the device.
+    assert await service.get_push_stats() == {"sent": 2, "deferred": 0, "suppressed_online": 0, "collapsed": 2, "pushes_avoided": 2}
+
+async def test_trailing_push_is_dropped_when_the_recipient_came_online(service, fake_db, fake_redis):
+    notification_settings(fake_db)
+    await send(service, 3)
+    await go_live(fake_redis, RECIPIENT_ID)
+    await asyncio.sleep(1.1)
+    assert [body for _, body in service.pushed] == ["message 0"]
+    assert (await service.get_push_stats())["suppressed_online"] == 2
+
+async def test_pushes_held_by_dnd_count_as_deferred_not_sent(service, fake_db):
+    notification_settings(fake_db, is_dnd_enabled=True)
+    await send(service, 2)
+    await asyncio.sleep(1.1)
+    assert service.pushed == []
+    stats = await service.get_push_stats()
+    assert (stats["sent"], stats["deferred"]) == (0, 2)
+
+async def test_flush_tasks_are_referenced_until_done(service, fake_db):
+    notification_settings(fake_db)
+    await send(service, 2)
+    assert len(service._flush_tasks) == 1
+    gc.collect() # An unreferenced task could be collected here and its trailing push lost.
+    await asyncio.sleep(1.1)
+    assert service._flush_tasks == set()
+    assert len(service.pushed) == 2
+
+async def test_trailing_count_includes_a_batch_that_opened_the_window(service, fake_db):
+    notification_settings(fake_db)
+    await service._route_message_push(SENDER, CHAT_ID, service._build_message_payload(SENDER, CHAT_ID, "2 new messages"), 2)
+    await send(service, 1)
+    await asyncio.sleep(1.1)
+    assert [body for _, body in service.pushed] == ["2 new messages", "3 new messages"]
+    assert (await service.get_push_stats())["collapsed"] == 1
+
+def test_push_stats_are_admin_only(fake_redis, monkeypatch):
+    admin, member = UserPublic(id=uuid.uuid4(), display_name="Ops"), UserPublic(id=uuid.uuid4(), display_name="Sam")
+    monkeypatch.setattr(settings, "ADMIN_USER_IDS", str(admin.id))
+    app = FastAPI()
+    app.include_router(notification_routes.router)
+    client = TestClient(app)
+    for user, expected in [(member, 403), (admin, 200)]:
+        app.dependency_overrides[get_current_user] = lambda user=user: user
+        assert client.get("/notifications/push-stats").status_code == expected
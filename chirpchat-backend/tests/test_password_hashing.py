@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+import pytest
+from passlib.hash import bcrypt
+
+from app.utils import security
+
+# Verification runs at the cost stored in the hash, whatever BCRYPT_ROUNDS the tests use. Cost 8 keeps the
+# suite quick; each step up doubles the work, so the default cost 12 is 16x slower per login.
+STORED_ROUNDS = 8
+CONCURRENT_LOGINS = 50
+TICK_SECONDS = 0.005
+
+@pytest.fixture(scope="module")
+def stored_hash() -> str:
+    return bcrypt.using(rounds=STORED_ROUNDS).hash("correct horse")
+
+async def max_loop_lag(work) -> float:
+    """Runs work() while a ticker measures how late the event loop wakes it; returns the worst delay in seconds."""
+    lag, done = 0.0, asyncio.Event()
+    async def ticker():
+        nonlocal lag
+        while not done.is_set():
+            expected = time.perf_counter() + TICK_SECONDS
+            await asyncio.sleep(TICK_SECONDS)
+            lag = max(lag, time.perf_counter() - expected)
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    try:
+        await work()
+    finally:
+        done.set()
+        await ticker_task
+    return lag
+
+async def pooled_logins(stored_hash: str):
+    results = await asyncio.gather(*[security.verify_password_and_update("correct horse", stored_hash) for _ in range(CONCURRENT_LOGINS)])
+    assert all(valid for valid, _ in results)
+
+async def inline_logins(stored_hash: str, count: int = CONCURRENT_LOGINS):
+    """How the handlers verified before: bcrypt called directly inside each coroutine."""
+    async def login():
+        assert security.pwd_context.verify("correct horse", stored_hash)
+    await asyncio.gather(*[login() for _ in range(count)])
+
+async def test_logins_do_not_stall_the_event_loop(stored_hash):
+    started = time.perf_counter()
+    security.pwd_context.verify("correct horse", stored_hash)
+    one_verify = time.perf_counter() - started
+    # Inline, every verification blocks the loop for its whole duration; pooled, 50 of them together block it for less than one.
+    assert await max_loop_lag(lambda: pooled_logins(stored_hash)) < one_verify
+
+async def test_configured_cost_is_used_and_other_costs_are_upgraded(stored_hash):
+    valid, new_hash = await security.verify_password_and_update("correct horse", stored_hash)
+    assert valid and new_hash and bcrypt.from_string(new_hash).rounds == security.settings.BCRYPT_ROUNDS
+
+@pytest.mark.benchmark(group="login-loop-lag")
+@pytest.mark.parametrize("mode", ["pooled", "inline"])
+def test_benchmark_50_concurrent_logins(benchmark, stored_hash, mode):
+    """Wall time of 50 concurrent logins; the worst event-loop delay seen is reported in extra_info."""
+    work = pooled_logins if mode == "pooled" else inline_logins
+    lags = []
+    def run():
+        lags.append(asyncio.run(max_loop_lag(lambda: work(stored_hash))))
+    benchmark.pedantic(run, rounds=3, iterations=1)
+    benchmark.extra_info["max_loop_lag_ms"] = round(max(lags) * 1000, 1)
@@ -0,0 +1,83 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import orjson
+import pytest
+from fastapi import HTTPException
+
+from app.chat import routes
+from app.chat.schemas import MessageCreate
+
+CHAT_ID, OTHER_CHAT_ID = uuid.uuid4(), uuid.uuid4()
+BASE = datetime(2024, 5, 1, tzinfo=timezone.utc)
+
+def message_row(i: int, chat_id=CHAT_ID, reply_to=None) -> dict:
+    created_at = (BASE + timedelta(seconds=i)).isoformat()
+    return {
+        "id": str(uuid.uuid4()), "chat_id": str(chat_id), "user_id": str(uuid.uuid4()), "text": f"message {i} " * 20,
+        "media_type": None, "media_url": None, "thumbnail_url": None, "stickers": None, "mode": "normal", "status": "sent_to_server",
+        "reactions": {}, "reply_to_message_id": reply_to, "created_at": created_at, "updated_at": created_at,
+    }
+
+@pytest.fixture
+def membership(monkeypatch):
+    state = {"cleared_at": None}
+    async def get_chat_membership(user_id, chat_id): return state
+    monkeypatch.setattr(routes.ws_manager, "get_chat_membership", get_chat_membership)
+    return state
+
+async def test_off_page_previews_are_fetched_from_the_same_chat_only(fake_db):
+    quoted = message_row(0)
+    fake_db.on("messages", [quoted])
+    rows = await routes.attach_reply_previews([message_row(1, reply_to=quoted["id"])], CHAT_ID, BASE.isoformat())
+    query = fake_db.queries_for("messages")[0]
+    assert ("chat_id", str(CHAT_ID)) in query.called("eq")
+    assert query.called("gt") == [("created_at", BASE.isoformat())]
+    assert rows[0]["reply_preview"]["id"] == quoted["id"]
+    assert len(rows[0]["reply_preview"]["text"]) == routes.REPLY_PREVIEW_TEXT_LENGTH
+
+async def test_in_page_previews_need_no_query(fake_db):
+    quoted = message_row(0)
+    await routes.attach_reply_previews([quoted, message_row(1, reply_to=quoted["id"])], CHAT_ID)
+    assert fake_db.queries == []
+
+async def test_reply_targets_in_other_chats_or_before_clear_are_invalid(fake_db):
+    own, foreign, cleared = message_row(10), message_row(11, chat_id=OTHER_CHAT_ID), message_row(1)
+    fake_db.on("messages", [own, foreign, cleared])
+    missing = uuid.uuid4()
+    invalid = await routes.find_invalid_reply_targets(CHAT_ID, [own["id"], foreign["id"], cleared["id"], missing], (BASE + timedelta(seconds=5)).isoformat())
+    assert invalid == {foreign["id"], cleared["id"]}
+
+async def test_send_rejects_a_reply_to_another_chat(fake_db, membership, monkeypatch):
+    foreign = message_row(0, chat_id=OTHER_CHAT_ID)
+    fake_db.on("messages", [foreign])
+    async def not_processed(client_temp_id): return False
+    monkeypatch.setattr(routes.ws_manager, "is_message_processed", not_processed)
+    with pytest.raises(HTTPException) as error:
+        await routes.send_message_http(CHAT_ID, MessageCreate(text="hi", client_temp_id="t1", reply_to_message_id=foreign["id"]), SimpleNamespace(id=uuid.uuid4()))
+    assert error.value.status_code == 400
+    assert [q.called("insert") for q in fake_db.queries_for("messages")] == [[]], "nothing may be inserted"
+
+@pytest.mark.benchmark(group="reply-previews")
+def test_benchmark_page_of_50_replies(benchmark, fake_db, membership):
+    """GET /chats/{id}/messages for 50 replies whose quoted messages are all on earlier pages, with a 2 ms DB round trip."""
+    fake_db.latency = 0.002
+    quoted = [message_row(i) for i in range(50)]
+    page = [message_row(100 + i, reply_to=quoted[i]["id"]) for i in range(50)]
+    user = SimpleNamespace(id=uuid.uuid4())
+    loop = asyncio.new_event_loop()
+
+    def load_page():
+        fake_db.on("messages", lambda q: [dict(row) for row in reversed(page)], quoted)
+        return loop.run_until_complete(routes.get_messages(CHAT_ID, 50, None, user))
+
+    try:
+        benchmark(load_page)
+        fake_db.queries.clear()
+        response = load_page()
+    finally:
+        loop.close()
+    assert len(fake_db.queries) == 2, "one page query plus one batched preview query"
+    assert all(m["reply_preview"] for m in orjson.loads(response.body)["messages"])
@@ -0,0 +1,71 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from app.auth.dependencies import get_current_admin_user
+from app.config import settings
+from app.media import signed_urls
+from app.routers import media
+
+CHAT_ID = str(uuid.uuid4())
+CREATED_AT = "2024-05-01T12:00:00+00:00"
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    signed_url_cache = signed_urls.signed_url_cache
+    signed_url_cache._entries.clear()
+    yield signed_url_cache
+
+@pytest.fixture
+def membership(monkeypatch):
+    state = {"membership": {"cleared_at": None}}
+    async def get_chat_membership(user_id, chat_id): return state["membership"]
+    monkeypatch.setattr(signed_urls.ws_manager, "get_chat_membership", get_chat_membership)
+    return state
+
+def cache_url(message_id, user_id) -> str:
+    url = f"https://res.example.com/private/{message_id}"
+    signed_urls.cache_signed_url(message_id, "original", user_id, url, int(datetime.now(timezone.utc).timestamp()) + 600, CHAT_ID, CREATED_AT)
+    return url
+
+async def test_hit_is_served_while_still_allowed(fake_redis, membership):
+    message_id, user_id = uuid.uuid4(), uuid.uuid4()
+    url = cache_url(message_id, user_id)
+    assert (await signed_urls.get_cached_signed_urls(user_id, [(message_id, "original")]))[0][0] == url
+
+async def test_deleted_message_is_not_served_from_cache(fake_redis, membership):
+    message_id, user_id = uuid.uuid4(), uuid.uuid4()
+    cache_url(message_id, user_id)
+    await signed_urls.revoke_signed_urls(message_id)
+    assert await signed_urls.get_cached_signed_urls(user_id, [(message_id, "original")]) == [None]
+    assert signed_urls.signed_url_cache.stats()["size"] == 0
+
+async def test_cleared_history_is_not_served_from_cache(fake_redis, membership):
+    message_id, user_id = uuid.uuid4(), uuid.uuid4()
+    cache_url(message_id, user_id)
+    membership["membership"] = {"cleared_at": (datetime.fromisoformat(CREATED_AT) + timedelta(microseconds=1)).isoformat()}
+    assert await signed_urls.get_cached_signed_urls(user_id, [(message_id, "original")]) == [None]
+
+async def test_former_participant_is_not_served_from_cache(fake_redis, membership):
+    message_id, user_id = uuid.uuid4(), uuid.uuid4()
+    cache_url(message_id, user_id)
+    membership["membership"] = None
+    assert await signed_urls.get_cached_signed_urls(user_id, [(message_id, "original")]) == [None]
+
+async def test_batch_miss_path_rejects_media_behind_cleared_at(fake_db, fake_redis, membership):
+    message_id, user_id = uuid.uuid4(), uuid.uuid4()
+    fake_db.on("messages", [{"id": str(message_id), "chat_id": CHAT_ID, "file_metadata": {"public_id": "p", "urls": {"original": "u"}}, "created_at": CREATED_AT}])
+    fake_db.on("chat_participants", [{"chat_id": CHAT_ID, "cleared_at": "2024-05-02T00:00:00+00:00"}])
+    batch = media.SignedUrlBatchRequest(items=[media.SignedUrlRequestItem(message_id=message_id)])
+    response = await media.get_signed_media_urls(batch, SimpleNamespace(id=user_id))
+    assert response.urls[0].url is None and response.urls[0].error == "You are not authorized to view this media."
+
+async def test_cache_stats_are_admin_only(monkeypatch):
+    admin, user = SimpleNamespace(id=uuid.uuid4()), SimpleNamespace(id=uuid.uuid4())
+    monkeypatch.setattr(settings, "ADMIN_USER_IDS", f"{uuid.uuid4()}, {admin.id}")
+    assert await get_current_admin_user(admin) is admin
+    with pytest.raises(media.HTTPException) as error:
+        await get_current_admin_user(user)
+    assert error.value.status_code == 403
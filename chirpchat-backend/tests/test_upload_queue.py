@@ -0,0 +1,172 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.auth.dependencies import get_current_user
+from app.auth.schemas import UserPublic
+from app.config import settings
+from app.media import upload_queue
+from app.media.schemas import UploadQueueCreate
+from app.routers import upload_queue as upload_queue_routes
+
+USER_ID = uuid.uuid4()
+MB = 1024 * 1024
+
+class UploadQueueTable:
+    """An in-memory upload_queue that answers the PostgREST queries app.media.upload_queue issues."""
+    VERBS = ("select", "update", "upsert")
+    FILTERS = {
+        "eq": lambda value, arg: value == arg,
+        "neq": lambda value, arg: value != arg,
+        "in_": lambda value, arg: value in arg,
+        "lte": lambda value, arg: value is not None and value <= arg,
+    }
+
+    def __init__(self):
+        self.rows = {}
+
+    def __call__(self, query):
+        # The module reuses one table() builder for several queries, so only the calls since the last verb count.
+        start = max(i for i, (name, _, _) in enumerate(query.calls) if name in self.VERBS)
+        (verb, verb_args, _), calls = query.calls[start], query.calls[start + 1:]
+        if verb == "upsert": return self._upsert(verb_args[0])
+        rows = [row for row in self.rows.values() if all(self.FILTERS[name](row[args[0]], args[1]) for name, args, _ in calls if name in self.FILTERS)]
+        for _, args, kwargs in reversed([call for call in calls if call[0] == "order"]):
+            rows.sort(key=lambda row: row[args[0]], reverse=kwargs.get("desc", False))
+        for name, args, _ in calls:
+            if name == "limit": rows = rows[:args[0]]
+        if verb == "update":
+            for row in rows: row.update(verb_args[0])
+        rows = [dict(row) for row in rows]
+        if any(name == "maybe_single" for name, _, _ in calls): return rows[0] if rows else None
+        return rows
+
+    def _upsert(self, data):
+        if any(row["temp_message_id"] == data["temp_message_id"] for row in self.rows.values()): return []
+        created_at = datetime.now(timezone.utc) - timedelta(minutes=10) + timedelta(milliseconds=len(self.rows))
+        row = {"id": str(uuid.uuid4()), "created_at": created_at.isoformat(), "retry_count": 0, "max_retries": 3, "scheduled_retry": None, "error_message": None, **data}
+        self.rows[row["id"]] = row
+        return [dict(row)]
+
+@pytest.fixture
+def queue(fake_db, fake_redis):
+    table = UploadQueueTable()
+    fake_db.on("upload_queue", *[table] * 200)
+    return table
+
+def make_upload(message_subtype="image", file_size=1024, temp_message_id=None) -> UploadQueueCreate:
+    return UploadQueueCreate(chat_id=uuid.uuid4(), temp_message_id=temp_message_id or uuid.uuid4(), file_name="file", file_type="image/jpeg", file_size=file_size, message_subtype=message_subtype)
+
+async def enqueue(message_subtype="image", file_size=1024, user_id=USER_ID):
+    return await upload_queue.enqueue_upload(user_id, make_upload(message_subtype, file_size))
+
+def schedule_retry(queue, item, seconds_from_now: float):
+    queue.rows[item["id"]].update(status="failed", scheduled_retry=(datetime.now(timezone.utc) + timedelta(seconds=seconds_from_now)).isoformat())
+
+async def test_a_voice_note_is_claimed_before_a_large_video_enqueued_earlier(queue):
+    video = await enqueue("clip", 200 * MB)
+    voice_note = await enqueue("voice_message", 40 * 1024)
+
+    assert [item["id"] for item in await upload_queue.claim_uploads(USER_ID, 1)] == [voice_note["id"]]
+    assert [item["id"] for item in await upload_queue.claim_uploads(USER_ID, 1)] == [video["id"]]
+    assert await upload_queue.claim_uploads(USER_ID, 1) == []
+
+async def test_claim_merges_due_retries_into_the_priority_order(queue):
+    clip = await enqueue("clip")
+    image = await enqueue("image")
+    due_voice_note = await enqueue("voice_message")
+    later_voice_note = await enqueue("voice_message")
+    schedule_retry(queue, due_voice_note, -1)
+    schedule_retry(queue, later_voice_note, 60)
+
+    claimed = await upload_queue.claim_uploads(USER_ID, 2)
+    assert [item["id"] for item in claimed] == [due_voice_note["id"], image["id"]]
+    assert all(item["status"] == "uploading" and item["scheduled_retry"] is None for item in claimed)
+    assert [item["id"] for item in await upload_queue.claim_uploads(USER_ID, 5)] == [clip["id"]] # The later retry isn't due yet.
+
+async def test_claim_only_returns_the_users_own_items(queue):
+    await enqueue("voice_message", user_id=uuid.uuid4())
+    mine = await enqueue("clip")
+    assert [item["id"] for item in await upload_queue.claim_uploads(USER_ID, 5)] == [mine["id"]]
+
+async def test_two_devices_claiming_at_once_never_get_the_same_upload(queue, fake_db):
+    fake_db.latency = 0.01 # Both devices read the same candidates before either claims them.
+    items = [await enqueue() for _ in range(3)]
+    first, second = await asyncio.gather(upload_queue.claim_uploads(USER_ID, 3), upload_queue.claim_uploads(USER_ID, 3))
+    assert sorted(item["id"] for item in first + second) == sorted(item["id"] for item in items)
+
+async def test_failed_uploads_back_off_exponentially_until_max_retries(queue, monkeypatch):
+    monkeypatch.setattr(upload_queue.random, "uniform", lambda low, high: 1.0)
+    item = await enqueue()
+    delays = []
+    for _ in range(4):
+        assert [claimed["id"] for claimed in await upload_queue.claim_uploads(USER_ID, 1)] == [item["id"]]
+        failed = await upload_queue.fail_upload(USER_ID, uuid.UUID(item["id"]), "network error", retryable=True)
+        assert failed["status"] == "failed"
+        if failed["scheduled_retry"] is None: break
+        delays.append((datetime.fromisoformat(failed["scheduled_retry"]) - datetime.now(timezone.utc)).total_seconds())
+        assert await upload_queue.claim_uploads(USER_ID, 1) == [] # Not due yet.
+        schedule_retry(queue, item, -1)
+
+    assert [round(delay) for delay in delays] == [5, 10, 20]
+    assert queue.rows[item["id"]]["retry_count"] == 4
+    assert await upload_queue.claim_uploads(USER_ID, 1) == [] # Out of retries: stays failed.
+
+async def test_a_non_retryable_failure_is_never_rescheduled(queue):
+    item = await enqueue()
+    failed = await upload_queue.fail_upload(USER_ID, uuid.UUID(item["id"]), "unsupported codec", retryable=False)
+    assert failed["retry_count"] == 1 and failed["scheduled_retry"] is None
+
+def test_retry_delay_is_jittered_and_capped():
+    delays = [upload_queue.compute_retry_delay(retry_count) for retry_count in range(20)]
+    assert 0.8 * upload_queue.RETRY_BASE_DELAY_SECONDS <= delays[0] <= 1.2 * upload_queue.RETRY_BASE_DELAY_SECONDS
+    assert max(delays) <= 1.2 * upload_queue.RETRY_MAX_DELAY_SECONDS
+
+async def test_enqueue_does_not_overwrite_an_existing_item(queue):
+    upload = make_upload()
+    item = await upload_queue.enqueue_upload(USER_ID, upload)
+    await upload_queue.complete_upload(USER_ID, uuid.UUID(item["id"]))
+
+    again = await upload_queue.enqueue_upload(USER_ID, upload)
+    assert again["id"] == item["id"] and again["status"] == "completed"
+    assert await upload_queue.enqueue_upload(uuid.uuid4(), upload) is None # Another user's temp_message_id.
+
+async def test_progress_is_only_recorded_for_the_users_active_items(queue, fake_redis):
+    item = await enqueue()
+    item_id = uuid.UUID(item["id"])
+    assert not await upload_queue.record_progress(uuid.uuid4(), item_id, 0.5, 512)
+    assert await upload_queue.record_progress(USER_ID, item_id, 0.5, 512)
+    assert (await fake_redis.hgetall(f"{upload_queue.UPLOAD_PROGRESS_PREFIX}{item_id}"))["bytes_uploaded"] == "512"
+
+    await upload_queue.complete_upload(USER_ID, item_id)
+    assert not await fake_redis.exists(f"{upload_queue.UPLOAD_PROGRESS_PREFIX}{item_id}")
+    assert not await upload_queue.record_progress(USER_ID, item_id, 0.9, 900)
+    assert await upload_queue.fail_upload(USER_ID, item_id, "late failure", retryable=True) is None
+
+async def test_queue_stats_are_scoped_to_the_user(queue):
+    other_user_id = uuid.uuid4()
+    await enqueue()
+    retrying = await enqueue()
+    schedule_retry(queue, retrying, 60)
+    for user_id in (USER_ID, other_user_id, other_user_id):
+        item = await enqueue(user_id=user_id)
+        await upload_queue.complete_upload(user_id, uuid.UUID(item["id"]))
+
+    stats = await upload_queue.get_queue_stats(USER_ID)
+    assert stats["pending"] == 1 and stats["retry_scheduled"] == 1 and stats["completed_total"] == 1
+    assert stats["avg_time_to_ready_seconds"] >= 600
+    assert (await upload_queue.get_global_queue_stats())["completed_total"] == 3
+
+def test_global_queue_stats_are_admin_only(fake_redis, monkeypatch):
+    admin, member = UserPublic(id=uuid.uuid4(), display_name="Ops"), UserPublic(id=uuid.uuid4(), display_name="Sam")
+    monkeypatch.setattr(settings, "ADMIN_USER_IDS", str(admin.id))
+    app = FastAPI()
+    app.include_router(upload_queue_routes.router)
+    client = TestClient(app)
+    for user, expected in [(member, 403), (admin, 200)]:
+        app.dependency_overrides[get_current_user] = lambda user=user: user
+        assert client.get("/uploads/queue/stats/global").status_code == expected
@@ -0,0 +1,49 @@
+import asyncio
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from cloudinary.utils import api_sign_request
+
+from app.config import settings
+from app.routers import uploads
+
+USER = SimpleNamespace(id=uuid.uuid4())
+
+@pytest.fixture(autouse=True)
+def webhook_url(monkeypatch):
+    monkeypatch.setattr(settings, "CLOUDINARY_WEBHOOK_URL", "https://api.example.com/webhooks/cloudinary/media-processed")
+
+def signature_request(count: int) -> uploads.GetUploadSignaturesRequest:
+    return uploads.GetUploadSignaturesRequest(files=[{"public_id": str(uuid.uuid4()), "resource_type": "image" if i % 2 else "video"} for i in range(count)])
+
+def test_signature_covers_every_signed_parameter():
+    signed = uploads.build_upload_signature("abc", "image", "user_media_uploads", USER.id, 1700000000)
+    params = {"timestamp": 1700000000, "public_id": "abc", "folder": signed.folder, "resource_type": "image", "type": "private",
+              "notification_url": signed.notification_url, "upload_preset": signed.upload_preset, "eager": signed.eager}
+    assert signed.signature == api_sign_request(params, settings.CLOUDINARY_API_SECRET)
+
+async def test_batch_shares_one_timestamp_and_marks_one_update(fake_db):
+    response = await uploads.get_cloudinary_upload_signatures(signature_request(20), USER)
+    assert len({s.timestamp for s in response.signatures}) == 1
+    assert len(fake_db.queries_for("upload_queue")) == 1
+
+@pytest.mark.benchmark(group="upload-signatures")
+def test_benchmark_one_signature(benchmark):
+    assert benchmark(uploads.build_upload_signature, "abc", "video", "user_media_uploads", USER.id).signature
+
+@pytest.mark.benchmark(group="upload-signatures")
+def test_benchmark_batch_of_20(benchmark, fake_db):
+    """20 files in one request; the fake DB adds a 2 ms round trip to the upload_queue update."""
+    fake_db.latency = 0.002
+    request = signature_request(20)
+    assert len(benchmark(lambda: asyncio.run(uploads.get_cloudinary_upload_signatures(request, USER))).signatures) == 20
+
+@pytest.mark.benchmark(group="upload-signatures")
+def test_benchmark_20_single_requests(benchmark, fake_db):
+    """The same 20 files signed one request at a time, as clients did before the batch endpoint."""
+    fake_db.latency = 0.002
+    requests = [uploads.GetUploadSignatureRequest(public_id=f.public_id, resource_type=f.resource_type) for f in signature_request(20).files]
+    async def sign_each():
+        return [await uploads.get_cloudinary_upload_signature(request, USER) for request in requests]
+    assert len(benchmark(lambda: asyncio.run(sign_each()))) == 20
@@ -0,0 +1,68 @@
+import asyncio
+import io
+import zipfile
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+from app.utils import security
+
+def png(size: int = 64) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (size, size), (30, 60, 90)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+def zip_archive(*names: str) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name in names: archive.writestr(name, "<xml/>")
+    return buffer.getvalue()
+
+async def chunked(data: bytes, chunk_size: int = security.UPLOAD_CHUNK_SIZE):
+    for i in range(0, len(data), chunk_size): yield data[i:i + chunk_size]
+
+async def test_valid_stream_passes_through_unchanged():
+    data = png() + bytes(200_000) # Trailing bytes stand in for the rest of a large file.
+    assert await security.read_validated_upload(chunked(data, 4096), {"image/png"}, len(data)) == data
+
+async def test_wrong_type_is_rejected_before_anything_is_yielded():
+    stream = security.validate_upload_stream(chunked(b"%PDF-1.4\n" + bytes(10_000)), {"image/png"}, 1 << 20)
+    with pytest.raises(HTTPException) as error:
+        await stream.__anext__()
+    assert error.value.status_code == 400
+
+async def test_oversized_declared_size_is_rejected_without_reading():
+    async def never_read():
+        raise AssertionError("the body must not be read")
+        yield b""
+    with pytest.raises(HTTPException) as error:
+        await security.read_validated_upload(never_read(), {"image/png"}, 1024, declared_size=2048)
+    assert error.value.status_code == 413
+
+async def test_running_size_is_enforced_when_the_declared_size_lies():
+    with pytest.raises(HTTPException) as error:
+        await security.read_validated_upload(chunked(png() + bytes(10_000)), {"image/png"}, 4096, declared_size=100)
+    assert error.value.status_code == 413
+
+def test_zip_is_a_docx_only_with_the_word_main_part():
+    assert security.sniff_content_type(zip_archive("word/document.xml", "word/styles.xml")) == security.DOCX_CONTENT_TYPE
+    assert security.sniff_content_type(zip_archive("payload.exe")) == "application/zip"
+    assert security.sniff_content_type(zip_archive("not-word/document.xml")) == "application/zip"
+
+@pytest.mark.benchmark(group="upload-validation")
+def test_benchmark_sniff(benchmark):
+    head = png()[:security.MAGIC_SNIFF_BYTES]
+    assert benchmark(security.sniff_content_type, head) == "image/png"
+
+@pytest.mark.benchmark(group="upload-validation")
+def test_benchmark_validate_10mb_stream(benchmark):
+    """A maximum-size image arriving in 64 KB chunks, validated and collected."""
+    data = png() + bytes(security.MAX_IMAGE_SIZE - len(png()))
+    chunks = [data[i:i + security.UPLOAD_CHUNK_SIZE] for i in range(0, len(data), security.UPLOAD_CHUNK_SIZE)]
+    async def source():
+        for chunk in chunks: yield chunk
+    async def validated_size():
+        # Only the length is returned: asyncio.run formats the task's result, which is slow for 10 MB of bytes.
+        return len(await security.read_validated_upload(source(), security.ALLOWED_IMAGE_TYPES, security.MAX_IMAGE_SIZE))
+    assert benchmark(lambda: asyncio.run(validated_size())) == len(data)
@@ -0,0 +1,71 @@
+import base64
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from pywebpush import webpush
+
+from app.notifications import service as notification_service_module
+from app.notifications.service import NotificationService
+
+def b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+VAPID_PRIVATE_KEY = b64url(ec.generate_private_key(ec.SECP256R1()).private_numbers().private_value.to_bytes(32, "big"))
+RECEIVER_PUBLIC_KEY = b64url(ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint))
+PAYLOAD = json.dumps({"type": "message", "title": "New message from Sam", "options": {"body": "hi", "tag": "conversation-1"}})
+
+def subscription(endpoint: str) -> dict:
+    return {"endpoint": endpoint, "p256dh_key": RECEIVER_PUBLIC_KEY, "auth_key": b64url(os.urandom(16))}
+
+class FakePushSession:
+    """Answers every push with 201 Created and records the request headers."""
+    def __init__(self):
+        self.headers = []
+
+    def post(self, endpoint, data=None, headers=None, timeout=None):
+        self.headers.append((endpoint, headers))
+        return SimpleNamespace(status_code=201, reason="Created", text="")
+
+@pytest.fixture
+def service():
+    notification_service_module.vapid_header_cache._entries.clear()
+    service = NotificationService()
+    service.vapid_private_key, service.vapid_admin_email = VAPID_PRIVATE_KEY, "mailto:admin@example.com"
+    service._push_session = FakePushSession()
+    return service
+
+def jwt_claims(authorization: str) -> dict:
+    token = authorization.split(" ", 1)[1].split(",")[0].removeprefix("t=")
+    payload = token.split(".")[1]
+    return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+
+def test_vapid_header_is_signed_once_per_push_service_origin(service):
+    service._send_web_push(subscription("https://fcm.googleapis.com/fcm/send/a"), PAYLOAD)
+    service._send_web_push(subscription("https://fcm.googleapis.com/fcm/send/b"), PAYLOAD)
+    service._send_web_push(subscription("https://updates.push.services.mozilla.com/wpush/v2/c"), PAYLOAD)
+    authorizations = [headers["Authorization"] for _, headers in service._push_session.headers]
+    assert authorizations[0] == authorizations[1] != authorizations[2]
+    assert jwt_claims(authorizations[0])["aud"] == "https://fcm.googleapis.com"
+    assert jwt_claims(authorizations[2])["aud"] == "https://updates.push.services.mozilla.com"
+
+def test_cached_header_is_not_shared_between_sends(service):
+    """WebPusher.send adds per-message headers (ttl, content-encoding) to the dict it is given."""
+    service._send_web_push(subscription("https://fcm.googleapis.com/fcm/send/a"), PAYLOAD)
+    assert set(notification_service_module.vapid_header_cache.get("https://fcm.googleapis.com")) == {"Authorization"}
+
+@pytest.mark.benchmark(group="web-push")
+def test_benchmark_send_with_cached_vapid_header(benchmark, service):
+    sub = subscription("https://fcm.googleapis.com/fcm/send/a")
+    benchmark(service._send_web_push, sub, PAYLOAD)
+
+@pytest.mark.benchmark(group="web-push")
+def test_benchmark_pywebpush_webpush_per_call(benchmark):
+    """What each send cost before: webpush() parses the key and signs a new JWT every time."""
+    sub = subscription("https://fcm.googleapis.com/fcm/send/a")
+    sub_info = {"endpoint": sub["endpoint"], "keys": {"p256dh": sub["p256dh_key"], "auth": sub["auth_key"]}}
+    session = FakePushSession()
+    benchmark(webpush, sub_info, PAYLOAD, vapid_private_key=VAPID_PRIVATE_KEY, vapid_claims={"sub": "mailto:admin@example.com"}, requests_session=session)
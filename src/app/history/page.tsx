@@ -10,6 +10,7 @@ import SettingsHeader from '@/components/settings/SettingsHeader';
 import { Card, CardContent } from '@/components/ui/card';
 import { Avatar, AvatarImage, AvatarFallback } from '@/components/ui/avatar';
 import { ScrollArea } from '@/components/ui/scroll-area';
+import { Button } from '@/components/ui/button';
 import { formatDistanceToNow, parseISO } from 'date-fns';
 import { Heart, Smile, User as UserIcon } from 'lucide-react';
 import { MOOD_OPTIONS } from '@/config/moods';
@@ -46,6 +47,8 @@ export default function HistoryPage() {
     const [history, setHistory] = useState<ActivityHistoryEvent[]>([]);
     const [partner, setPartner] = useState<User | null>(null);
     const [isLoading, setIsLoading] = useState(true);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+    const [isLoadingMore, setIsLoadingMore] = useState(false);
 
     useEffect(() => {
         if (!currentUser) return;
@@ -53,11 +56,12 @@ export default function HistoryPage() {
         const fetchData = async () => {
             setIsLoading(true);
             try {
-                const [historyData, partnerData] = await Promise.all([
-                    api.getActivityHistory(),
+                const [historyPage, partnerData] = await Promise.all([
+                    api.getActivityTimeline(),
                     currentUser.partner_id ? api.getUserProfile(currentUser.partner_id) : Promise.resolve(null)
                 ]);
-                setHistory(historyData);
+                setHistory(historyPage.events);
+                setNextCursor(historyPage.next_cursor);
                 setPartner(partnerData);
             } catch (error) {
                 console.error("Failed to fetch history data:", error);
@@ -69,6 +73,20 @@ export default function HistoryPage() {
         fetchData();
     }, [currentUser]);
 
+    const loadMore = async () => {
+        if (!nextCursor) return;
+        setIsLoadingMore(true);
+        try {
+            const historyPage = await api.getActivityTimeline(nextCursor);
+            setHistory(prev => [...prev, ...historyPage.events]);
+            setNextCursor(historyPage.next_cursor);
+        } catch (error) {
+            console.error("Failed to fetch more history:", error);
+        } finally {
+            setIsLoadingMore(false);
+        }
+    };
+
     if (isAuthLoading || isLoading) {
         return <FullPageLoader />;
     }
@@ -100,6 +118,13 @@ export default function HistoryPage() {
                                     ))}
                                 </ul>
                             )}
+                            {nextCursor && (
+                                <div className="flex justify-center pt-4">
+                                    <Button variant="outline" onClick={loadMore} disabled={isLoadingMore}>
+                                        {isLoadingMore ? 'Loading...' : 'Load more'}
+                                    </Button>
+                                </div>
+                            )}
                         </CardContent>
                     </Card>
                 </main>
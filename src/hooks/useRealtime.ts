@@ -6,7 +6,7 @@ import { useState, useEffect, useCallback } from 'react';
 import { useAuth } from '@/contexts/AuthContext';
 import { useToast } from './use-toast';
 import { realtimeService, type RealtimeProtocol } from '@/services/realtimeService';
-import type { Message, MessageAckEventData, UserPresenceUpdateEventData, TypingIndicatorEventData, ThinkingOfYouReceivedEventData, NewMessageEventData, MessageReactionUpdateEventData, UserProfileUpdateEventData, EventPayload, ChatModeChangedEventData, MessageDeletedEventData, ChatHistoryClearedEventData, MediaProcessedEventData, MessageStatusUpdateEventData } from '@/types';
+import type { Message, MessageAckEventData, UserPresenceUpdateEventData, TypingIndicatorEventData, ThinkingOfYouReceivedEventData, NewMessageEventData, NewMessageBatchEventData, MessageReactionUpdateEventData, UserProfileUpdateEventData, EventPayload, ChatModeChangedEventData, MessageDeletedEventData, ChatHistoryClearedEventData, MediaProcessedEventData, MessageStatusUpdateEventData } from '@/types';
 
 interface UseRealtimeOptions {
   onMessageReceived: (message: Message) => void;
@@ -43,6 +43,7 @@ export function useRealtime({
         const payload = data as EventPayload;
         switch (payload.event_type) {
           case 'new_message': onMessageReceived((payload as NewMessageEventData).message); break;
+          case 'new_message_batch': (payload as NewMessageBatchEventData).messages.forEach(message => onMessageReceived(message)); break;
           case 'media_processed': onMediaProcessed(payload as MediaProcessedEventData); break;
           case 'message_deleted': onMessageDeleted(payload as MessageDeletedEventData); break;
           case 'message_reaction_update': onReactionUpdate(payload as MessageReactionUpdateEventData); break;
@@ -3,7 +3,7 @@ import type {
   StickerPackResponse, StickerListResponse, PushSubscriptionJSON,
   NotificationSettings, PartnerRequest, EventPayload, VerifyOtpResponse,
   CompleteRegistrationRequest, PasswordChangeRequest, DeleteAccountRequest, FileAnalyticsPayload,
-  MoodAnalyticsPayload, CloudinaryUploadParams, MediaMessagePayload, ActivityHistoryEvent
+  MoodAnalyticsPayload, CloudinaryUploadParams, MediaMessagePayload, ActivityHistoryEvent, ActivityTimelinePage
 } from '@/types';
 import type { MoodOption } from '@/config/moods';
 
@@ -312,6 +312,11 @@ export const api = {
     const response = await fetchWithInterceptor(`${API_BASE_URL}users/me/activity-history`, { headers: getApiHeaders() });
     return handleResponse<ActivityHistoryEvent[]>(response);
   },
+  getActivityTimeline: async (cursor?: string | null): Promise<ActivityTimelinePage> => {
+    const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+    const response = await fetchWithInterceptor(`${API_BASE_URL}users/me/activity-timeline${query}`, { headers: getApiHeaders() });
+    return handleResponse<ActivityTimelinePage>(response);
+  },
 };
 
 export { API_BASE_URL, getApiHeaders };
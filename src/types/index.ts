@@ -25,6 +25,7 @@ export interface User {
   id: string;
   display_name: string;
   avatar_url: string | null;
+  avatar_variants?: Record<string, string> | null; // pixel size ("64" | "128" | "512") -> WebP URL
   mood: Mood;
   phone?: string | null;
   email?: string | null;
@@ -49,6 +50,10 @@ export interface MediaMetadata {
   format: string;
   bytes: number;
   duration_seconds?: number;
+  duration_ms?: number;
+  waveform?: number[]; // Audio peaks scaled 0-255, computed server-side
+  content_hash?: string;
+  blurhash?: string; // Image placeholder, decode client-side while the thumbnail loads
   width?: number;
   height?: number;
   urls: {
@@ -64,6 +69,14 @@ export interface MediaMetadata {
   };
 }
 
+export interface ReplyPreview {
+  id: string;
+  user_id: string;
+  message_subtype?: MessageSubtype | null;
+  text?: string | null;
+  thumbnail_url?: string | null;
+}
+
 export interface Message {
   id: string;
   user_id: string;
@@ -94,6 +107,7 @@ export interface Message {
   audio_format?: string | null;
   transcription?: string | null;
   reply_to_message_id?: string | null;
+  reply_preview?: ReplyPreview | null;
   uploadProgress?: number;
   uploadError?: UploadErrorType;
   file?: File; // Not stored in DB
@@ -121,13 +135,14 @@ export interface VoiceMessageUploadResponse { file_url: string; clip_type: 'audi
 export interface VideoUploadResponse { file_url: string; clip_type: 'video'; thumbnail_url: string | null; duration_seconds: number | null; }
 
 export type NewMessageEventData = { event_type: "new_message"; message: Message; chat_id: string; };
+export type NewMessageBatchEventData = { event_type: "new_message_batch"; messages: Message[]; chat_id: string; };
 export type MediaProcessedEventData = { event_type: "media_processed"; message: Message; };
 export type MessageDeletedEventData = { event_type: "message_deleted"; message_id: string; chat_id: string; };
 export type MessageReactionUpdateEventData = { event_type: "message_reaction_update"; message_id: string; chat_id: string; reactions: Partial<Record<SupportedEmoji, string[]>>; };
 export type UserPresenceUpdateEventData = { event_type: "user_presence_update"; user_id: string; is_online: boolean; last_seen: string | null; mood: Mood; };
 export type TypingIndicatorEventData = { event_type: "typing_indicator"; chat_id: string; user_id: string; is_typing: boolean; };
 export type ThinkingOfYouReceivedEventData = { event_type: "thinking_of_you_received"; sender_id: string; sender_name: string; };
-export type UserProfileUpdateEventData = { event_type: "user_profile_update"; user_id: string; mood?: Mood; display_name?: string; avatar_url?: string; };
+export type UserProfileUpdateEventData = { event_type: "user_profile_update"; user_id: string; mood?: Mood; display_name?: string; avatar_url?: string; avatar_variants?: Record<string, string> | null; };
 export type HeartbeatClientEvent = { event_type: "HEARTBEAT"; };
 export type MessageAckEventData = { event_type: "message_ack"; client_temp_id: string; server_assigned_id: string; status: MessageStatus; timestamp: string; };
 export type ChatModeChangedEventData = { event_type: "chat_mode_changed"; chat_id: string; mode: MessageMode; };
@@ -135,7 +150,7 @@ export type ChatHistoryClearedEventData = { event_type: "chat_history_cleared";
 export interface MessageStatusUpdateEventData { event_type: "message_status_update"; message_id: string; chat_id: string; status: MessageStatus; read_at?: string; }
 
 export type EventPayload = { sequence?: number; } & (
-  | NewMessageEventData | MediaProcessedEventData | MessageDeletedEventData | MessageReactionUpdateEventData | UserPresenceUpdateEventData | TypingIndicatorEventData
+  | NewMessageEventData | NewMessageBatchEventData | MediaProcessedEventData | MessageDeletedEventData | MessageReactionUpdateEventData | UserPresenceUpdateEventData | TypingIndicatorEventData
   | ThinkingOfYouReceivedEventData | UserProfileUpdateEventData | MessageAckEventData | ChatModeChangedEventData | ChatHistoryClearedEventData | MessageStatusUpdateEventData
   | { event_type: "error", detail: string }
 );
@@ -230,3 +245,8 @@ export type ActivityHistoryEvent = {
     | { type: 'ping_sent'; recipient_id: string; }
     | { type: 'ping_received'; sender_id: string; }
 );
+
+export interface ActivityTimelinePage {
+    events: ActivityHistoryEvent[];
+    next_cursor: string | null;
+}